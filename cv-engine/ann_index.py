@@ -0,0 +1,219 @@
+"""
+Approximate nearest-neighbour search for large galleries.
+
+IVFIndex is an inverted-file index with a k-means coarse quantizer, written
+in pure NumPy. Gallery rows are bucketed by their nearest centroid and a
+query only scores the rows in its `nprobe` closest buckets.
+
+Gallery changes (enroll/delete/ID update) reuse the trained centroids and
+the previous bucket of every unchanged row: only added or changed rows are
+assigned to a bucket and removed rows are dropped. The quantizer needs
+retraining when the mean or the largest list size has drifted by more than
+RETRAIN_FACTOR since it was last trained.
+"""
+import numpy as np
+
+# Below this size exact search is both faster and exact
+MIN_INDEX_SIZE = 2048
+RETRAIN_FACTOR = 2.0
+KMEANS_ITERATIONS = 10
+# Rows sampled per centroid when training k-means
+TRAIN_SAMPLES_PER_LIST = 64
+
+
+def _squared_distances(queries, points, point_sq_norms=None):
+    """(len(queries), len(points)) squared Euclidean distances"""
+    if point_sq_norms is None:
+        point_sq_norms = np.einsum('ij,ij->i', points, points)
+    sq_dist = queries @ points.T
+    sq_dist *= -2.0
+    sq_dist += np.einsum('ij,ij->i', queries, queries)[:, None]
+    sq_dist += point_sq_norms[None, :]
+    np.maximum(sq_dist, 0.0, out=sq_dist)
+    return sq_dist
+
+
+def default_nlist(gallery_size):
+    """Roughly 4 * sqrt(N) lists, the usual IVF starting point"""
+    return int(max(1, min(4096, 4 * np.sqrt(gallery_size))))
+
+
+def train_kmeans(vectors, nlist, iterations=KMEANS_ITERATIONS, seed=0):
+    """Lloyd's k-means on a sample of the vectors; returns float32 (nlist, dim) centroids"""
+    rng = np.random.default_rng(seed)
+    sample_size = min(len(vectors), nlist * TRAIN_SAMPLES_PER_LIST)
+    sample = np.asarray(vectors[np.sort(rng.choice(len(vectors), sample_size, replace=False))], dtype=np.float32)
+    centroids = sample[rng.choice(len(sample), nlist, replace=False)].copy()
+
+    for _ in range(iterations):
+        assignment = np.argmin(_squared_distances(sample, centroids), axis=1)
+        counts = np.bincount(assignment, minlength=nlist)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignment, sample)
+        non_empty = counts > 0
+        centroids[non_empty] = sums[non_empty] / counts[non_empty, None]
+        # Re-seed empty lists from random sample rows
+        empty = np.flatnonzero(~non_empty)
+        if len(empty):
+            centroids[empty] = sample[rng.choice(len(sample), len(empty), replace=False)]
+    return centroids
+
+
+class IVFLists:
+    """Bucketed rows of one gallery matrix; never modified once built"""
+
+    def __init__(self, matrix, sq_norms, centroids, rows, offsets):
+        self.matrix = matrix
+        self.sq_norms = sq_norms
+        self.centroids = centroids
+        # Rows of list i are rows[offsets[i]:offsets[i + 1]]
+        self.rows = rows
+        self.offsets = offsets
+
+
+class IVFIndex:
+    """Inverted-file index over the rows of a gallery matrix
+
+    update() builds a new IVFLists and publishes it with one assignment, so a
+    search running concurrently sees either the old gallery or the new one.
+    Rows are matched to the previous update by key so their buckets can be
+    reused; updates must be serialized by the caller.
+    """
+
+    def __init__(self, nlist=None, nprobe=8, min_index_size=MIN_INDEX_SIZE, seed=0):
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.min_index_size = min_index_size
+        self.seed = seed
+        self.centroids = None
+        self.trained_size = 0
+        self.trained_max_list = 0
+        self.lists = None
+        # Rows, keys and buckets of the last assignment, reused by the next update
+        self._matrix = None
+        self._keys = None
+        self._assignment = None
+
+    @property
+    def is_active(self):
+        """False when the gallery is small enough that exact search should be used"""
+        return self.lists is not None
+
+    def needs_training(self, gallery_size):
+        if self.centroids is None:
+            return True
+        ratio = gallery_size / max(1, self.trained_size)
+        if ratio > RETRAIN_FACTOR or ratio < 1.0 / RETRAIN_FACTOR:
+            return True
+        if self.lists is None:
+            return False
+        max_list = int(np.diff(self.lists.offsets).max())
+        return max_list > RETRAIN_FACTOR * max(1, self.trained_max_list)
+
+    def fit(self, matrix):
+        """k-means centroids for the matrix; does not touch the index"""
+        nlist = self.nlist or default_nlist(len(matrix))
+        nlist = min(nlist, len(matrix))
+        return train_kmeans(matrix, nlist, seed=self.seed)
+
+    @staticmethod
+    def assign(matrix, centroids):
+        """Nearest-centroid bucket of every row"""
+        assignment = np.empty(len(matrix), dtype=np.int32)
+        for start in range(0, len(matrix), 16384):
+            chunk = np.asarray(matrix[start:start + 16384], dtype=np.float32)
+            assignment[start:start + len(chunk)] = np.argmin(_squared_distances(chunk, centroids), axis=1)
+        return assignment
+
+    def train(self, matrix):
+        self.set_centroids(self.fit(matrix), matrix)
+
+    def set_centroids(self, centroids, matrix, keys=None, assignment=None):
+        """Install centroids trained on matrix, optionally with the rows' buckets already assigned"""
+        self.centroids = centroids
+        self.trained_size = len(matrix)
+        if assignment is None:
+            assignment = self.assign(matrix, centroids)
+        self.trained_max_list = int(np.bincount(assignment, minlength=len(centroids)).max())
+        self._matrix, self._keys, self._assignment = matrix, None, assignment
+        if keys is not None:
+            self._keys = dict(zip(keys, range(len(keys))))
+
+    def _reusable_rows(self, matrix, keys):
+        """(rows, previous rows) whose key and vector are unchanged since the last assignment"""
+        if keys is None or self._keys is None:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+        previous = np.fromiter((self._keys.get(key, -1) for key in keys), dtype=np.int64, count=len(keys))
+        rows = np.flatnonzero(previous >= 0)
+        unchanged = np.all(self._matrix[previous[rows]] == matrix[rows], axis=1)
+        return rows[unchanged], previous[rows[unchanged]]
+
+    def update(self, matrix, sq_norms=None, keys=None, train=True):
+        """Point the index at a new gallery matrix
+
+        Args:
+            keys: one hashable per row (e.g. student ID) so unchanged rows keep their bucket
+            train: (re)train first when needs_training(); with False an untrained
+                index returns None and a drifted one keeps its centroids
+
+        Returns:
+            IVFLists: the published lists, or None when the gallery is too small to index
+        """
+        if len(matrix) < self.min_index_size:
+            self.lists = None
+            return None
+        if train and self.needs_training(len(matrix)):
+            self.train(matrix)
+        if self.centroids is None:
+            self.lists = None
+            return None
+        centroids = self.centroids
+        if sq_norms is None:
+            sq_norms = np.einsum('ij,ij->i', matrix, matrix)
+
+        assignment = np.empty(len(matrix), dtype=np.int32)
+        reused, previous = self._reusable_rows(matrix, keys)
+        assignment[reused] = self._assignment[previous]
+        changed = np.ones(len(matrix), dtype=bool)
+        changed[reused] = False
+        changed = np.flatnonzero(changed)
+        if len(changed):
+            assignment[changed] = self.assign(matrix[changed], centroids)
+
+        self._matrix, self._assignment = matrix, assignment
+        self._keys = dict(zip(keys, range(len(keys)))) if keys is not None else None
+        rows = np.argsort(assignment, kind='stable').astype(np.int64)
+        counts = np.bincount(assignment, minlength=len(centroids))
+        self.lists = IVFLists(matrix, sq_norms, centroids, rows, np.concatenate(([0], np.cumsum(counts))))
+        return self.lists
+
+    def search(self, queries, k=1, nprobe=None, lists=None):
+        """Approximate top-k rows per query
+
+        Args:
+            lists: IVFLists to search (the latest published ones by default)
+
+        Returns:
+            tuple: (rows, distances) lists with one closest-first array per query
+        """
+        lists = lists or self.lists
+        queries = np.asarray(queries, dtype=np.float32).reshape(-1, lists.matrix.shape[1])
+        nprobe = min(nprobe or self.nprobe, len(lists.centroids))
+        probe = np.argpartition(_squared_distances(queries, lists.centroids), nprobe - 1, axis=1)[:, :nprobe]
+
+        all_rows, all_distances = [], []
+        for query, probed in zip(queries, probe):
+            candidates = np.concatenate([lists.rows[lists.offsets[i]:lists.offsets[i + 1]] for i in probed])
+            if len(candidates) == 0:
+                all_rows.append(np.empty(0, dtype=np.int64))
+                all_distances.append(np.empty(0, dtype=np.float32))
+                continue
+            distances = np.sqrt(_squared_distances(
+                query[None, :], np.asarray(lists.matrix[candidates], dtype=np.float32), lists.sq_norms[candidates]
+            )[0])
+            top_k = min(k, len(candidates))
+            top = np.argpartition(distances, top_k - 1)[:top_k]
+            top = top[np.argsort(distances[top])]
+            all_rows.append(candidates[top])
+            all_distances.append(distances[top])
+        return all_rows, all_distances
@@ -0,0 +1,155 @@
+"""
+ASGI entry point for the CV engine, serving the same routes as server.py.
+
+    uvicorn asgi:app --host 0.0.0.0 --port 5001     (or: python run.py --asgi)
+
+The live MJPEG feeds (/api/attendance/live[/<source>]) are served natively
+with async generators: a viewer waiting for its next frame is an idle
+coroutine rather than a blocked thread, so many open streams cost almost
+nothing and cannot starve the other routes. Every other route is the Flask
+view itself, run through a2wsgi on a pool of CV_ASGI_WORKERS threads, so
+decoding, detection, encoding and matching never run on the event loop.
+Request bodies are received by the event loop and handed to the view in
+memory.
+
+Backpressure: at most CV_ASGI_MAX_INFLIGHT requests are running or queued
+for a worker, and at most CV_ASGI_MAX_STREAMS live feeds are open. Beyond
+that the engine answers 503 with Retry-After at once instead of queueing
+without bound.
+"""
+import contextlib
+import os
+import sys
+
+if __name__ == '__main__':
+    # See server.py: detection pool workers must not re-run a script that imports the engine
+    os.execv(sys.executable, [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'run.py'), '--asgi'])
+
+from a2wsgi import WSGIMiddleware
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Route
+
+import server
+from metrics import REGISTRY
+
+logger = server.logger
+
+ASGI_WORKERS = int(os.environ.get('CV_ASGI_WORKERS', max(4, os.cpu_count() or 1)))
+ASGI_MAX_INFLIGHT = int(os.environ.get('CV_ASGI_MAX_INFLIGHT', ASGI_WORKERS * 4))
+ASGI_MAX_STREAMS = int(os.environ.get('CV_ASGI_MAX_STREAMS', 256))
+LIVE_FEED_PATH = '/api/attendance/live'
+
+REJECTED = REGISTRY.counter('cv_rejected_requests_total', 'Requests refused with 503 by the ASGI backpressure limit', ('kind',))
+
+
+def json_error(message, status_code, headers=None):
+    return JSONResponse({'success': False, 'message': message}, status_code=status_code, headers=headers)
+
+
+class LiveStreamResponse(StreamingResponse):
+    """StreamingResponse that calls on_close however the response ends
+
+    A client that disconnects before the first frame cancels the response
+    before the body generator has started, so a finally block inside the
+    generator would never run and the subscription would keep the camera open.
+    """
+
+    def __init__(self, content, on_close, **kwargs):
+        super().__init__(content, **kwargs)
+        self.on_close = on_close
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            # The broker releases the camera once nobody watches
+            self.on_close()
+
+
+async def video_feed(request):
+    """Async version of server.video_feed"""
+    source_name = request.path_params.get('source_name')
+    broker = server.live_sources.get(source_name)
+    if broker is None:
+        return json_error(f'Unknown live source: {source_name}', 404)
+    matcher, error = server.resolve_matcher(request.query_params)
+    if matcher is None:
+        return json_error(error, 404)
+    course_id = request.query_params.get('course_id') or None
+    student_ids = server.parse_student_ids(request.query_params.get('student_ids'))
+
+    # Opening a camera can take seconds, so it runs off the event loop
+    subscription = await run_in_threadpool(broker.subscribe, course_id, student_ids)
+    if subscription is None:
+        logger.error("Failed to open camera %s!", broker.name)
+        return json_error(f'Could not open live source: {broker.name}', 503)
+
+    async def generate_frames():
+        async for frame_bytes in subscription.aframes():
+            yield (b'--frame\r\n'
+                   b'Content-Type: image/jpeg\r\n\r\n' + frame_bytes + b'\r\n')
+
+    return LiveStreamResponse(
+        generate_frames(), lambda: broker.unsubscribe(subscription),
+        media_type='multipart/x-mixed-replace; boundary=frame'
+    )
+
+
+class Backpressure:
+    """Refuses requests beyond the in-flight limits instead of queueing them"""
+
+    def __init__(self, app, max_inflight=ASGI_MAX_INFLIGHT, max_streams=ASGI_MAX_STREAMS):
+        self.app = app
+        self.limits = {'request': max_inflight, 'stream': max_streams}
+        # Only touched from the event loop thread, so plain counters suffice
+        self.active = {'request': 0, 'stream': 0}
+        REGISTRY.gauge('cv_inflight_requests', 'Requests being served or waiting for a worker', ('kind',),
+                       callback=lambda: {(kind,): count for kind, count in self.active.items()})
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+        path = scope['path']
+        is_stream = path.startswith(LIVE_FEED_PATH) and path != f'{LIVE_FEED_PATH}/stats'
+        kind = 'stream' if is_stream else 'request'
+        if self.active[kind] >= self.limits[kind]:
+            REJECTED.inc(kind=kind)
+            response = json_error('Server busy, try again shortly', 503, headers={'Retry-After': '1'})
+            await response(scope, receive, send)
+            return
+        self.active[kind] += 1
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.active[kind] -= 1
+
+
+def record_live_request(request, status_code):
+    server.REQUESTS.inc(endpoint=LIVE_FEED_PATH, method=request.method, status=status_code)
+
+
+async def live_feed(request):
+    response = await video_feed(request)
+    record_live_request(request, response.status_code)
+    return response
+
+
+@contextlib.asynccontextmanager
+async def lifespan(app):
+    server.start_warmup()
+    yield
+
+
+flask_app = WSGIMiddleware(server.app, workers=ASGI_WORKERS)
+
+app = Starlette(lifespan=lifespan, routes=[
+    # Served by Flask like every other route (it would otherwise match as a source name)
+    Route(f'{LIVE_FEED_PATH}/stats', flask_app),
+    Route(LIVE_FEED_PATH, live_feed),
+    Route(LIVE_FEED_PATH + '/{source_name}', live_feed),
+    Route('/{path:path}', flask_app),
+])
+app = Backpressure(app)
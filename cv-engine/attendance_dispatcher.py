@@ -0,0 +1,280 @@
+"""
+Background submission of attendance to the backend.
+
+The live loop must never wait on HTTP. Recognitions go through a
+SightingWindow, which confirms a student only after MIN_SIGHTINGS sightings
+within WINDOW_SECONDS (a single lucky match of a passer-by is not enough).
+Confirmed IDs are handed to an AttendanceDispatcher, which collects them for
+BATCH_SECONDS and POSTs one {'studentIds': [...], 'courseId': ...} request
+per course from its own thread, over a keep-alive requests.Session.
+
+Failed requests (connection errors, timeouts, 408/429/5xx) are retried with
+exponential backoff; a batch that still fails is appended to the spool file
+(JSON lines). The spool is replayed on the next start and after a batch is
+delivered again (at most once per batch window, so a backend that is down
+costs one retry cycle per batch), so attendance taken while the backend is
+down is not lost. The backend upserts per student and day, so replaying
+batches late or out of order is harmless.
+"""
+import collections
+import json
+import logging
+import os
+import queue
+import threading
+import time
+
+import requests
+
+logger = logging.getLogger(__name__)
+
+MIN_SIGHTINGS = int(os.environ.get('CV_ATTENDANCE_MIN_SIGHTINGS', 3))
+WINDOW_SECONDS = float(os.environ.get('CV_ATTENDANCE_WINDOW_SECONDS', 10))
+BATCH_SECONDS = float(os.environ.get('CV_ATTENDANCE_BATCH_SECONDS', 2))
+SPOOL_FILE = os.environ.get('CV_ATTENDANCE_SPOOL', 'attendance_spool.jsonl')
+REQUEST_TIMEOUT = float(os.environ.get('CV_ATTENDANCE_TIMEOUT', 5))
+MAX_RETRIES = 3
+RETRY_BACKOFF = 0.5
+RETRY_STATUSES = (408, 429, 500, 502, 503, 504)
+DEFAULT_CONFIDENCE = 0.95
+
+
+class SightingWindow:
+    """Confirms a student after min_sightings sightings within window_seconds"""
+
+    def __init__(self, min_sightings=MIN_SIGHTINGS, window_seconds=WINDOW_SECONDS):
+        self.min_sightings = max(1, min_sightings)
+        self.window_seconds = window_seconds
+        self._sightings = collections.defaultdict(collections.deque)
+        self.confirmed = set()
+
+    def observe(self, student_ids, now=None):
+        """Record one frame's recognitions; returns the students confirmed by it"""
+        now = time.monotonic() if now is None else now
+        newly_confirmed = []
+        # A face counts once per frame however many times it was matched
+        for student_id in dict.fromkeys(student_ids):
+            if student_id in self.confirmed:
+                continue
+            seen = self._sightings[student_id]
+            seen.append(now)
+            while seen and now - seen[0] > self.window_seconds:
+                seen.popleft()
+            if len(seen) >= self.min_sightings:
+                self.confirmed.add(student_id)
+                del self._sightings[student_id]
+                newly_confirmed.append(student_id)
+        return newly_confirmed
+
+    def reset(self):
+        self._sightings.clear()
+        self.confirmed.clear()
+
+
+class AttendanceDispatcher:
+    """Batches attendance and POSTs it from a background thread
+
+    Args:
+        backend_url: base URL of the backend API
+        batch_seconds: how long submissions are collected before sending
+        spool_path: JSON-lines file holding batches that could not be sent
+        session: requests.Session to use (a pooled keep-alive one by default)
+    """
+
+    def __init__(self, backend_url, batch_seconds=BATCH_SECONDS, spool_path=SPOOL_FILE,
+                 timeout=REQUEST_TIMEOUT, max_retries=MAX_RETRIES, session=None):
+        self.url = f"{backend_url.rstrip('/')}/api/attendance/mark"
+        self.batch_seconds = batch_seconds
+        self.spool_path = spool_path
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.session = session or requests.Session()
+        self._queue = queue.Queue()
+        # Guards the spool file; never held during HTTP requests
+        self._lock = threading.Lock()
+        self._replaying = threading.Lock()
+        self._thread = None
+        self._stop = threading.Event()
+        self.stats = {'sent': 0, 'batches': 0, 'spooled': 0, 'failed': 0}
+
+    # ------------------------------------------------------------------
+    # Producer side (called from the frame loop, never blocks)
+    # ------------------------------------------------------------------
+
+    def submit(self, student_ids, course_id, confidence=DEFAULT_CONFIDENCE):
+        if isinstance(student_ids, str):
+            student_ids = [student_ids]
+        if student_ids:
+            self._queue.put((list(student_ids), course_id, confidence))
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name='attendance-dispatcher', daemon=True)
+            self._thread.start()
+        return self
+
+    def close(self, timeout=None):
+        """Send what is queued (spooling it if the backend is unreachable) and stop the thread"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+        self._drain()
+
+    # ------------------------------------------------------------------
+    # Sending
+    # ------------------------------------------------------------------
+
+    def _run(self):
+        self.replay_spool()
+        while not self._stop.is_set():
+            try:
+                first = self._queue.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            # Gather everything else that arrives within the batch window
+            items = [first]
+            deadline = time.monotonic() + self.batch_seconds
+            while not self._stop.is_set():
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    items.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._send_batches(items)
+
+    def _drain(self):
+        items = []
+        while True:
+            try:
+                items.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        if items:
+            self._send_batches(items)
+
+    def _send_batches(self, items):
+        """One request per course with the de-duplicated student IDs"""
+        batches = {}
+        for student_ids, course_id, confidence in items:
+            batch = batches.setdefault(course_id, {'studentIds': [], 'courseId': course_id, 'confidence': confidence})
+            batch['studentIds'].extend(s for s in student_ids if s not in batch['studentIds'])
+            batch['confidence'] = min(batch['confidence'], confidence)
+
+        delivered = [self._deliver(payload) for payload in batches.values()]
+        self._replay_if_reachable(any(delivered))
+
+    def send(self, student_ids, course_id, confidence=DEFAULT_CONFIDENCE):
+        """Synchronous submission for callers outside the live loop"""
+        delivered = self._deliver({'studentIds': list(student_ids), 'courseId': course_id, 'confidence': confidence})
+        self._replay_if_reachable(delivered)
+        return delivered
+
+    def _deliver(self, payload):
+        accepted = self.post(payload)
+        if accepted is False:
+            self._spool(payload)
+        return bool(accepted)
+
+    def _replay_if_reachable(self, delivered):
+        """Replay the spool once the backend has just accepted a batch"""
+        if delivered and os.path.exists(self.spool_path):
+            self.replay_spool()
+
+    def post(self, payload):
+        """POST one payload with retries
+
+        Returns:
+            True when accepted, False when the backend could not be reached
+            (spool it), None when it was rejected (4xx other than 408/429;
+            resending would fail the same way)
+        """
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                time.sleep(RETRY_BACKOFF * 2 ** (attempt - 1))
+            try:
+                response = self.session.post(self.url, json=payload, timeout=self.timeout)
+            except requests.RequestException as e:
+                logger.warning("Attendance request failed (attempt %d): %s", attempt + 1, e)
+                continue
+            if response.status_code == 200:
+                self.stats['sent'] += len(payload['studentIds'])
+                self.stats['batches'] += 1
+                logger.info("Attendance marked for %d students", len(payload['studentIds']))
+                return True
+            if response.status_code not in RETRY_STATUSES:
+                self.stats['failed'] += len(payload['studentIds'])
+                logger.error("Backend rejected attendance (%d): %s", response.status_code, response.text[:200])
+                return None
+            logger.warning("Backend returned %d (attempt %d)", response.status_code, attempt + 1)
+        return False
+
+    # ------------------------------------------------------------------
+    # Spool
+    # ------------------------------------------------------------------
+
+    def _spool(self, payload):
+        with self._lock:
+            with open(self.spool_path, 'a') as f:
+                f.write(json.dumps(payload) + '\n')
+                f.flush()
+                os.fsync(f.fileno())
+        self.stats['spooled'] += 1
+        logger.warning("Backend unreachable, spooled attendance for %d students to %s",
+                       len(payload['studentIds']), self.spool_path)
+
+    def _read_spool(self):
+        """Spooled payloads in order; caller holds self._lock"""
+        if not os.path.exists(self.spool_path):
+            return []
+        pending = []
+        with open(self.spool_path, 'r') as f:
+            for line in f:
+                try:
+                    pending.append(json.loads(line))
+                except ValueError:
+                    # Torn last line from a crash mid-write
+                    continue
+        return pending
+
+    def replay_spool(self):
+        """Resend spooled batches in order; stops at the first one that still fails
+
+        The spool is only locked while it is read and rewritten, so batches
+        spooled during the requests are kept. Returns at once with 0 when
+        another thread is already replaying.
+
+        Returns:
+            int: number of batches delivered
+        """
+        if not self._replaying.acquire(blocking=False):
+            return 0
+        try:
+            with self._lock:
+                pending = self._read_spool()
+
+            delivered = 0
+            for payload in pending:
+                if self.post(payload) is False:
+                    break
+                delivered += 1
+
+            if delivered:
+                with self._lock:
+                    # Only this replay removes lines, so the delivered ones are still first
+                    remaining = self._read_spool()[delivered:]
+                    if remaining:
+                        tmp_path = f'{self.spool_path}.tmp'
+                        with open(tmp_path, 'w') as f:
+                            f.writelines(json.dumps(payload) + '\n' for payload in remaining)
+                        os.replace(tmp_path, self.spool_path)
+                    else:
+                        os.remove(self.spool_path)
+        finally:
+            self._replaying.release()
+        if delivered:
+            logger.info("Delivered %d spooled attendance batches", delivered)
+        return delivered
@@ -0,0 +1 @@
+"""Benchmarks for the CV engine. Run from cv-engine/ as `python -m benchmarks.<name>`."""
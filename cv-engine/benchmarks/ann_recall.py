@@ -0,0 +1,71 @@
+"""
+Recall and speed of the IVF index against exact search.
+
+    python -m benchmarks.ann_recall --sizes 10000 50000 --nprobe 4 8 16
+"""
+import argparse
+import time
+
+import numpy as np
+
+from ann_index import IVFIndex
+from matcher import GalleryMatcher
+from benchmarks.common import format_row
+from benchmarks.synthetic import synthetic_gallery, synthetic_queries
+
+
+def run(sizes, nprobes, queries_per_run=200, k=5):
+    rows = []
+    for size in sizes:
+        encodings, student_ids = synthetic_gallery(size)
+        queries, _ = synthetic_queries(encodings, queries_per_run)
+
+        exact = GalleryMatcher(encodings, student_ids)
+        start = time.perf_counter()
+        exact_results = exact.match(queries, k=k)
+        exact_ms = (time.perf_counter() - start) * 1000 / len(queries)
+
+        start = time.perf_counter()
+        approx = GalleryMatcher(encodings, student_ids, index=IVFIndex(min_index_size=0))
+        build_s = time.perf_counter() - start
+
+        for nprobe in nprobes:
+            approx.index.nprobe = nprobe
+            start = time.perf_counter()
+            approx_results = approx.match(queries, k=k)
+            approx_ms = (time.perf_counter() - start) * 1000 / len(queries)
+
+            recall_at_1 = np.mean([
+                bool(a) and a[0]['index'] == e[0]['index'] for a, e in zip(approx_results, exact_results)
+            ])
+            recall_at_k = np.mean([
+                len({c['index'] for c in a} & {c['index'] for c in e}) / len(e)
+                for a, e in zip(approx_results, exact_results)
+            ])
+            rows.append({
+                'gallery_size': size,
+                'nlist': len(approx.index.centroids),
+                'nprobe': nprobe,
+                'build_s': round(build_s, 3),
+                'exact_ms_per_query': round(exact_ms, 4),
+                'ivf_ms_per_query': round(approx_ms, 4),
+                'speedup': round(exact_ms / approx_ms, 2),
+                'recall@1': round(float(recall_at_1), 4),
+                f'recall@{k}': round(float(recall_at_k), 4)
+            })
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 50000])
+    parser.add_argument('--nprobe', type=int, nargs='+', default=[4, 8, 16])
+    parser.add_argument('--queries', type=int, default=200)
+    args = parser.parse_args()
+
+    for row in run(args.sizes, args.nprobe, args.queries):
+        print(format_row(row))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,35 @@
+"""Shared helpers for benchmark scripts"""
+import os
+import resource
+
+import numpy as np
+
+
+def latency_summary(samples_ms):
+    """mean/p50/p95/p99 of a list of millisecond samples"""
+    if not samples_ms:
+        return {'count': 0}
+    samples = np.asarray(samples_ms, dtype=np.float64)
+    return {
+        'count': int(len(samples)),
+        'mean_ms': round(float(samples.mean()), 2),
+        'p50_ms': round(float(np.percentile(samples, 50)), 2),
+        'p95_ms': round(float(np.percentile(samples, 95)), 2),
+        'p99_ms': round(float(np.percentile(samples, 99)), 2)
+    }
+
+
+def format_row(row):
+    return '  '.join(f'{key}={value}' for key, value in row.items())
+
+
+def rss_mb():
+    """Current resident set size of this process (Linux /proc)"""
+    with open('/proc/self/statm') as f:
+        resident_pages = int(f.read().split()[1])
+    return round(resident_pages * os.sysconf('SC_PAGE_SIZE') / 2**20, 1)
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process so far"""
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
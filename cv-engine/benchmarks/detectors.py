@@ -0,0 +1,84 @@
+"""
+Latency and recall of each detector backend on a fixed image set.
+
+By default every image in uploads/students/ is expected to contain exactly one
+face (they are enrollment photos). Pass --labels with a JSON object mapping
+file names to expected face counts for other sets.
+
+    python -m benchmarks.detectors --backends hog haar dnn cascade --repeat 3
+"""
+import argparse
+import json
+import os
+import time
+
+from benchmarks.common import format_row, latency_summary
+from detectors import get_detector
+from face_pipeline import decode_image, locate_faces
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+BACKENDS = ('hog', 'haar', 'dnn', 'cascade')
+
+
+def load_images(image_dir, labels_path=None):
+    labels = {}
+    if labels_path:
+        with open(labels_path) as f:
+            labels = json.load(f)
+    images = []
+    for filename in sorted(os.listdir(image_dir)):
+        if not filename.lower().endswith(IMAGE_EXTENSIONS):
+            continue
+        with open(os.path.join(image_dir, filename), 'rb') as f:
+            images.append((filename, decode_image(f.read())[0], labels.get(filename, 1)))
+    return images
+
+
+def run(backends, images, repeat=1, max_edge=None):
+    rows = []
+    for name in backends:
+        try:
+            detector = get_detector(name)
+        except (FileNotFoundError, ValueError) as e:
+            print(f"Skipping {name}: {e}")
+            rows.append({'backend': name, 'skipped': str(e)})
+            continue
+
+        latencies, found_total, expected_total, extra_total = [], 0, 0, 0
+        for _, rgb_image, expected in images:
+            for i in range(repeat):
+                start = time.perf_counter()
+                locations = locate_faces(rgb_image, max_edge=max_edge, detector=detector)
+                latencies.append((time.perf_counter() - start) * 1000)
+            found_total += min(len(locations), expected)
+            extra_total += max(0, len(locations) - expected)
+            expected_total += expected
+
+        row = {'backend': name, 'images': len(images)}
+        if hasattr(detector, 'stages'):
+            # Cascade stages whose backend could not be loaded are left out
+            row['stages'] = [stage.name for stage in detector.stages]
+        row.update(latency_summary(latencies))
+        row['recall'] = round(found_total / max(1, expected_total), 3)
+        row['extra_detections'] = extra_total
+        rows.append(row)
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--images', default='uploads/students')
+    parser.add_argument('--labels', help='JSON file mapping file name to expected face count')
+    parser.add_argument('--backends', nargs='+', default=list(BACKENDS))
+    parser.add_argument('--repeat', type=int, default=1)
+    parser.add_argument('--max-edge', type=int, default=None, help='Override CV_DETECTION_MAX_EDGE')
+    args = parser.parse_args()
+
+    images = load_images(args.images, args.labels)
+    for row in run(args.backends, images, args.repeat, args.max_edge):
+        if 'skipped' not in row:
+            print(format_row(row))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+"""
+Cold-start cost of the CV engine.
+
+Every measurement runs in a fresh interpreter, so nothing is imported or
+loaded beforehand:
+
+    import_pipeline_ms       import face_pipeline (recognition core, models not loaded)
+    import_server_ms         import server (Flask app, store, routes) in an empty directory
+    cold_first_request_ms    first detect_and_encode_bytes() without warmup
+    warmup_ms                face_pipeline.warmup(): model loading + one dummy inference
+    warm_first_request_ms    first detect_and_encode_bytes() after warmup()
+    steady_request_ms        the next call on the same photo
+
+Each value is the median over --repeat runs.
+
+    python -m benchmarks.startup --image uploads/students/132.jpg --repeat 5
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+import numpy as np
+
+from benchmarks.common import format_row
+
+ENGINE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_IMAGE_DIR = os.path.join(ENGINE_DIR, 'uploads', 'students')
+
+PIPELINE_PROBE = '''
+import json, sys, time
+start = time.perf_counter()
+import face_pipeline
+result = {'import_pipeline_ms': (time.perf_counter() - start) * 1000}
+with open(sys.argv[1], 'rb') as f:
+    image = f.read()
+prefix = 'cold'
+if sys.argv[2] == 'warm':
+    result['warmup_ms'] = face_pipeline.warmup()
+    prefix = 'warm'
+start = time.perf_counter()
+face_pipeline.detect_and_encode_bytes(image)
+result[prefix + '_first_request_ms'] = (time.perf_counter() - start) * 1000
+start = time.perf_counter()
+face_pipeline.detect_and_encode_bytes(image)
+result['steady_request_ms'] = (time.perf_counter() - start) * 1000
+print(json.dumps(result))
+'''
+
+SERVER_PROBE = '''
+import json, time
+start = time.perf_counter()
+import server
+print(json.dumps({'import_server_ms': (time.perf_counter() - start) * 1000}))
+'''
+
+
+def default_image():
+    names = sorted(n for n in os.listdir(DEFAULT_IMAGE_DIR) if n.lower().endswith(('.jpg', '.jpeg', '.png')))
+    return os.path.join(DEFAULT_IMAGE_DIR, names[0])
+
+
+def _probe(code, *args, cwd=None):
+    env = dict(os.environ, PYTHONPATH=ENGINE_DIR, CV_LOG_LEVEL='WARNING', CV_ENCODING_CACHE_SIZE='0')
+    with tempfile.TemporaryDirectory(prefix='cv-startup-') as workdir:
+        env['CV_LIVE_SOURCES'] = os.path.join(workdir, 'live_sources.json')
+        output = subprocess.run(
+            [sys.executable, '-c', code, *args], cwd=cwd or workdir, env=env,
+            capture_output=True, text=True, check=True
+        ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def run(image_path=None, repeat=3):
+    image_path = os.path.abspath(image_path or default_image())
+    samples = {}
+    for _ in range(repeat):
+        for mode in ('cold', 'warm'):
+            for key, value in _probe(PIPELINE_PROBE, image_path, mode).items():
+                samples.setdefault(key, []).append(value)
+        for key, value in _probe(SERVER_PROBE).items():
+            samples.setdefault(key, []).append(value)
+    return {key: round(float(np.median(values)), 2) for key, values in samples.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--image', help='Photo used for the first requests (default: first image in uploads/students)')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+    print(format_row(run(args.image, args.repeat)))
+
+
+if __name__ == '__main__':
+    main()
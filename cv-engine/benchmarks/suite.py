@@ -0,0 +1,497 @@
+"""
+Reproducible benchmark suite for the CV engine (offline, CPU only).
+
+Sections:
+    matcher  synthetic galleries (default 1k/10k/100k): single-face and
+             32-face batch latency, throughput per thread count, memory,
+             recall of enrolled faces and rejection of unknown ones
+    enroll   POST /enroll of every image in the fixed set, per concurrency level
+    verify   POST /verify of deterministic re-captures (mirrored, darker,
+             half size) of every enrolled image: latency, throughput, accuracy
+    live     the face tracker on a synthetic video made from the image set,
+             then the full LivePipeline replaying it at its frame rate
+    startup  import time, model warmup and first-request cost in fresh
+             interpreters (see benchmarks/startup.py)
+    detectors latency and recall of every detector backend on the image set
+              (see benchmarks/detectors.py)
+
+The image set defaults to uploads/students/, where <student_id>.jpg holds one
+face of that student. The HTTP sections import server.py inside a temporary
+working directory (empty store, encoding cache disabled) and call it through
+the Flask test client, so nothing needs to be running.
+
+Results are written as JSON. With --baseline, the run is compared against a
+previous one and the exit status is 1 when a latency or memory metric got
+worse by more than --tolerance (relative) or an accuracy/throughput metric
+dropped by more than that (accuracy: more than 0.01 absolute). p99 values
+are reported but not compared. Baselines are only meaningful on the machine
+that recorded them; --save-baseline stores the current run as the new one.
+
+    python -m benchmarks.suite --sections matcher --sizes 1000 10000 100000
+    python -m benchmarks.suite --baseline benchmarks/baseline.json
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+
+ENGINE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# The HTTP sections change the working directory, so engine imports must not rely on it
+if ENGINE_DIR not in sys.path:
+    sys.path.insert(0, ENGINE_DIR)
+
+import cv2
+import numpy as np
+from PIL import Image, ImageEnhance, ImageOps
+
+from benchmarks import detectors, startup
+from benchmarks.common import latency_summary, peak_rss_mb, rss_mb
+from benchmarks.synthetic import synthetic_gallery, synthetic_queries
+
+DEFAULT_IMAGE_DIR = os.path.join(ENGINE_DIR, 'uploads', 'students')
+DEFAULT_BASELINE = os.path.join(ENGINE_DIR, 'benchmarks', 'baseline.json')
+SECTIONS = ('matcher', 'enroll', 'verify', 'live', 'startup', 'detectors')
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+ACCURACY_TOLERANCE = 0.01
+# Latency changes smaller than this are timer and scheduler noise, whatever the ratio
+MIN_LATENCY_DELTA_MS = 0.5
+LIVE_FRAME_SIZE = (640, 480)
+LIVE_FPS = 15
+
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    return result, (time.perf_counter() - start) * 1000
+
+
+def run_concurrent(fn, items, concurrency):
+    """Call fn on every item from `concurrency` threads
+
+    Returns:
+        tuple: (results, summary) with throughput and latency percentiles
+    """
+    results = [None] * len(items)
+    latencies = [None] * len(items)
+
+    def call(i):
+        results[i], latencies[i] = timed(fn, items[i])
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(call, range(len(items))))
+    wall = time.perf_counter() - start
+    return results, {
+        'concurrency': concurrency,
+        'throughput_per_s': round(len(items) / wall, 2),
+        **latency_summary(latencies)
+    }
+
+
+# ----------------------------------------------------------------------
+# Matcher on synthetic galleries
+# ----------------------------------------------------------------------
+
+def bench_matcher(sizes, concurrency_levels, num_queries=500):
+    from matcher import DEFAULT_TOLERANCE, GalleryMatcher
+
+    rows = []
+    for size in sizes:
+        encodings, student_ids = synthetic_gallery(size)
+        known, true_rows = synthetic_queries(encodings, num_queries)
+        # Faces of people who are not enrolled (a gallery drawn with another seed)
+        unknown, _ = synthetic_queries(synthetic_gallery(num_queries, seed=7)[0], num_queries)
+
+        tracemalloc.start()
+        matcher, build_ms = timed(GalleryMatcher, encodings, student_ids)
+        build_peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+        single = [timed(matcher.match, [query])[1] for query in known[:200]]
+        batch = [timed(matcher.match, known[start:start + 32])[1] for start in range(0, len(known), 32)]
+        throughput = [
+            run_concurrent(lambda query: matcher.match([query]), list(known), level)[1]
+            for level in concurrency_levels
+        ]
+
+        best = matcher.best_matches(np.concatenate([known, unknown]), tolerance=DEFAULT_TOLERANCE)
+        recall = np.mean([
+            match is not None and match['student_id'] == student_ids[row]
+            for match, row in zip(best[:len(known)], true_rows)
+        ])
+        rejected = np.mean([match is None for match in best[len(known):]])
+
+        rows.append({
+            'gallery_size': size,
+            'build_ms': round(build_ms, 2),
+            'gallery_mb': round(matcher.matrix.nbytes / 2**20, 2),
+            'build_peak_mb': round(build_peak / 2**20, 2),
+            'single_face': latency_summary(single),
+            'batch_32_faces': latency_summary(batch),
+            'throughput': throughput,
+            'recall_at_1': round(float(recall), 4),
+            'unknown_reject_rate': round(float(rejected), 4)
+        })
+    return rows
+
+
+# ----------------------------------------------------------------------
+# Fixed image set
+# ----------------------------------------------------------------------
+
+def load_image_set(image_dir):
+    """[(student_id, image_bytes)] for every <student_id>.jpg in image_dir"""
+    images = []
+    for filename in sorted(os.listdir(image_dir)):
+        if filename.lower().endswith(IMAGE_EXTENSIONS):
+            with open(os.path.join(image_dir, filename), 'rb') as f:
+                images.append((os.path.splitext(filename)[0], f.read()))
+    return images
+
+
+def _jpeg(img):
+    out = io.BytesIO()
+    img.save(out, 'JPEG', quality=90)
+    return out.getvalue()
+
+
+def recaptures(image_bytes):
+    """Deterministic re-captures of one photo as JPEG bytes: mirrored, darker and half size"""
+    img = Image.open(io.BytesIO(image_bytes)).convert('RGB')
+    width, height = img.size
+    return {
+        'mirrored': _jpeg(ImageOps.mirror(img)),
+        'darker': _jpeg(ImageEnhance.Brightness(img).enhance(0.6)),
+        'half_size': _jpeg(img.resize((width // 2, height // 2), Image.BILINEAR))
+    }
+
+
+# ----------------------------------------------------------------------
+# HTTP endpoints through the Flask test client
+# ----------------------------------------------------------------------
+
+def start_engine(workdir):
+    """Import server.py inside an empty working directory (fresh store, no encoding cache) and warm it up"""
+    os.environ['CV_ENCODING_CACHE_SIZE'] = '0'
+    os.environ['CV_LIVE_SOURCES'] = os.path.join(workdir, 'live_sources.json')
+    os.chdir(workdir)
+    import server
+    # Measure a warmed-up engine; the cold start is the startup section's job
+    server.warmup()
+    return server
+
+
+def post_photo(app, url, image_bytes, **form):
+    data = dict(form, photo=(io.BytesIO(image_bytes), 'photo.jpg'))
+    response = app.test_client().post(url, data=data, content_type='multipart/form-data')
+    return response.status_code, response.get_json()
+
+
+def bench_enroll(server, images, concurrency_levels):
+    runs = []
+    for level in concurrency_levels:
+        results, summary = run_concurrent(
+            lambda item: post_photo(server.app, '/enroll', item[1], student_id=item[0], replace='true'),
+            images, level
+        )
+        summary['success_rate'] = round(float(np.mean([status == 200 for status, _ in results])), 4)
+        runs.append(summary)
+    return {
+        'images': len(images),
+        'enrolled': server.gallery_matcher.num_students,
+        'runs': runs,
+        'rss_mb': rss_mb(),
+        'peak_rss_mb': peak_rss_mb()
+    }
+
+
+def bench_verify(server, images, concurrency_levels):
+    if server.gallery_matcher.num_students == 0:
+        for student_id, image_bytes in images:
+            post_photo(server.app, '/enroll', image_bytes, student_id=student_id, replace='true')
+    enrolled = set(server.gallery_matcher.identities)
+    queries = [
+        (student_id, kind, data)
+        for student_id, image_bytes in images if student_id in enrolled
+        for kind, data in recaptures(image_bytes).items()
+    ]
+    if not queries:
+        return {'queries': 0, 'message': 'No image of the set could be enrolled'}
+
+    runs = []
+    for level in concurrency_levels:
+        results, summary = run_concurrent(lambda query: post_photo(server.app, '/verify', query[2]), queries, level)
+        correct = [
+            bool(body and body.get('recognized')) and body['recognized'][0]['student_id'] == student_id
+            for (student_id, _, _), (_, body) in zip(queries, results)
+        ]
+        summary['accuracy'] = round(float(np.mean(correct)), 4)
+        summary['accuracy_by_recapture'] = {
+            kind: round(float(np.mean([c for c, q in zip(correct, queries) if q[1] == kind])), 4)
+            for kind in sorted({q[1] for q in queries})
+        }
+        runs.append(summary)
+    return {
+        'queries': len(queries),
+        'gallery_students': len(enrolled),
+        'runs': runs,
+        'rss_mb': rss_mb(),
+        'peak_rss_mb': peak_rss_mb()
+    }
+
+
+# ----------------------------------------------------------------------
+# Live pipeline on a synthetic video
+# ----------------------------------------------------------------------
+
+def build_video(images, path, frames_per_face=30):
+    """MJPEG video showing each image for frames_per_face frames with a slow pan
+
+    Returns:
+        list: expected student ID per frame
+    """
+    from face_pipeline import decode_image
+
+    width, height = LIVE_FRAME_SIZE
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'MJPG'), LIVE_FPS, LIVE_FRAME_SIZE)
+    expected = []
+    for student_id, image_bytes in images:
+        rgb_image, _ = decode_image(image_bytes)
+        scale = min(width / rgb_image.shape[1], height / rgb_image.shape[0])
+        resized = cv2.resize(rgb_image, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+        frame = np.zeros((height, width, 3), dtype=np.uint8)
+        top, left = (height - resized.shape[0]) // 2, (width - resized.shape[1]) // 2
+        frame[top:top + resized.shape[0], left:left + resized.shape[1]] = resized[:, :, ::-1]
+        for i in range(frames_per_face):
+            writer.write(np.roll(frame, 2 * i, axis=1))
+            expected.append(student_id)
+    writer.release()
+    return expected
+
+
+def bench_live(images, workdir, frames_per_face=30):
+    from face_pipeline import detect_and_encode_bytes
+    from matcher import GalleryMatcher
+    from streaming import LivePipeline
+    from tracking import FaceTracker
+
+    enrolled = []
+    for student_id, image_bytes in images:
+        _, faces, _ = detect_and_encode_bytes(image_bytes)
+        if faces:
+            enrolled.append((student_id, faces[0]['encoding']))
+    matcher = GalleryMatcher([e for _, e in enrolled], [s for s, _ in enrolled])
+
+    video_path = os.path.join(workdir, 'live_benchmark.avi')
+    expected = build_video(images, video_path, frames_per_face)
+
+    # Tracker alone, every frame in order (deterministic)
+    tracker = FaceTracker()
+    capture = cv2.VideoCapture(video_path)
+    latencies, correct = [], []
+    for student_id in expected:
+        ok, frame = capture.read()
+        if not ok:
+            break
+        tracks, elapsed = timed(tracker.process, frame, matcher)
+        latencies.append(elapsed)
+        correct.append(any(track.student_id == student_id for track in tracks))
+    capture.release()
+    tracker_result = {
+        'frames': len(latencies),
+        'frame': latency_summary(latencies),
+        'throughput_fps': round(len(latencies) / (sum(latencies) / 1000), 2) if latencies else None,
+        'frame_accuracy': round(float(np.mean(correct)), 4) if correct else None,
+        'detections': tracker.stats['detections'],
+        'encodings': tracker.stats['encodings']
+    }
+
+    # Full capture -> inference -> encode pipeline, replayed at the video's frame rate
+    pipeline = LivePipeline(video_path, lambda: matcher, realtime=True, name='benchmark')
+    pipeline_result = None
+    if pipeline.start():
+        queue = pipeline.subscribe()
+        start = time.perf_counter()
+        streamed, snapshot = 0, None
+        for _ in pipeline.frames(queue):
+            streamed += 1
+            if streamed % LIVE_FPS == 0:
+                snapshot = pipeline.stats()
+        wall = time.perf_counter() - start
+        pipeline.stop()
+        snapshot = snapshot or pipeline.stats()
+        pipeline_result = {
+            'source_fps': LIVE_FPS,
+            'streamed_fps': round(streamed / wall, 2),
+            'inference_fps': round(pipeline.tracker.stats['frames'] / wall, 2),
+            'inference_ms': snapshot['inference_ms_avg'],
+            'inference_lag_ms': snapshot['inference_lag_ms_avg'],
+            'latency_p50_ms': snapshot['latency_ms_p50'],
+            'latency_p95_ms': snapshot['latency_ms_p95'],
+            'dropped_frames': snapshot['dropped']
+        }
+    return {
+        'gallery_students': len(enrolled),
+        'tracker': tracker_result,
+        'pipeline': pipeline_result,
+        'rss_mb': rss_mb(),
+        'peak_rss_mb': peak_rss_mb()
+    }
+
+
+# ----------------------------------------------------------------------
+# Baseline comparison
+# ----------------------------------------------------------------------
+
+def flatten(value, prefix=''):
+    """{'a/b/c': number} for every numeric leaf; list rows are keyed by size, concurrency or backend"""
+    metrics = {}
+    if isinstance(value, dict):
+        for key, item in value.items():
+            metrics.update(flatten(item, f'{prefix}/{key}' if prefix else str(key)))
+    elif isinstance(value, list):
+        for i, item in enumerate(value):
+            if isinstance(item, dict) and 'gallery_size' in item:
+                label = f"size={item['gallery_size']}"
+            elif isinstance(item, dict) and 'concurrency' in item:
+                label = f"concurrency={item['concurrency']}"
+            elif isinstance(item, dict) and 'backend' in item:
+                label = f"backend={item['backend']}"
+            else:
+                label = str(i)
+            metrics.update(flatten(item, f'{prefix}/{label}'))
+    elif isinstance(value, (int, float)) and not isinstance(value, bool):
+        metrics[prefix] = value
+    return metrics
+
+
+def metric_direction(name):
+    """'lower' or 'higher' is better, or None for informational values"""
+    leaf = name.rsplit('/', 1)[-1]
+    if leaf.startswith('p99'):
+        # A handful of samples decide the tail, too noisy to gate on
+        return None
+    if leaf.endswith(('_ms', '_mb')):
+        return 'lower'
+    if any(word in leaf for word in ('throughput', 'fps', 'accuracy', 'recall', 'rate')):
+        return 'higher'
+    return None
+
+
+def compare(current, baseline, tolerance):
+    """Regressions of the current results against a baseline, as readable strings"""
+    current_metrics = flatten(current)
+    baseline_metrics = flatten(baseline)
+    regressions = []
+    for name, old in sorted(baseline_metrics.items()):
+        new = current_metrics.get(name)
+        direction = metric_direction(name)
+        if new is None or direction is None or name == 'live/pipeline/source_fps':
+            continue
+        leaf = name.rsplit('/', 1)[-1]
+        if any(word in leaf for word in ('accuracy', 'recall', 'rate')):
+            worse = old - new > ACCURACY_TOLERANCE
+        elif direction == 'lower':
+            worse = new > old * (1 + tolerance) and (not leaf.endswith('_ms') or new - old > MIN_LATENCY_DELTA_MS)
+        else:
+            worse = old > 0 and new < old * (1 - tolerance)
+        if worse:
+            regressions.append(f'{name}: {old} -> {new}')
+    return regressions
+
+
+def environment():
+    import matcher
+    import face_pipeline
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'numpy': np.__version__,
+        'opencv': cv2.__version__,
+        'pipeline_signature': face_pipeline.pipeline_signature(),
+        'gallery_aggregate': matcher.GALLERY_AGGREGATE
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sections', nargs='+', default=list(SECTIONS), choices=SECTIONS)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000],
+                        help='Synthetic gallery sizes for the matcher section')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 4])
+    parser.add_argument('--images', default=DEFAULT_IMAGE_DIR, help='Directory of <student_id>.jpg photos')
+    parser.add_argument('--frames-per-face', type=int, default=30, help='Frames per image in the live video')
+    parser.add_argument('--detector-repeat', type=int, default=3, help='Timed runs per image and detector backend')
+    parser.add_argument('--output', default='benchmark-results.json')
+    parser.add_argument('--baseline', help='Compare against this results file')
+    parser.add_argument('--save-baseline', action='store_true', help='Write this run to --baseline (default: %(default)s)')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='Allowed relative slowdown before failing')
+    args = parser.parse_args()
+
+    os.environ.setdefault('CV_LOG_LEVEL', 'WARNING')
+    output_path = os.path.abspath(args.output)
+    baseline_path = os.path.abspath(args.baseline or DEFAULT_BASELINE)
+    images = load_image_set(args.images) if set(args.sections) - {'matcher', 'startup', 'detectors'} else []
+
+    results = {'environment': environment(), 'results': {}}
+    workdir = tempfile.mkdtemp(prefix='cv-benchmark-')
+    cwd = os.getcwd()
+    try:
+        if 'startup' in args.sections:
+            print("startup: fresh interpreters")
+            results['results']['startup'] = startup.run()
+        if 'detectors' in args.sections:
+            print(f"detectors: {', '.join(detectors.BACKENDS)} on {args.images}")
+            results['results']['detectors'] = detectors.run(
+                detectors.BACKENDS, detectors.load_images(args.images), args.detector_repeat
+            )
+        if 'matcher' in args.sections:
+            print(f"matcher: galleries of {args.sizes}")
+            results['results']['matcher'] = bench_matcher(args.sizes, args.concurrency)
+        if 'live' in args.sections:
+            print(f"live: {len(images)} images x {args.frames_per_face} frames")
+            results['results']['live'] = bench_live(images, workdir, args.frames_per_face)
+        if 'enroll' in args.sections or 'verify' in args.sections:
+            server = start_engine(workdir)
+            if 'enroll' in args.sections:
+                print(f"enroll: {len(images)} images at concurrency {args.concurrency}")
+                results['results']['enroll'] = bench_enroll(server, images, args.concurrency)
+            if 'verify' in args.sections:
+                print(f"verify: re-captures of {len(images)} images at concurrency {args.concurrency}")
+                results['results']['verify'] = bench_verify(server, images, args.concurrency)
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    with open(output_path, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {output_path}")
+
+    if args.save_baseline:
+        with open(baseline_path, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"Baseline saved to {baseline_path}")
+    elif args.baseline:
+        with open(baseline_path) as f:
+            baseline = json.load(f)
+        regressions = compare(results['results'], baseline['results'], args.tolerance)
+        if baseline.get('environment', {}).get('cpu_count') != os.cpu_count():
+            print("Note: the baseline was recorded on a machine with a different CPU count")
+        if regressions:
+            print(f"{len(regressions)} regressions against {baseline_path}:")
+            for regression in regressions:
+                print(f"  {regression}")
+            sys.exit(1)
+        print(f"No regressions against {baseline_path}")
+
+
+if __name__ == '__main__':
+    main()
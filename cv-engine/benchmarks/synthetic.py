@@ -0,0 +1,28 @@
+"""
+Synthetic dlib-like galleries for benchmarks.
+
+Real 128-d dlib encodings share a common mean; different people sit roughly
+0.8-1.0 apart and photos of the same person are usually under 0.4 apart.
+The generator reproduces those scales so thresholds behave as in production.
+"""
+import numpy as np
+
+IDENTITY_SPREAD = 0.055
+SAMPLE_NOISE = 0.025
+
+
+def synthetic_gallery(size, dim=128, seed=0):
+    """Return (encodings, student_ids) for `size` distinct synthetic students"""
+    rng = np.random.default_rng(seed)
+    mean = rng.normal(0.0, 0.08, dim)
+    encodings = (mean + rng.normal(0.0, IDENTITY_SPREAD, (size, dim))).astype(np.float32)
+    student_ids = [str(100000 + i) for i in range(size)]
+    return encodings, student_ids
+
+
+def synthetic_queries(encodings, count, seed=1):
+    """Return (queries, true_rows): noisy re-captures of randomly chosen gallery rows"""
+    rng = np.random.default_rng(seed)
+    true_rows = rng.choice(len(encodings), count, replace=count > len(encodings))
+    queries = encodings[true_rows] + rng.normal(0.0, SAMPLE_NOISE, (count, encodings.shape[1]))
+    return queries.astype(np.float32), true_rows
@@ -0,0 +1,269 @@
+"""
+Shared camera access for live viewers.
+
+A CameraBroker owns one capture device and one LivePipeline, so recognition
+runs once per frame no matter how many clients are watching; every viewer
+gets its own drop-oldest output queue fed with the same annotated JPEGs.
+
+The pipeline starts with the first subscriber and stops CAMERA_IDLE_SECONDS
+after the last one leaves (so a page reload does not reopen the device).
+Each subscriber may scope recognition to a course; the pipeline matches
+against the union of the active scopes, or the full gallery if any viewer
+asked for it.
+
+camera_status() reports whether the device is usable without opening it on
+every call: a running broker is known to be available, otherwise the result
+of the last probe is reused for CAMERA_STATUS_TTL seconds.
+
+A SourceRegistry holds one broker per named source (camera index, RTSP URL
+or video file), each optionally bound to a course, all sharing one
+InferenceScheduler. Sources come from the JSON file named by CV_LIVE_SOURCES:
+
+    {
+        "hall-a": {"source": "rtsp://10.0.0.11/stream", "course_id": "CS101", "weight": 2},
+        "hall-b": {"source": 1},
+        "replay": {"source": "recordings/lecture.mp4", "loop": true}
+    }
+
+Without that file there is a single source named "default" on camera 0.
+"""
+import json
+import logging
+import os
+import threading
+import time
+
+import cv2
+
+from streaming import InferenceScheduler, LivePipeline, parse_source
+
+logger = logging.getLogger(__name__)
+
+CAMERA_IDLE_SECONDS = float(os.environ.get('CV_CAMERA_IDLE_SECONDS', 5))
+CAMERA_STATUS_TTL = float(os.environ.get('CV_CAMERA_STATUS_TTL', 30))
+LIVE_SOURCES_FILE = os.environ.get('CV_LIVE_SOURCES', 'live_sources.json')
+DEFAULT_SOURCE = 'default'
+
+
+class Subscription:
+    """One viewer of a broker: its frame queue and recognition scope"""
+
+    def __init__(self, pipeline, queue, course_id=None, student_ids=None):
+        self.pipeline = pipeline
+        self.queue = queue
+        self.course_id = course_id
+        self.student_ids = student_ids
+
+    def frames(self):
+        return self.pipeline.frames(self.queue)
+
+    def aframes(self):
+        return self.pipeline.aframes(self.queue)
+
+
+class CameraBroker:
+    """Reference-counted owner of one video source and its live pipeline
+
+    Args:
+        source: cv2.VideoCapture argument (camera index, file path or URL)
+        galleries: CourseGalleries used to resolve subscriber scopes
+        idle_seconds: how long to keep the device open after the last viewer leaves
+        name: label used in stats and logs (defaults to the source)
+        course_id: course that viewers without their own scope are matched against
+        scheduler: InferenceScheduler shared with other sources (private if None)
+        weight: share of the scheduler's inference slots
+        loop: restart video file sources when they end
+    """
+
+    def __init__(self, source, galleries, idle_seconds=CAMERA_IDLE_SECONDS, name=None, course_id=None,
+                 scheduler=None, weight=1.0, loop=False):
+        self.source = source
+        self.galleries = galleries
+        self.idle_seconds = idle_seconds
+        self.name = name or str(source)
+        self.course_id = course_id
+        self.scheduler = scheduler
+        self.weight = weight
+        self.loop = loop
+        self.pipeline = None
+        self._subscriptions = []
+        self._lock = threading.RLock()
+        self._idle_timer = None
+        self._status = None
+        self._status_checked = 0.0
+
+    def _matcher(self):
+        """Matcher for the union of every active subscriber's scope"""
+        with self._lock:
+            scopes = [(s.course_id, s.student_ids) for s in self._subscriptions]
+        if not scopes or any(course_id is None and student_ids is None for course_id, student_ids in scopes):
+            return self.galleries.matcher
+        if len(scopes) == 1:
+            # A roster removed mid-stream leaves nobody to match
+            return self.galleries.view(*scopes[0]) or self.galleries.view(student_ids=[])
+
+        student_ids = set()
+        for course_id, ids in scopes:
+            student_ids.update(ids if ids is not None else self.galleries.get_roster(course_id) or [])
+        return self.galleries.view(student_ids=student_ids)
+
+    def _set_status(self, available):
+        self._status = available
+        self._status_checked = time.monotonic()
+
+    def subscribe(self, course_id=None, student_ids=None):
+        """Join the stream, starting the camera if needed; None if it cannot be opened
+
+        Viewers that give neither a course nor student IDs use the source's course binding.
+        """
+        if course_id is None and student_ids is None:
+            course_id = self.course_id
+        with self._lock:
+            if self._idle_timer is not None:
+                self._idle_timer.cancel()
+                self._idle_timer = None
+            if self.pipeline is None or not self.pipeline.running:
+                if self.pipeline is not None:
+                    self.pipeline.stop()
+                logger.info("Opening camera %s (%s)...", self.name, self.source)
+                self.pipeline = LivePipeline(
+                    self.source, self._matcher, scheduler=self.scheduler, weight=self.weight, loop=self.loop,
+                    name=self.name
+                )
+                started = self.pipeline.start()
+                self._set_status(started)
+                if not started:
+                    self.pipeline.stop()
+                    self.pipeline = None
+                    return None
+                logger.info("Camera %s opened", self.name)
+            subscription = Subscription(self.pipeline, self.pipeline.subscribe(), course_id, student_ids)
+            self._subscriptions.append(subscription)
+            return subscription
+
+    def unsubscribe(self, subscription):
+        """Leave the stream; the camera is released once nobody has watched for idle_seconds"""
+        with self._lock:
+            if subscription not in self._subscriptions:
+                return
+            self._subscriptions.remove(subscription)
+            subscription.pipeline.unsubscribe(subscription.queue)
+            if not self._subscriptions and self.pipeline is not None:
+                self._idle_timer = threading.Timer(self.idle_seconds, self._stop_if_idle)
+                self._idle_timer.daemon = True
+                self._idle_timer.start()
+
+    def _stop_if_idle(self):
+        with self._lock:
+            if self._subscriptions or self.pipeline is None:
+                return
+            self.pipeline.stop()
+            logger.info("Camera %s released (pipeline stats: %s)", self.name, self.pipeline.stats())
+            self.pipeline = None
+            self._idle_timer = None
+
+    @property
+    def subscriber_count(self):
+        with self._lock:
+            return len(self._subscriptions)
+
+    def camera_status(self, max_age=CAMERA_STATUS_TTL):
+        """Whether the source can be opened, probing it at most once per max_age seconds"""
+        with self._lock:
+            if self.pipeline is not None and self.pipeline.running:
+                self._set_status(True)
+            elif self._status is None or time.monotonic() - self._status_checked > max_age:
+                cap = cv2.VideoCapture(self.source)
+                available = cap.isOpened()
+                if available:
+                    cap.release()
+                self._set_status(available)
+            return {
+                'available': self._status,
+                'checked_seconds_ago': round(time.monotonic() - self._status_checked, 1)
+            }
+
+    def stats(self):
+        with self._lock:
+            pipeline = self.pipeline
+            stats = {'source': str(self.source), 'subscribers': len(self._subscriptions)}
+        if pipeline is not None:
+            stats.update(pipeline.stats())
+        stats.update({'name': self.name, 'course_id': self.course_id, 'weight': self.weight})
+        return stats
+
+    def shutdown(self):
+        with self._lock:
+            if self._idle_timer is not None:
+                self._idle_timer.cancel()
+                self._idle_timer = None
+            self._subscriptions = []
+            if self.pipeline is not None:
+                self.pipeline.stop()
+                self.pipeline = None
+
+
+class SourceRegistry:
+    """Named live sources, one CameraBroker each, sharing an inference scheduler"""
+
+    def __init__(self, galleries, scheduler=None):
+        self.galleries = galleries
+        self.scheduler = scheduler or InferenceScheduler()
+        self._brokers = {}
+        self._lock = threading.Lock()
+
+    def add(self, name, source, course_id=None, weight=1.0, loop=False):
+        """Register (or replace an idle) source; raises ValueError if it is being watched"""
+        broker = CameraBroker(
+            parse_source(source), self.galleries, name=name, course_id=course_id,
+            scheduler=self.scheduler, weight=float(weight), loop=bool(loop)
+        )
+        with self._lock:
+            existing = self._brokers.get(name)
+            if existing is not None:
+                if existing.subscriber_count:
+                    raise ValueError(f"Source '{name}' has active viewers")
+                existing.shutdown()
+            self._brokers[name] = broker
+        return broker
+
+    def remove(self, name):
+        with self._lock:
+            broker = self._brokers.pop(name, None)
+        if broker is None:
+            return False
+        broker.shutdown()
+        return True
+
+    def get(self, name=None):
+        """Broker by name; without a name the default source (or the first one configured)"""
+        with self._lock:
+            if name is None:
+                name = DEFAULT_SOURCE if DEFAULT_SOURCE in self._brokers else next(iter(self._brokers), None)
+            return self._brokers.get(name)
+
+    def brokers(self):
+        with self._lock:
+            return list(self._brokers.values())
+
+    def load(self, path=LIVE_SOURCES_FILE):
+        """Register sources from a JSON file, or camera 0 as 'default' if there is none"""
+        if not os.path.exists(path):
+            self.add(DEFAULT_SOURCE, 0)
+            return
+        with open(path, 'r') as f:
+            config = json.load(f)
+        for name, entry in config.items():
+            if not isinstance(entry, dict):
+                entry = {'source': entry}
+            self.add(
+                name, entry['source'], course_id=entry.get('course_id'),
+                weight=entry.get('weight', 1.0), loop=entry.get('loop', False)
+            )
+        logger.info("Loaded %d live sources from %s", len(config), path)
+
+    def stats(self):
+        return {
+            'streams': [broker.stats() for broker in self.brokers()],
+            'scheduler': self.scheduler.stats()
+        }
@@ -0,0 +1,60 @@
+"""
+Process pool for CPU-bound face detection and encoding.
+
+dlib HOG detection holds the GIL-bound request thread for most of a /verify
+call. With a pool, each worker process loads the dlib models once (warmed up
+by the pool initializer) and then serves decode+detect+encode jobs, so concurrent
+requests run on separate cores while Flask threads only wait on futures.
+
+Workers receive the raw upload bytes and return encodings; the gallery stays
+in the parent process as the memory-mapped matrix, so nothing gallery-sized
+is ever copied across the process boundary.
+"""
+import logging
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+
+def _init_worker():
+    import face_pipeline
+    face_pipeline.warmup()
+
+
+def _ping():
+    return os.getpid()
+
+
+def _detect_and_encode(image_bytes):
+    import face_pipeline
+    return face_pipeline.detect_and_encode_bytes(image_bytes)
+
+
+class DetectionPool:
+    """Fixed-size pool of model-loaded worker processes"""
+
+    def __init__(self, workers):
+        self.workers = workers
+        # spawn avoids forking the Flask process with live threads and dlib state
+        self._executor = ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=_init_worker
+        )
+
+    def start(self):
+        """Spawn every worker now so the first request does not pay model loading"""
+        pids = {future.result() for future in [self._executor.submit(_ping) for _ in range(self.workers)]}
+        logger.info("Detection pool ready with %d worker processes", len(pids))
+
+    def submit(self, image_bytes):
+        """Future resolving to (image_shape, faces, timings) as returned by face_pipeline.detect_and_encode_bytes"""
+        return self._executor.submit(_detect_and_encode, image_bytes)
+
+    def detect(self, image_bytes):
+        return self.submit(image_bytes).result()
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True, cancel_futures=True)
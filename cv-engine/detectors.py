@@ -0,0 +1,207 @@
+"""
+Interchangeable face detector backends.
+
+Every backend takes an RGB image and returns a list of
+((top, right, bottom, left), score) tuples in that image's coordinates.
+Scores are backend-specific (HOG SVM margin, Haar level weight, SSD
+probability), which is why each backend carries its own `min_score` used by
+the cascade to decide whether a result is trustworthy.
+
+    hog      dlib HOG + linear SVM (the engine's original detector)
+    haar     OpenCV Haar cascade (cheapest, weakest on pose/lighting)
+    dnn      OpenCV DNN res10 300x300 SSD on CPU (needs the Caffe model files)
+    cascade  cheapest-first chain that escalates on empty/low-confidence output
+
+Select one with CV_DETECTOR (default 'hog'); the cascade order comes from
+CV_DETECTOR_CASCADE (default 'haar,dnn,hog', unavailable backends are skipped).
+"""
+import logging
+import os
+import threading
+
+import cv2
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+DETECTOR = os.environ.get('CV_DETECTOR', 'hog')
+CASCADE_ORDER = os.environ.get('CV_DETECTOR_CASCADE', 'haar,dnn,hog')
+
+# res10 SSD files from OpenCV's samples/dnn/face_detector
+DNN_MODEL_DIR = os.environ.get('CV_DNN_MODEL_DIR', 'models')
+DNN_PROTOTXT = 'deploy.prototxt'
+DNN_WEIGHTS = 'res10_300x300_ssd_iter_140000.caffemodel'
+
+
+class FaceDetector:
+    """Base class: detect(rgb_image, upsample) -> [((top, right, bottom, left), score)]"""
+
+    name = 'base'
+    # Whether a larger `upsample` value makes this backend find smaller faces
+    supports_upsample = False
+    # Detections scoring below this are treated as low confidence by the cascade
+    min_score = 0.0
+
+    def detect(self, rgb_image, upsample=1):
+        raise NotImplementedError
+
+
+class HogDetector(FaceDetector):
+    name = 'hog'
+    supports_upsample = True
+    min_score = 0.3
+
+    def __init__(self):
+        import dlib
+        self._new_detector = dlib.get_frontal_face_detector
+        # dlib's detector corrupts memory when one instance runs in several threads, and building
+        # one takes ~0.5 s, so idle instances are kept and each call borrows one
+        self._idle = []
+        self._lock = threading.Lock()
+
+    def detect(self, rgb_image, upsample=1):
+        with self._lock:
+            detector = self._idle.pop() if self._idle else None
+        if detector is None:
+            detector = self._new_detector()
+        try:
+            rects, scores, _ = detector.run(rgb_image, upsample, 0.0)
+        finally:
+            with self._lock:
+                self._idle.append(detector)
+        height, width = rgb_image.shape[:2]
+        return [
+            ((max(rect.top(), 0), min(rect.right(), width), min(rect.bottom(), height), max(rect.left(), 0)), float(score))
+            for rect, score in zip(rects, scores)
+        ]
+
+
+class HaarDetector(FaceDetector):
+    name = 'haar'
+    # Level weights of real frontal faces are typically 5+, background hits 0-4
+    min_score = 5.0
+
+    def __init__(self):
+        self._cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
+        # CascadeClassifier is not safe to share between threads
+        self._lock = threading.Lock()
+
+    def _run(self, gray, scale_factor, min_neighbors, min_size):
+        with self._lock:
+            faces, _, weights = self._cascade.detectMultiScale3(
+                gray,
+                scaleFactor=scale_factor,
+                minNeighbors=min_neighbors,
+                minSize=min_size,
+                flags=cv2.CASCADE_SCALE_IMAGE,
+                outputRejectLevels=True
+            )
+        return faces, np.ravel(weights)
+
+    def detect(self, rgb_image, upsample=1):
+        gray = cv2.equalizeHist(cv2.cvtColor(rgb_image, cv2.COLOR_RGB2GRAY))
+        # Same parameters as debug_face_recognition.py, including the lenient retry
+        faces, weights = self._run(gray, 1.1, 3, (30, 30))
+        if len(faces) == 0:
+            faces, weights = self._run(gray, 1.05, 2, (20, 20))
+        return [
+            ((int(y), int(x + w), int(y + h), int(x)), float(weight))
+            for (x, y, w, h), weight in zip(faces, weights)
+        ]
+
+
+class DnnDetector(FaceDetector):
+    name = 'dnn'
+    min_score = 0.7
+    # Detections below this probability are discarded outright
+    threshold = 0.5
+
+    def __init__(self, model_dir=None):
+        model_dir = model_dir or DNN_MODEL_DIR
+        prototxt = os.path.join(model_dir, DNN_PROTOTXT)
+        weights = os.path.join(model_dir, DNN_WEIGHTS)
+        for path in (prototxt, weights):
+            if not os.path.exists(path):
+                raise FileNotFoundError(f'DNN face detector model not found: {path}')
+        self._net = cv2.dnn.readNetFromCaffe(prototxt, weights)
+        self._net.setPreferableBackend(cv2.dnn.DNN_BACKEND_OPENCV)
+        self._net.setPreferableTarget(cv2.dnn.DNN_TARGET_CPU)
+        self._lock = threading.Lock()
+
+    def detect(self, rgb_image, upsample=1):
+        height, width = rgb_image.shape[:2]
+        # The model expects BGR input with these (B, G, R) channel means; swapRB converts our RGB
+        blob = cv2.dnn.blobFromImage(
+            cv2.resize(rgb_image, (300, 300)), 1.0, (300, 300), (104.0, 177.0, 123.0), swapRB=True
+        )
+        with self._lock:
+            self._net.setInput(blob)
+            detections = self._net.forward()[0, 0]
+
+        results = []
+        for detection in detections:
+            score = float(detection[2])
+            if score < self.threshold:
+                continue
+            left, top, right, bottom = (detection[3:7] * [width, height, width, height]).astype(int)
+            left, top = max(0, left), max(0, top)
+            right, bottom = min(width, right), min(height, bottom)
+            if right > left and bottom > top:
+                results.append(((int(top), int(right), int(bottom), int(left)), score))
+        return results
+
+
+class CascadeDetector(FaceDetector):
+    """Run detectors cheapest-first, escalating on empty or low-confidence results
+
+    A stage's detections at or above its min_score are returned as soon as there
+    is at least one; otherwise the next (more expensive) stage runs.
+    """
+
+    name = 'cascade'
+
+    def __init__(self, stages):
+        if not stages:
+            raise ValueError('Cascade needs at least one detector')
+        self.stages = stages
+        self.supports_upsample = stages[-1].supports_upsample
+
+    def detect(self, rgb_image, upsample=1):
+        detections = []
+        for stage in self.stages:
+            detections = stage.detect(rgb_image, upsample)
+            confident = [d for d in detections if d[1] >= stage.min_score]
+            if confident:
+                return confident
+        # Every stage was unsure: fall back to the last (strongest) detector's output
+        return detections
+
+
+BACKENDS = {
+    'hog': HogDetector,
+    'haar': HaarDetector,
+    'dnn': DnnDetector
+}
+
+_instances = {}
+_instances_lock = threading.Lock()
+
+
+def get_detector(name=None):
+    """Shared detector instance by name ('hog', 'haar', 'dnn' or 'cascade')"""
+    name = name or DETECTOR
+    with _instances_lock:
+        if name not in _instances:
+            if name == 'cascade':
+                stages = []
+                for stage_name in [s.strip() for s in CASCADE_ORDER.split(',') if s.strip()]:
+                    try:
+                        stages.append(BACKENDS[stage_name]())
+                    except FileNotFoundError as e:
+                        logger.warning("Skipping %s in detector cascade: %s", stage_name, e)
+                _instances[name] = CascadeDetector(stages)
+            elif name in BACKENDS:
+                _instances[name] = BACKENDS[name]()
+            else:
+                raise ValueError(f"Unknown detector '{name}'. Choose from: {', '.join(list(BACKENDS) + ['cascade'])}")
+        return _instances[name]
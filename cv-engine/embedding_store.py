@@ -0,0 +1,392 @@
+"""
+Persistent embedding store shared by the CV engine scripts.
+
+On-disk layout (one directory):
+    manifest.json          {"generation": n, "dim": 128} - replaced atomically
+    vectors-<n>.f32        fixed-width float32 rows, append-only
+    journal-<n>.jsonl      ID table as an append-only log of add/del/rename ops
+    store.lock             taken (flock) by every writer
+
+Enrollments append one row and one journal line (O(1)), deletes write a
+tombstone, and compact() rewrites live rows into a new generation which is
+published by swapping the manifest. Vectors are loaded through np.memmap so
+startup does not read the whole gallery into memory.
+
+The server and the CLI scripts may open the same store at once. Every
+mutation holds an exclusive lock on store.lock and first catches up with
+whatever other processes wrote (a new generation or new journal lines), so
+rows are always appended at the true end of the store. Readers see other
+processes' writes after their own next mutation or a reopen.
+"""
+import contextlib
+import json
+import logging
+import os
+import pickle
+import threading
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:
+    # Windows: writers are only serialized within one process
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+ENCODING_DIM = 128
+DEFAULT_STORE_DIR = 'student_embeddings'
+LEGACY_EMBEDDINGS_FILE = 'student_embeddings.pkl'
+
+# Compact once tombstoned rows outnumber this fraction of all rows
+COMPACTION_RATIO = 0.25
+LOCK_FILE = 'store.lock'
+
+
+def _fsync_write(path, data):
+    """Write bytes to a temporary file and atomically move it into place"""
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+class EmbeddingStore:
+    """Float32 encoding matrix plus a student ID table"""
+
+    def __init__(self, path=DEFAULT_STORE_DIR, dim=ENCODING_DIM):
+        self.path = path
+        self.dim = dim
+        self._lock = threading.RLock()
+        self._lock_file = None
+        self._lock_depth = 0
+        self.generation = None
+        os.makedirs(path, exist_ok=True)
+        # Entering the writer lock loads the store (and repairs a torn journal) safely
+        with self._writing():
+            pass
+
+    # ------------------------------------------------------------------
+    # Loading
+    # ------------------------------------------------------------------
+
+    def _manifest_path(self):
+        return os.path.join(self.path, 'manifest.json')
+
+    def _vectors_path(self, generation=None):
+        return os.path.join(self.path, f'vectors-{self.generation if generation is None else generation}.f32')
+
+    def _journal_path(self, generation=None):
+        return os.path.join(self.path, f'journal-{self.generation if generation is None else generation}.jsonl')
+
+    @contextlib.contextmanager
+    def _writing(self):
+        """Thread and process lock for a mutation, entered with the latest on-disk state loaded"""
+        with self._lock:
+            if self._lock_depth == 0:
+                self._lock_file = open(os.path.join(self.path, LOCK_FILE), 'a')
+                try:
+                    if fcntl is not None:
+                        fcntl.flock(self._lock_file.fileno(), fcntl.LOCK_EX)
+                    self._refresh()
+                except BaseException:
+                    self._lock_file.close()
+                    self._lock_file = None
+                    raise
+            self._lock_depth += 1
+            try:
+                yield
+            finally:
+                self._lock_depth -= 1
+                if self._lock_depth == 0:
+                    # Closing the file releases the flock
+                    self._lock_file.close()
+                    self._lock_file = None
+
+    def _refresh(self):
+        """Catch up with the manifest and journal lines written by other processes"""
+        if os.path.exists(self._manifest_path()):
+            with open(self._manifest_path(), 'r') as f:
+                manifest = json.load(f)
+            if manifest.get('dim', self.dim) != self.dim:
+                raise ValueError(f"Store dimension {manifest['dim']} does not match expected {self.dim}")
+            generation = manifest['generation']
+        else:
+            generation = 0
+            self._write_manifest(generation)
+
+        if generation != self.generation:
+            # First load, or another process compacted the store
+            self.generation = generation
+            # Row index -> student ID, None marks a tombstone
+            self._row_ids = []
+            # Bytes of the journal applied so far (always the end of a complete line)
+            self._journal_size = 0
+            self._mmap = None
+            self._live_cache = None
+
+        applied = self._journal_size
+        self._read_journal()
+        if self._journal_size != applied:
+            self._live_cache = None
+
+    def _read_journal(self):
+        """Apply the journal lines after _journal_size, cutting off a torn last line"""
+        journal_path = self._journal_path()
+        if not os.path.exists(journal_path):
+            return
+        with open(journal_path, 'rb') as f:
+            f.seek(self._journal_size)
+            for line in f:
+                if not line.endswith(b'\n'):
+                    break
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    break
+                self._apply(entry)
+                self._journal_size += len(line)
+        if os.path.getsize(journal_path) > self._journal_size:
+            # Torn write from a crash - everything before it is intact. Cut it off so the
+            # next append starts on a line of its own instead of being glued onto the fragment.
+            logger.warning("Dropping torn journal entry at byte %d of %s", self._journal_size, journal_path)
+            os.truncate(journal_path, self._journal_size)
+
+    def _apply(self, entry):
+        op = entry['op']
+        row = entry['row']
+        if op == 'add':
+            # Rows are appended in order; anything else means two writers went unserialized
+            if row != len(self._row_ids):
+                raise ValueError(f'Journal adds row {row} to a store of {len(self._row_ids)} rows')
+            self._row_ids.append(entry['id'])
+            return
+        if not 0 <= row < len(self._row_ids):
+            raise ValueError(f"Journal {op} of row {row} outside a store of {len(self._row_ids)} rows")
+        if op == 'del':
+            self._row_ids[row] = None
+        elif op == 'rename':
+            self._row_ids[row] = entry['id']
+
+    def _write_manifest(self, generation):
+        manifest = json.dumps({'generation': generation, 'dim': self.dim}).encode()
+        _fsync_write(self._manifest_path(), manifest)
+
+    def _vectors(self):
+        """Memory-mapped view of every row in the current generation"""
+        if self._mmap is None or len(self._mmap) < len(self._row_ids):
+            rows = len(self._row_ids)
+            if rows == 0:
+                self._mmap = np.empty((0, self.dim), dtype=np.float32)
+            else:
+                self._mmap = np.memmap(self._vectors_path(), dtype=np.float32, mode='r', shape=(rows, self.dim))
+        return self._mmap[:len(self._row_ids)]
+
+    # ------------------------------------------------------------------
+    # Read access
+    # ------------------------------------------------------------------
+
+    def __len__(self):
+        return len(self.student_ids)
+
+    def __contains__(self, student_id):
+        return student_id in self._row_ids
+
+    @property
+    def student_ids(self):
+        """Student ID of every live row, in row order"""
+        return [student_id for student_id in self._row_ids if student_id is not None]
+
+    @property
+    def tombstones(self):
+        return sum(1 for student_id in self._row_ids if student_id is None)
+
+    def matrix(self):
+        """Live encodings as a float32 (N, dim) array aligned with student_ids
+
+        Without tombstones this is the memory-mapped file itself (no copy).
+        """
+        with self._lock:
+            if self._live_cache is None:
+                vectors = self._vectors()
+                if self.tombstones:
+                    live = np.fromiter((sid is not None for sid in self._row_ids), dtype=bool, count=len(self._row_ids))
+                    vectors = np.ascontiguousarray(vectors[live])
+                self._live_cache = vectors
+            return self._live_cache
+
+    def snapshot(self):
+        """(matrix(), student_ids) read together, so a concurrent write cannot misalign them"""
+        with self._lock:
+            return self.matrix(), self.student_ids
+
+    def encodings_for(self, student_id):
+        """All encodings stored for one student"""
+        rows = [i for i, sid in enumerate(self._row_ids) if sid == student_id]
+        return np.array(self._vectors()[rows])
+
+    # ------------------------------------------------------------------
+    # Mutations
+    # ------------------------------------------------------------------
+
+    def _journal(self, entries):
+        data = ''.join(json.dumps(entry) + '\n' for entry in entries).encode()
+        with open(self._journal_path(), 'ab') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        self._journal_size += len(data)
+        for entry in entries:
+            self._apply(entry)
+        self._live_cache = None
+
+    def add(self, student_id, encoding):
+        """Append one encoding for a student (O(1))"""
+        return self.add_many([student_id], [encoding])[0]
+
+    def add_many(self, student_ids, encodings):
+        """Append several encodings with a single write and journal flush"""
+        return self._append(student_ids, encodings)
+
+    def _append(self, student_ids, encodings, removed_rows=()):
+        """Write vectors, then journal the removals and additions in one flush"""
+        vectors = np.ascontiguousarray(np.asarray(encodings, dtype=np.float32).reshape(-1, self.dim))
+        if len(vectors) != len(student_ids):
+            raise ValueError(f'{len(vectors)} encodings for {len(student_ids)} student IDs')
+
+        with self._writing():
+            first_row = len(self._row_ids)
+            # Vectors first: a crash before the journal write leaves an orphan row that is never referenced
+            vectors_path = self._vectors_path()
+            with open(vectors_path, 'r+b' if os.path.exists(vectors_path) else 'wb') as f:
+                f.seek(first_row * self.dim * 4)
+                # Never truncate: past our rows there is at most an orphan from a crashed write
+                f.write(vectors.tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+            rows = list(range(first_row, first_row + len(vectors)))
+            self._journal([{'op': 'del', 'row': row} for row in removed_rows] + [
+                {'op': 'add', 'row': row, 'id': str(student_id)}
+                for row, student_id in zip(rows, student_ids)
+            ])
+            return rows
+
+    def remove(self, student_id):
+        """Tombstone every row for a student; returns the number removed"""
+        with self._writing():
+            rows = [i for i, sid in enumerate(self._row_ids) if sid == student_id]
+            if rows:
+                self._journal([{'op': 'del', 'row': row} for row in rows])
+                self.maybe_compact()
+            return len(rows)
+
+    def replace(self, student_id, encoding):
+        """Drop any existing encodings for a student and store a new one"""
+        with self._writing():
+            rows = [i for i, sid in enumerate(self._row_ids) if sid == student_id]
+            if rows:
+                self._journal([{'op': 'del', 'row': row} for row in rows])
+            row = self.add(student_id, encoding)
+            self.maybe_compact()
+            return row
+
+    def add_sample(self, student_id, encoding, max_samples):
+        """Append another encoding for a student, dropping their oldest beyond max_samples"""
+        with self._writing():
+            rows = [i for i, sid in enumerate(self._row_ids) if sid == student_id]
+            # Rows are append-only, so the lowest rows are the oldest samples
+            removed = rows[:max(0, len(rows) - max_samples + 1)]
+            row = self._append([student_id], [encoding], removed)[0]
+            self.maybe_compact()
+            return row
+
+    def add_samples(self, student_ids, encodings, max_samples):
+        """Bulk add_sample (one encoding per student) in one commit"""
+        with self._writing():
+            student_rows = {}
+            for row, sid in enumerate(self._row_ids):
+                if sid is not None:
+                    student_rows.setdefault(sid, []).append(row)
+            removed = []
+            for student_id in student_ids:
+                rows = student_rows.get(str(student_id), [])
+                removed.extend(rows[:max(0, len(rows) - max_samples + 1)])
+            rows = self._append(student_ids, encodings, removed)
+            self.maybe_compact()
+            return rows
+
+    def replace_many(self, student_ids, encodings):
+        """Bulk replace: drop existing encodings of these students and append the new ones in one commit"""
+        with self._writing():
+            wanted = {str(student_id) for student_id in student_ids}
+            removed = [i for i, sid in enumerate(self._row_ids) if sid in wanted]
+            rows = self._append(student_ids, encodings, removed)
+            self.maybe_compact()
+            return rows
+
+    def rename(self, old_id, new_id):
+        """Change a student ID without touching the vectors; returns False if old_id is unknown"""
+        with self._writing():
+            rows = [i for i, sid in enumerate(self._row_ids) if sid == old_id]
+            if rows:
+                self._journal([{'op': 'rename', 'row': row, 'id': str(new_id)} for row in rows])
+            return bool(rows)
+
+    def maybe_compact(self):
+        if self._row_ids and self.tombstones > COMPACTION_RATIO * len(self._row_ids):
+            self.compact()
+
+    def compact(self):
+        """Rewrite live rows into a new generation and drop tombstones"""
+        with self._writing():
+            self.rewrite(self.student_ids, self.matrix())
+
+    def rewrite(self, student_ids, encodings):
+        """Atomically replace the whole store contents (used for compaction and full re-enrollment)"""
+        vectors = np.ascontiguousarray(np.asarray(encodings, dtype=np.float32).reshape(-1, self.dim))
+        if len(vectors) != len(student_ids):
+            raise ValueError(f'{len(vectors)} encodings for {len(student_ids)} student IDs')
+
+        with self._writing():
+            old_generation = self.generation
+            new_generation = old_generation + 1
+            _fsync_write(self._vectors_path(new_generation), vectors.tobytes())
+            journal = ''.join(
+                json.dumps({'op': 'add', 'row': row, 'id': str(student_id)}) + '\n'
+                for row, student_id in enumerate(student_ids)
+            )
+            _fsync_write(self._journal_path(new_generation), journal.encode())
+
+            # Publishing the manifest is the commit point
+            self._write_manifest(new_generation)
+            self.generation = new_generation
+            self._row_ids = [str(student_id) for student_id in student_ids]
+            self._journal_size = os.path.getsize(self._journal_path())
+            self._mmap = None
+            self._live_cache = None
+
+            for path in (self._vectors_path(old_generation), self._journal_path(old_generation)):
+                if os.path.exists(path):
+                    os.remove(path)
+
+    def import_legacy_pickle(self, pickle_path=LEGACY_EMBEDDINGS_FILE):
+        """Load the old {'encodings': [...], 'student_ids': [...]} pickle into the store"""
+        with open(pickle_path, 'rb') as f:
+            data = pickle.load(f)
+        self.rewrite(data['student_ids'], data['encodings'])
+        return len(data['student_ids'])
+
+
+def open_store(path=DEFAULT_STORE_DIR, legacy_pickle=LEGACY_EMBEDDINGS_FILE):
+    """Open the embedding store, importing the legacy pickle on first use"""
+    store = EmbeddingStore(path)
+    if legacy_pickle and os.path.exists(legacy_pickle):
+        # Under the writer lock, so only one of several processes starting together imports it
+        with store._writing():
+            if store.generation == 0 and store._journal_size == 0:
+                count = store.import_legacy_pickle(legacy_pickle)
+                logger.info("Imported %d embeddings from %s into %s/", count, legacy_pickle, path)
+    return store
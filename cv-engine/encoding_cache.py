@@ -0,0 +1,146 @@
+"""
+Content-addressed cache of face detection + encoding results.
+
+Entries are keyed by the SHA-256 of the image bytes together with the
+detection/encoding configuration (face_pipeline.pipeline_signature()), so a
+change of detector, downscale size or model never serves stale results.
+A cached image skips decoding, detection and the ResNet encoder entirely.
+
+Entries live in a SQLite file (safe to share between the server and
+migrate_embeddings.py), bounded to CV_ENCODING_CACHE_SIZE images with
+least-recently-used eviction. Set CV_ENCODING_CACHE_SIZE=0 to disable.
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+import numpy as np
+
+from face_pipeline import pipeline_signature
+
+ENCODING_CACHE_PATH = os.environ.get('CV_ENCODING_CACHE', 'encoding_cache.sqlite3')
+ENCODING_CACHE_SIZE = int(os.environ.get('CV_ENCODING_CACHE_SIZE', 10000))
+ENCODING_DIM = 128
+
+
+class EncodingCache:
+    """LRU-bounded, persistent map of image content -> (image_shape, faces)
+
+    faces has the detect_and_encode_bytes layout: [{'encoding', 'coordinates'}]
+    with coordinates as (x, y, w, h).
+    """
+
+    def __init__(self, path=ENCODING_CACHE_PATH, max_entries=ENCODING_CACHE_SIZE, signature=None):
+        self.path = path
+        self.max_entries = max_entries
+        self.signature = signature or pipeline_signature()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._db = None
+        if self.enabled:
+            self._db = sqlite3.connect(path, check_same_thread=False, timeout=30)
+            self._db.execute('PRAGMA journal_mode=WAL')
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS encodings ('
+                ' key TEXT PRIMARY KEY, shape TEXT, coordinates TEXT, encodings BLOB, last_used REAL)'
+            )
+            self._db.execute('CREATE INDEX IF NOT EXISTS encodings_last_used ON encodings (last_used)')
+            self._db.commit()
+
+    @property
+    def enabled(self):
+        return self.max_entries > 0
+
+    def key(self, image_bytes):
+        digest = hashlib.sha256(image_bytes).hexdigest()
+        return hashlib.sha256(f'{self.signature}:{digest}'.encode()).hexdigest()
+
+    def get(self, image_bytes):
+        """Cached (image_shape, faces) for these image bytes, or None"""
+        if not self.enabled:
+            return None
+        key = self.key(image_bytes)
+        with self._lock:
+            row = self._db.execute(
+                'SELECT shape, coordinates, encodings FROM encodings WHERE key = ?', (key,)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._db.execute('UPDATE encodings SET last_used = ? WHERE key = ?', (time.time(), key))
+            self._db.commit()
+
+        shape, coordinates, blob = row
+        encodings = np.frombuffer(blob, dtype=np.float64).reshape(-1, ENCODING_DIM)
+        faces = [
+            {'encoding': encoding.copy(), 'coordinates': tuple(coords)}
+            for encoding, coords in zip(encodings, json.loads(coordinates))
+        ]
+        return tuple(json.loads(shape)), faces
+
+    def put(self, image_bytes, image_shape, faces):
+        """Store the result for these image bytes, evicting least-recently-used entries"""
+        if not self.enabled:
+            return
+        key = self.key(image_bytes)
+        coordinates = json.dumps([[int(v) for v in face['coordinates']] for face in faces])
+        blob = np.asarray([face['encoding'] for face in faces], dtype=np.float64).reshape(-1, ENCODING_DIM).tobytes()
+        with self._lock:
+            self._db.execute(
+                'INSERT OR REPLACE INTO encodings (key, shape, coordinates, encodings, last_used) VALUES (?, ?, ?, ?, ?)',
+                (key, json.dumps([int(v) for v in image_shape]), coordinates, blob, time.time())
+            )
+            count = self._db.execute('SELECT COUNT(*) FROM encodings').fetchone()[0]
+            if count > self.max_entries:
+                excess = count - self.max_entries
+                self._db.execute(
+                    'DELETE FROM encodings WHERE key IN (SELECT key FROM encodings ORDER BY last_used LIMIT ?)',
+                    (excess,)
+                )
+                self.evictions += excess
+            self._db.commit()
+
+    def get_or_compute(self, image_bytes, compute):
+        """Cached result, or compute(image_bytes) -> (image_shape, faces, timings) and store it
+
+        Returns:
+            tuple: (image_shape, faces, timings); timings is {'cache_ms': ...} on a hit
+        """
+        start = time.perf_counter()
+        cached = self.get(image_bytes)
+        if cached is not None:
+            return cached[0], cached[1], {'cache_ms': round((time.perf_counter() - start) * 1000, 2)}
+        image_shape, faces, timings = compute(image_bytes)
+        self.put(image_bytes, image_shape, faces)
+        return image_shape, faces, timings
+
+    def __len__(self):
+        if not self.enabled:
+            return 0
+        with self._lock:
+            return self._db.execute('SELECT COUNT(*) FROM encodings').fetchone()[0]
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'enabled': self.enabled,
+            'entries': len(self),
+            'max_entries': self.max_entries,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / lookups, 3) if lookups else None,
+            'evictions': self.evictions
+        }
+
+    def clear(self):
+        if not self.enabled:
+            return
+        with self._lock:
+            self._db.execute('DELETE FROM encodings')
+            self._db.commit()
@@ -2,33 +2,23 @@ import os
 import cv2
 import face_recognition
 import numpy as np
-import pickle
 import requests
 from PIL import Image
 from io import BytesIO
+from embedding_store import open_store
 
 class StudentEnrollment:
-    def __init__(self, embeddings_file='student_embeddings.pkl', models_dir='../client/public/models'):
-        self.embeddings_file = embeddings_file
+    def __init__(self, embeddings_dir='student_embeddings', models_dir='../client/public/models'):
+        self.embeddings_dir = embeddings_dir
         self.models_dir = models_dir
+        self.store = open_store(embeddings_dir)
         self.known_face_encodings = []
         self.known_student_ids = []
         self.load_embeddings()
     
     def load_embeddings(self):
-        if os.path.exists(self.embeddings_file):
-            with open(self.embeddings_file, 'rb') as f:
-                data = pickle.load(f)
-                self.known_face_encodings = data['encodings']
-                self.known_student_ids = data['student_ids']
-    
-    def save_embeddings(self):
-        data = {
-            'encodings': self.known_face_encodings,
-            'student_ids': self.known_student_ids
-        }
-        with open(self.embeddings_file, 'wb') as f:
-            pickle.dump(data, f)
+        self.known_face_encodings = self.store.matrix()
+        self.known_student_ids = self.store.student_ids
     
     def process_enrollment_photo(self, student_id):
         """Process a new student's enrollment photo from models directory and add to embeddings"""
@@ -75,12 +65,9 @@ class StudentEnrollment:
                         'message': f'Face already registered with student ID: {matched_id}'
                     }
             
-            # Add new face encoding
-            self.known_face_encodings.append(face_encoding)
-            self.known_student_ids.append(student_id)
-            
-            # Save updated embeddings
-            self.save_embeddings()
+            # Append the new face encoding to the store (no full rewrite)
+            self.store.add(student_id, face_encoding)
+            self.load_embeddings()
             
             # Process and save cropped face
             top, right, bottom, left = face_locations[0]
@@ -0,0 +1,53 @@
+"""
+Lazily loaded dlib models used by the recognition pipeline.
+
+Importing face_recognition loads every model it ships (both landmark
+predictors, the CNN detector and the ResNet encoder), which costs well over a
+second before any engine code runs. The pipeline only needs the 5-point
+landmark predictor and the encoder, so they are loaded here on first use,
+once per process, and shared by every thread. face_pipeline.warmup() loads
+them ahead of the first request.
+"""
+import threading
+
+ENCODER_MODEL_FILE = 'dlib_face_recognition_resnet_model_v1.dat'
+
+_models = {}
+_lock = threading.Lock()
+
+
+def _load(name, factory):
+    model = _models.get(name)
+    if model is None:
+        with _lock:
+            model = _models.get(name)
+            if model is None:
+                model = _models[name] = factory()
+    return model
+
+
+def _shape_predictor():
+    import dlib
+    import face_recognition_models
+    return dlib.shape_predictor(face_recognition_models.pose_predictor_five_point_model_location())
+
+
+def _face_encoder():
+    import dlib
+    import face_recognition_models
+    return dlib.face_recognition_model_v1(face_recognition_models.face_recognition_model_location())
+
+
+def shape_predictor():
+    """5-point landmark predictor (face_recognition's model='small')"""
+    return _load('shape_predictor', _shape_predictor)
+
+
+def face_encoder():
+    """ResNet face descriptor model producing 128-d encodings"""
+    return _load('face_encoder', _face_encoder)
+
+
+def loaded():
+    """Names of the models loaded so far"""
+    return sorted(_models)
@@ -0,0 +1,280 @@
+"""
+Face detection and encoding helpers shared by the Flask app and worker processes.
+
+Everything here works on RGB images (the layout face_recognition expects) and
+has no dependency on server.py, so it can be imported by detection workers
+without booting the web app.
+
+Detection runs (with the backend chosen in detectors.py) on a copy
+downscaled to DETECTION_MAX_EDGE pixels on the long edge (HOG cost grows with
+pixel count), boxes are mapped back, and encodings are computed from the
+original-resolution image. If fewer than DETECTION_MIN_FACES faces are found,
+detection is retried with one more upsampling step. Callers can pass a `timings` dict to collect per-stage
+milliseconds.
+
+Models are loaded lazily (see face_models.py), so importing this module is
+cheap; warmup() loads them and runs one dummy inference ahead of the first
+request.
+
+Uploads are decoded in memory straight to RGB. Large JPEGs are decoded at a
+reduced 1/2, 1/4 or 1/8 scale (libjpeg DCT scaling) as long as the long
+edge stays at least DECODE_MIN_EDGE pixels; face coordinates are always
+reported in the original image's pixels.
+"""
+import io
+import math
+import os
+import time
+
+import cv2
+import dlib
+import numpy as np
+from PIL import Image, ImageFile
+
+from detectors import CASCADE_ORDER, DETECTOR, get_detector
+from face_models import ENCODER_MODEL_FILE, face_encoder, shape_predictor
+
+# Decode truncated uploads as far as they go (importing face_recognition used to set this)
+ImageFile.LOAD_TRUNCATED_IMAGES = True
+
+# Long-edge size detection runs at (0 = always detect at full resolution)
+DETECTION_MAX_EDGE = int(os.environ.get('CV_DETECTION_MAX_EDGE', 1024))
+# Retry with extra upsampling when fewer faces than this are found
+DETECTION_MIN_FACES = int(os.environ.get('CV_DETECTION_MIN_FACES', 1))
+DETECTION_UPSAMPLE = 1
+# Smallest long edge a reduced JPEG decode may produce (0 = always decode at full size)
+DECODE_MIN_EDGE = int(os.environ.get('CV_DECODE_MIN_EDGE', 1600))
+FACE_CROP_SIZE = 200
+
+
+class StageTimer:
+    """Context manager adding elapsed milliseconds to timings[stage]"""
+
+    def __init__(self, timings, stage):
+        self.timings = timings
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        if self.timings is not None:
+            elapsed = (time.perf_counter() - self.start) * 1000
+            self.timings[self.stage] = round(self.timings.get(self.stage, 0.0) + elapsed, 2)
+        return False
+
+
+def pipeline_signature():
+    """Configuration string identifying what detect_and_encode_bytes would return
+
+    Anything that changes boxes or encodings belongs here; encoding caches key on it.
+    """
+    detector = f'cascade[{CASCADE_ORDER}]' if DETECTOR == 'cascade' else DETECTOR
+    return (
+        f'detector={detector};max_edge={DETECTION_MAX_EDGE};min_faces={DETECTION_MIN_FACES};'
+        f'upsample={DETECTION_UPSAMPLE};decode_min_edge={DECODE_MIN_EDGE};landmarks=small;jitters=1;'
+        f'encoder={ENCODER_MODEL_FILE}'
+    )
+
+
+def decode_image(source, min_edge=None):
+    """Decode image bytes or a file-like upload stream to an RGB uint8 array
+
+    Returns:
+        tuple: (rgb_image, image_shape) where image_shape is the original
+        (height, width, 3); rgb_image is smaller when the JPEG was draft-decoded
+    """
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        source = io.BytesIO(source)
+    img = Image.open(source)
+    width, height = img.size
+    min_edge = DECODE_MIN_EDGE if min_edge is None else min_edge
+    if min_edge and max(width, height) >= 2 * min_edge:
+        # JPEG (and MPO) only: draft() picks the largest DCT scale keeping at least this size; a no-op for other formats
+        ratio = min_edge / max(width, height)
+        img.draft('RGB', (math.ceil(width * ratio), math.ceil(height * ratio)))
+    if img.mode != 'RGB':
+        img = img.convert('RGB')
+    return np.array(img), (height, width, 3)
+
+
+def decode_scale(rgb_image, image_shape):
+    """Decoded size relative to the original image (1.0 unless draft-decoded)"""
+    return rgb_image.shape[1] / image_shape[1]
+
+
+def location_to_coordinates(location, scale=1.0):
+    """(top, right, bottom, left) in an image decoded at scale -> original-image (x, y, w, h)"""
+    top, right, bottom, left = location
+    if scale != 1.0:
+        top, right, bottom, left = (int(round(v / scale)) for v in (top, right, bottom, left))
+    return left, top, right - left, bottom - top
+
+
+def build_faces(face_encodings, face_locations, rgb_image, image_shape):
+    """[{'encoding', 'coordinates'}] with coordinates in original-image pixels"""
+    scale = decode_scale(rgb_image, image_shape)
+    return [
+        {
+            'encoding': encoding,
+            'coordinates': location_to_coordinates(location, scale)
+        }
+        for encoding, location in zip(face_encodings, face_locations)
+    ]
+
+
+def face_crop_jpeg(image, coordinates, size=FACE_CROP_SIZE):
+    """size x size JPEG of one face, from image bytes (or an RGB array) and original-image (x, y, w, h)"""
+    if isinstance(image, np.ndarray):
+        rgb_image, scale = image, 1.0
+    else:
+        rgb_image, image_shape = decode_image(image)
+        scale = decode_scale(rgb_image, image_shape)
+    x, y, w, h = (int(round(v * scale)) for v in coordinates)
+    crop = Image.fromarray(rgb_image[y:y+h, x:x+w]).resize((size, size), Image.BILINEAR)
+    out = io.BytesIO()
+    crop.save(out, 'JPEG', quality=95)
+    return out.getvalue()
+
+
+def locate_faces(rgb_image, max_edge=None, min_faces=None, timings=None, detector=None):
+    """Face locations in full-resolution (top, right, bottom, left) coordinates
+
+    Detection runs on a copy scaled down to max_edge with the configured
+    detector backend (see detectors.py); if it finds fewer than min_faces faces
+    and the backend supports it, it is retried once with an extra upsampling step.
+    """
+    detector = detector or get_detector()
+    max_edge = DETECTION_MAX_EDGE if max_edge is None else max_edge
+    min_faces = DETECTION_MIN_FACES if min_faces is None else min_faces
+    height, width = rgb_image.shape[:2]
+
+    scale = 1.0
+    small_image = rgb_image
+    if max_edge and max(height, width) > max_edge:
+        with StageTimer(timings, 'resize_ms'):
+            scale = max_edge / max(height, width)
+            small_image = cv2.resize(rgb_image, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+
+    with StageTimer(timings, 'detect_ms'):
+        locations = [location for location, _ in detector.detect(small_image, DETECTION_UPSAMPLE)]
+    if len(locations) < min_faces and detector.supports_upsample:
+        with StageTimer(timings, 'detect_retry_ms'):
+            retry_locations = [location for location, _ in detector.detect(small_image, DETECTION_UPSAMPLE + 1)]
+        if len(retry_locations) > len(locations):
+            locations = retry_locations
+
+    if scale == 1.0:
+        return locations
+    return [
+        (
+            max(0, int(round(top / scale))),
+            min(width, int(round(right / scale))),
+            min(height, int(round(bottom / scale))),
+            max(0, int(round(left / scale)))
+        )
+        for top, right, bottom, left in locations
+    ]
+
+
+def detect_faces_rgb(image_bytes, timings=None):
+    """Decode uploaded image bytes and find face locations
+
+    Returns:
+        tuple: (rgb_image, face_locations, image_shape) with locations as
+        (top, right, bottom, left) in rgb_image pixels and image_shape the
+        original size (see build_faces)
+    """
+    with StageTimer(timings, 'decode_ms'):
+        rgb_image, image_shape = decode_image(image_bytes)
+    face_locations = locate_faces(rgb_image, timings=timings)
+    return rgb_image, face_locations, image_shape
+
+
+def _landmarks(rgb_image, face_locations):
+    predictor = shape_predictor()
+    return [
+        predictor(rgb_image, dlib.rectangle(left, top, right, bottom))
+        for top, right, bottom, left in face_locations
+    ]
+
+
+def face_encodings(rgb_image, face_locations, num_jitters=1):
+    """128-d encoding of each face (same result as face_recognition.face_encodings with model='small')"""
+    encoder = face_encoder()
+    return [
+        np.array(encoder.compute_face_descriptor(rgb_image, shape, num_jitters))
+        for shape in _landmarks(rgb_image, face_locations)
+    ]
+
+
+def face_distance(known_encodings, face_encoding):
+    """Euclidean distance from one encoding to each known encoding"""
+    if len(known_encodings) == 0:
+        return np.empty(0)
+    return np.linalg.norm(np.asarray(known_encodings) - face_encoding, axis=1)
+
+
+def warmup():
+    """Load the detector, landmark and encoder models and run one dummy inference
+
+    Returns:
+        float: milliseconds taken
+    """
+    start = time.perf_counter()
+    blank = np.zeros((160, 160, 3), dtype=np.uint8)
+    locate_faces(blank, min_faces=0)
+    face_encodings(blank, [(16, 144, 144, 16)])
+    return round((time.perf_counter() - start) * 1000, 2)
+
+
+def batch_face_encodings(rgb_images, locations_per_image):
+    """Encode every face of every image with a single dlib descriptor call
+
+    Returns:
+        list: one list of 128-d encodings per image, aligned with its locations
+    """
+    batch_images, batch_faces, owners = [], [], []
+    for i, (rgb_image, face_locations) in enumerate(zip(rgb_images, locations_per_image)):
+        if not face_locations:
+            continue
+        shapes = dlib.full_object_detections()
+        for shape in _landmarks(rgb_image, face_locations):
+            shapes.append(shape)
+        batch_images.append(rgb_image)
+        batch_faces.append(shapes)
+        owners.append(i)
+    
+    encodings = [[] for _ in rgb_images]
+    if not batch_images:
+        return encodings
+    
+    encoder = face_encoder()
+    try:
+        descriptors = encoder.compute_face_descriptor(batch_images, batch_faces, 1)
+    except TypeError:
+        # dlib builds without the batch overload
+        descriptors = [encoder.compute_face_descriptor(img, faces, 1) for img, faces in zip(batch_images, batch_faces)]
+    
+    for owner, image_descriptors in zip(owners, descriptors):
+        encodings[owner] = [np.array(descriptor) for descriptor in image_descriptors]
+    return encodings
+
+
+def detect_and_encode_bytes(image_bytes):
+    """Decode, detect and encode every face in an uploaded image
+
+    Returns:
+        tuple: (image_shape, faces, timings) where faces is a list of dicts with
+        'encoding' (128-d array) and 'coordinates' (x, y, w, h), and timings
+        holds per-stage milliseconds
+    """
+    timings = {}
+    rgb_image, face_locations, image_shape = detect_faces_rgb(image_bytes, timings)
+    if not face_locations:
+        return image_shape, [], timings
+    # Encode from the decoded image even though detection was downscaled
+    with StageTimer(timings, 'encode_ms'):
+        encodings = face_encodings(rgb_image, face_locations)
+    return image_shape, build_faces(encodings, face_locations, rgb_image, image_shape), timings
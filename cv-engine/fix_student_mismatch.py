@@ -3,60 +3,41 @@
 Script to fix student ID mismatches between face recognition system and database
 """
 
-import pickle
 import os
 import sys
+from embedding_store import open_store
 
 def load_embeddings():
-    """Load current embeddings"""
-    if os.path.exists('student_embeddings.pkl'):
-        with open('student_embeddings.pkl', 'rb') as f:
-            return pickle.load(f)
-    return {'encodings': [], 'student_ids': []}
-
-def save_embeddings(data):
-    """Save embeddings back to file"""
-    with open('student_embeddings.pkl', 'wb') as f:
-        pickle.dump(data, f)
+    """Open the current embedding store"""
+    return open_store()
 
 def list_current_students():
     """List all students currently in the embeddings"""
-    data = load_embeddings()
+    store = load_embeddings()
     print("Current students in face recognition system:")
-    for i, student_id in enumerate(data['student_ids']):
+    for i, student_id in enumerate(store.student_ids):
         print(f"  {i}: Student ID {student_id}")
-    return data
+    return store
 
 def remove_student(student_id):
     """Remove a specific student from embeddings"""
-    data = load_embeddings()
+    store = load_embeddings()
     
-    if student_id not in data['student_ids']:
+    if not store.remove(student_id):
         print(f"Student {student_id} not found in embeddings")
         return False
     
-    # Find and remove the student
-    index = data['student_ids'].index(student_id)
-    data['student_ids'].pop(index)
-    data['encodings'].pop(index)
-    
-    save_embeddings(data)
     print(f"Removed student {student_id} from face recognition system")
     return True
 
 def update_student_id(old_id, new_id):
     """Update a student ID in the embeddings"""
-    data = load_embeddings()
+    store = load_embeddings()
     
-    if old_id not in data['student_ids']:
+    if not store.rename(old_id, new_id):
         print(f"Student {old_id} not found in embeddings")
         return False
     
-    # Update the student ID
-    index = data['student_ids'].index(old_id)
-    data['student_ids'][index] = new_id
-    
-    save_embeddings(data)
     print(f"Updated student ID from {old_id} to {new_id}")
     return True
 
@@ -65,10 +46,10 @@ def main():
     print()
     
     # List current students
-    data = list_current_students()
+    store = list_current_students()
     print()
     
-    if len(data['student_ids']) == 0:
+    if len(store) == 0:
         print("No students found in embeddings file")
         return
     
@@ -1,46 +1,53 @@
 import cv2
-import face_recognition
 import numpy as np
-import pickle
-import requests
 import os
 from datetime import datetime
 import time
+from attendance_dispatcher import AttendanceDispatcher, SightingWindow
+from embedding_store import open_store
+from face_pipeline import decode_image, face_encodings, locate_faces
+from matcher import GalleryMatcher
+from metrics import configure_logging
+from streaming import parse_source
+from tracking import FaceTracker
 
 class AttendanceSystem:
-    def __init__(self, embeddings_file='student_embeddings.pkl', backend_url='http://localhost:5000'):
-        self.embeddings_file = embeddings_file
+    def __init__(self, embeddings_dir='student_embeddings', backend_url='http://localhost:5000', store=None):
+        self.embeddings_dir = embeddings_dir
         self.backend_url = backend_url
+        # An already opened store may be passed in (e.g. by worker processes that must not import the legacy pickle)
+        self.store = store if store is not None else open_store(embeddings_dir)
         self.known_face_encodings = []
         self.known_student_ids = []
+        self.matcher = GalleryMatcher()
         self.load_embeddings()
         
         # Attendance tracking
         self.marked_today = set()
         self.recognition_threshold = 0.6
-        
+        self._dispatcher = None
+        
+    @property
+    def dispatcher(self):
+        """Created on first use, so recognition-only instances never build one"""
+        if self._dispatcher is None:
+            self._dispatcher = AttendanceDispatcher(self.backend_url)
+        return self._dispatcher
+    
     def load_embeddings(self):
-        """Load student face embeddings from file"""
-        if os.path.exists(self.embeddings_file):
-            try:
-                with open(self.embeddings_file, 'rb') as f:
-                    data = pickle.load(f)
-                    self.known_face_encodings = data['encodings']
-                    self.known_student_ids = data['student_ids']
-                print(f"Loaded {len(self.known_student_ids)} student embeddings")
-            except Exception as e:
-                print(f"Error loading embeddings: {e}")
+        """Load student face embeddings from the embedding store"""
+        self.known_face_encodings = self.store.matrix()
+        self.known_student_ids = self.store.student_ids
+        self.matcher.set_gallery(self.known_face_encodings, self.known_student_ids)
+        if self.known_student_ids:
+            print(f"Loaded {len(self.known_student_ids)} embeddings of {self.matcher.num_students} students")
         else:
-            print("No embeddings file found. Please train the system first.")
+            print("No embeddings found. Please train the system first.")
     
     def save_embeddings(self):
-        """Save student face embeddings to file"""
-        data = {
-            'encodings': self.known_face_encodings,
-            'student_ids': self.known_student_ids
-        }
-        with open(self.embeddings_file, 'wb') as f:
-            pickle.dump(data, f)
+        """Replace the store contents with the current embeddings in one atomic write"""
+        self.store.rewrite(self.known_student_ids, self.known_face_encodings)
+        self.load_embeddings()
         print(f"Saved {len(self.known_student_ids)} student embeddings")
     
     def train_from_images(self, image_folder):
@@ -60,8 +67,8 @@ class AttendanceSystem:
                     image_path = os.path.join(student_path, image_file)
                     
                     try:
-                        image = face_recognition.load_image_file(image_path)
-                        encodings = face_recognition.face_encodings(image)
+                        image, _ = decode_image(image_path, min_edge=0)
+                        encodings = face_encodings(image, locate_faces(image, max_edge=0, min_faces=0))
                         
                         if len(encodings) > 0:
                             self.known_face_encodings.append(encodings[0])
@@ -76,61 +83,39 @@ class AttendanceSystem:
         print(f"Training complete! Total students: {len(set(self.known_student_ids))}")
     
     def mark_attendance(self, student_ids, course_id):
-        """Send attendance to backend API"""
-        try:
-            url = f"{self.backend_url}/api/attendance/mark"
-            data = {
-                'studentIds': student_ids,
-                'courseId': course_id,
-                'confidence': 0.95
-            }
-            response = requests.post(url, json=data)
-            if response.status_code == 200:
-                print(f"Attendance marked for {len(student_ids)} students")
-                return True
-            else:
-                print(f"Error marking attendance: {response.text}")
-                return False
-        except Exception as e:
-            print(f"Error connecting to backend: {e}")
-            return False
+        """Send attendance to backend API now (spooled for a later retry if it is down)"""
+        if self.dispatcher.send(student_ids, course_id):
+            print(f"Attendance marked for {len(student_ids)} students")
+            return True
+        print(f"Backend unreachable, attendance for {len(student_ids)} students saved to {self.dispatcher.spool_path}")
+        return False
     
-    def recognize_faces(self, frame):
-        """Recognize faces in a frame"""
+    def recognize_faces(self, frame, scale=0.25):
+        """Recognize faces in a frame
+
+        Args:
+            frame: BGR image
+            scale: resize factor applied before detection (smaller is faster)
+        """
         # Resize frame for faster processing
-        small_frame = cv2.resize(frame, (0, 0), fx=0.25, fy=0.25)
+        small_frame = cv2.resize(frame, (0, 0), fx=scale, fy=scale)
         rgb_small_frame = cv2.cvtColor(small_frame, cv2.COLOR_BGR2RGB)
         
         # Find faces and encodings
-        face_locations = face_recognition.face_locations(rgb_small_frame)
-        face_encodings = face_recognition.face_encodings(rgb_small_frame, face_locations)
+        face_locations = locate_faces(rgb_small_frame, max_edge=0, min_faces=0)
+        encodings = face_encodings(rgb_small_frame, face_locations)
         
         recognized_students = []
         
-        for face_encoding, face_location in zip(face_encodings, face_locations):
-            # Compare with known faces
-            matches = face_recognition.compare_faces(
-                self.known_face_encodings, 
-                face_encoding,
-                tolerance=self.recognition_threshold
-            )
-            face_distances = face_recognition.face_distance(
-                self.known_face_encodings, 
-                face_encoding
-            )
-            
-            best_match_index = np.argmin(face_distances)
-            
-            if matches[best_match_index]:
-                student_id = self.known_student_ids[best_match_index]
-                confidence = 1 - face_distances[best_match_index]
+        # Compare every face with the whole gallery in one call
+        matches = self.matcher.best_matches(encodings, tolerance=self.recognition_threshold)
+        for match, face_location in zip(matches, face_locations):
+            if match:
+                student_id = match['student_id']
+                confidence = 1 - match['distance']
                 
                 # Scale back coordinates
-                top, right, bottom, left = face_location
-                top *= 4
-                right *= 4
-                bottom *= 4
-                left *= 4
+                top, right, bottom, left = (int(v / scale) for v in face_location)
                 
                 recognized_students.append({
                     'student_id': student_id,
@@ -141,7 +126,10 @@ class AttendanceSystem:
         return recognized_students
     
     def run_live_recognition(self, course_id, camera_index=0):
-        """Run live face recognition for attendance"""
+        """Run live face recognition for attendance
+
+        camera_index may also be an RTSP/HTTP URL or a video file path.
+        """
         print("Starting live recognition... Press 'q' to quit")
         
         video_capture = cv2.VideoCapture(camera_index)
@@ -150,8 +138,11 @@ class AttendanceSystem:
             print("Error: Could not open camera")
             return
         
-        frame_count = 0
-        process_every_n_frames = 5  # Process every 5th frame for performance
+        # Identities are voted across frames per track, so one lucky match does not mark anyone
+        tracker = FaceTracker(tolerance=self.recognition_threshold)
+        # Students are marked after a few consistent sightings, and sent in batches off the frame loop
+        sightings = SightingWindow()
+        self.dispatcher.start()
         
         while True:
             ret, frame = video_capture.read()
@@ -159,28 +150,26 @@ class AttendanceSystem:
                 print("Error: Could not read frame")
                 break
             
-            frame_count += 1
+            # Detection runs every few frames inside the tracker; other frames only move the boxes
+            tracks = tracker.process(frame, self.matcher)
+            recognized = [track for track in tracks if track.student_id is not None]
             
-            # Process frame
-            if frame_count % process_every_n_frames == 0:
-                recognized = self.recognize_faces(frame)
+            # Mark attendance for confirmed students
+            confirmed = sightings.observe([track.student_id for track in recognized])
+            new_students = [student_id for student_id in confirmed if student_id not in self.marked_today]
+            if new_students:
+                self.dispatcher.submit(new_students, course_id)
+                self.marked_today.update(new_students)
+            
+            for track in recognized:
+                # Draw rectangle and label
+                top, right, bottom, left = track.location
+                cv2.rectangle(frame, (left, top), (right, bottom), (0, 255, 0), 2)
                 
-                # Mark attendance for recognized students
-                for student in recognized:
-                    student_id = student['student_id']
-                    
-                    if student_id not in self.marked_today:
-                        self.mark_attendance([student_id], course_id)
-                        self.marked_today.add(student_id)
-                    
-                    # Draw rectangle and label
-                    top, right, bottom, left = student['location']
-                    cv2.rectangle(frame, (left, top), (right, bottom), (0, 255, 0), 2)
-                    
-                    label = f"{student_id} ({student['confidence']:.2f})"
-                    cv2.rectangle(frame, (left, bottom - 35), (right, bottom), (0, 255, 0), cv2.FILLED)
-                    cv2.putText(frame, label, (left + 6, bottom - 6), 
-                               cv2.FONT_HERSHEY_DUPLEX, 0.6, (255, 255, 255), 1)
+                label = f"{track.student_id} ({track.confidence:.2f})"
+                cv2.rectangle(frame, (left, bottom - 35), (right, bottom), (0, 255, 0), cv2.FILLED)
+                cv2.putText(frame, label, (left + 6, bottom - 6), 
+                           cv2.FONT_HERSHEY_DUPLEX, 0.6, (255, 255, 255), 1)
             
             # Display info
             cv2.putText(frame, f"Marked: {len(self.marked_today)}", (10, 30),
@@ -197,6 +186,8 @@ class AttendanceSystem:
         
         video_capture.release()
         cv2.destroyAllWindows()
+        # Flush the last batch before reporting
+        self.dispatcher.close()
         
         print(f"\nSession ended. Total students marked: {len(self.marked_today)}")
 
@@ -209,7 +200,8 @@ def main():
         print("\n=== Automated Attendance System ===")
         print("1. Train system with images")
         print("2. Start live recognition")
-        print("3. Exit")
+        print("3. Process recorded lecture video")
+        print("4. Exit")
         
         choice = input("\nEnter your choice: ")
         
@@ -222,12 +214,27 @@ def main():
         
         elif choice == '2':
             course_id = input("Enter Course ID: ")
-            camera = input("Enter camera index (default 0): ")
-            camera_idx = int(camera) if camera else 0
-            system.run_live_recognition(course_id, camera_idx)
+            camera = input("Enter camera index, RTSP URL or video file (default 0): ")
+            system.run_live_recognition(course_id, parse_source(camera) if camera else 0)
             system.marked_today.clear()  # Reset for next session
         
         elif choice == '3':
+            from video_attendance import process_video
+            video_path = input("Enter path to lecture video: ")
+            if not os.path.exists(video_path):
+                print("Video not found!")
+                continue
+            course_id = input("Enter Course ID: ")
+            report = process_video(video_path, embeddings_dir=system.embeddings_dir)
+            print(f"Processed {report['duration_seconds']}s of video in {report['processing_seconds']}s")
+            for record in report['students']:
+                print(f"  {record['student_id']}: visible {record['total_seconds']}s "
+                      f"({record['first_seen']}s - {record['last_seen']}s)")
+            present = [record['student_id'] for record in report['students'] if record['total_seconds'] >= 60]
+            if present:
+                system.mark_attendance(present, course_id)
+        
+        elif choice == '4':
             print("Goodbye!")
             break
         
@@ -236,4 +243,5 @@ def main():
 
 
 if __name__ == "__main__":
+    configure_logging()
     main()
\ No newline at end of file
@@ -0,0 +1,463 @@
+"""
+Vectorized gallery matching for 128-d face encodings.
+
+The gallery is kept as one contiguous float32 (N, 128) matrix so that every
+detected face can be scored against every enrolled student with a single
+batched NumPy call instead of a Python loop over face_distance().
+
+A student may have several encodings (samples). Each student then also
+gets one representative vector (centroid or medoid of their samples); a
+query is first scored against the representatives, and only the closest
+students' individual samples are scored to re-rank them, so matching cost
+follows the number of students rather than the number of samples. Exact
+search (and find_duplicate) scores every sample.
+
+An optional approximate index (see ann_index.IVFIndex) can be attached for
+large galleries; callers can still force exact search per request.
+CourseGalleries keeps cached per-course views so attendance for one course
+only scores that course's roster.
+"""
+import copy
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+ENCODING_DIM = 128
+DEFAULT_TOLERANCE = 0.6
+# Representative per multi-sample student: 'centroid' (mean) or 'medoid' (most central sample)
+GALLERY_AGGREGATE = os.environ.get('CV_GALLERY_AGGREGATE', 'centroid')
+# Students whose samples are re-ranked per requested candidate (at least RERANK_MIN)
+RERANK_FACTOR = 4
+RERANK_MIN = 8
+
+
+def distance_to_confidence(distances):
+    """Vectorized distance-to-confidence mapping
+
+    0.4 distance or less = 1.0 confidence, 1.0 distance or more = 0.0 confidence,
+    linear in between.
+    """
+    distances = np.asarray(distances, dtype=np.float32)
+    return np.clip(1.0 - (distances - 0.4) / 0.6, 0.0, 1.0)
+
+
+def as_encoding_matrix(encodings):
+    """Convert a list of encodings (or a single encoding) to a contiguous float32 (N, 128) matrix"""
+    if encodings is None or len(encodings) == 0:
+        return np.empty((0, ENCODING_DIM), dtype=np.float32)
+    matrix = np.asarray(encodings, dtype=np.float32)
+    return np.ascontiguousarray(matrix.reshape(-1, ENCODING_DIM))
+
+
+def find_duplicate_pairs(encodings, tolerance=DEFAULT_TOLERANCE, block_size=1024):
+    """All (i, j) pairs with j < i whose encodings are within tolerance
+
+    One blocked pairwise-distance pass, so memory stays at block_size x N floats.
+    """
+    matrix = as_encoding_matrix(encodings)
+    sq_norms = np.einsum('ij,ij->i', matrix, matrix)
+    pairs = []
+    for start in range(0, len(matrix), block_size):
+        block = matrix[start:start + block_size]
+        # Only earlier rows can be the original of a duplicate
+        sq_distances = sq_norms[start:start + len(block), None] + sq_norms[None, :start + len(block)] \
+            - 2.0 * block @ matrix[:start + len(block)].T
+        rows, cols = np.nonzero(sq_distances <= tolerance * tolerance)
+        rows = rows + start
+        earlier = cols < rows
+        pairs.extend(zip(rows[earlier].tolist(), cols[earlier].tolist()))
+    return pairs
+
+
+def _squared_distances(queries, points, point_sq_norms):
+    # ||q - g||^2 = ||q||^2 + ||g||^2 - 2 q.g
+    sq_dist = queries @ points.T
+    sq_dist *= -2.0
+    sq_dist += np.einsum('ij,ij->i', queries, queries)[:, None]
+    sq_dist += point_sq_norms[None, :]
+    return np.maximum(sq_dist, 0.0, out=sq_dist)
+
+
+def representatives(matrix, row_identity, num_identities, aggregate=GALLERY_AGGREGATE):
+    """One vector per identity: the mean of its samples, or the sample closest to all others"""
+    counts = np.bincount(row_identity, minlength=num_identities).astype(np.float32)
+    if aggregate == 'medoid':
+        reps = np.empty((num_identities, matrix.shape[1]), dtype=np.float32)
+        order = np.argsort(row_identity, kind='stable')
+        starts = np.concatenate([[0], np.cumsum(counts.astype(int))])
+        for identity in range(num_identities):
+            rows = order[starts[identity]:starts[identity + 1]]
+            samples = matrix[rows]
+            sq_norms = np.einsum('ij,ij->i', samples, samples)
+            spread = np.sqrt(_squared_distances(samples, samples, sq_norms)).sum(axis=1)
+            reps[identity] = samples[int(np.argmin(spread))]
+        return reps
+
+    sums = np.zeros((num_identities, matrix.shape[1]), dtype=np.float32)
+    np.add.at(sums, row_identity, matrix)
+    return sums / counts[:, None]
+
+
+class GallerySnapshot:
+    """One gallery and everything derived from it; never modified once published
+
+    matrix/student_ids hold one row per sample; identities lists each student once.
+    """
+
+    def __init__(self, encodings, student_ids, version=0):
+        matrix = as_encoding_matrix(encodings)
+        if len(matrix) != len(student_ids):
+            raise ValueError(f'Gallery size mismatch: {len(matrix)} encodings vs {len(student_ids)} student IDs')
+
+        self.version = version
+        self.matrix = matrix
+        self.student_ids = list(student_ids)
+        # Squared norms are cached so distances reduce to one matrix product
+        self.sq_norms = np.einsum('ij,ij->i', matrix, matrix)
+
+        positions = {}
+        self.row_identity = np.array(
+            [positions.setdefault(student_id, len(positions)) for student_id in self.student_ids], dtype=np.int64
+        )
+        self.identities = list(positions)
+        self.identity_position = positions
+        self.multi_sample = len(self.identities) < len(self.student_ids)
+        self.identity_rows = None
+        if self.multi_sample:
+            identity_rows = [[] for _ in self.identities]
+            for row, identity in enumerate(self.row_identity):
+                identity_rows[identity].append(row)
+            self.identity_rows = [np.array(rows) for rows in identity_rows]
+            self.reps = representatives(matrix, self.row_identity, len(self.identities))
+        else:
+            # One sample per student: the rows are the representatives
+            self.reps = matrix
+        self.rep_sq_norms = np.einsum('ij,ij->i', self.reps, self.reps)
+        # Filled in by GalleryMatcher before the snapshot is published
+        self.index_lists = None
+
+
+class GalleryMatcher:
+    """Scores face encodings against the whole gallery in one batched call
+
+    Results are per student: the distance of their closest sample.
+
+    The gallery lives in one GallerySnapshot. set_gallery() builds a new one
+    and publishes it with a single assignment, and every query reads the
+    snapshot once, so a request that overlaps an enrollment scores either the
+    old gallery or the new one, never a mix of both.
+
+    With background_training the index's k-means runs on a worker thread:
+    queries use exact search until the first training finishes, and a
+    drifted index keeps serving with its old centroids until the new ones
+    are ready.
+    """
+
+    def __init__(self, encodings=None, student_ids=None, index=None, background_training=False):
+        self.index = index
+        self.background_training = background_training
+        # Serializes writers: the index keeps training state across updates
+        self._update_lock = threading.Lock()
+        self._training = None
+        self.snapshot = None
+        self.set_gallery(encodings, student_ids or [])
+
+    def set_gallery(self, encodings, student_ids):
+        """Replace the gallery (call after every enroll/delete/update)"""
+        with self._update_lock:
+            # Bumped on every gallery change so derived views know they are stale
+            version = self.snapshot.version + 1 if self.snapshot is not None else 1
+            snapshot = GallerySnapshot(encodings, student_ids, version)
+            if self.index is not None:
+                snapshot.index_lists = self._update_index(snapshot)
+            self.snapshot = snapshot
+
+    def _update_index(self, snapshot):
+        """Index lists for a new snapshot; caller holds _update_lock"""
+        if not self.background_training:
+            return self.index.update(snapshot.reps, snapshot.rep_sq_norms, snapshot.identities)
+        if len(snapshot.reps) >= self.index.min_index_size and self.index.needs_training(len(snapshot.reps)):
+            if self._training is None:
+                self._training = threading.Thread(
+                    target=self._train_index, args=(snapshot,), name='ivf-training', daemon=True
+                )
+                self._training.start()
+        return self.index.update(snapshot.reps, snapshot.rep_sq_norms, snapshot.identities, train=False)
+
+    def _train_index(self, trained):
+        """Train on a snapshot without blocking writers, then re-publish the current one indexed"""
+        try:
+            centroids = self.index.fit(trained.reps)
+            assignment = self.index.assign(trained.reps, centroids)
+            with self._update_lock:
+                self.index.set_centroids(centroids, trained.reps, trained.identities, assignment)
+                # Only rows changed since `trained` are re-assigned here
+                snapshot = copy.copy(self.snapshot)
+                snapshot.index_lists = self.index.update(
+                    snapshot.reps, snapshot.rep_sq_norms, snapshot.identities, train=False
+                )
+                self.snapshot = snapshot
+        finally:
+            with self._update_lock:
+                self._training = None
+
+    @property
+    def version(self):
+        return self.snapshot.version
+
+    @property
+    def matrix(self):
+        return self.snapshot.matrix
+
+    @property
+    def student_ids(self):
+        return self.snapshot.student_ids
+
+    @property
+    def identities(self):
+        return self.snapshot.identities
+
+    @property
+    def multi_sample(self):
+        return self.snapshot.multi_sample
+
+    def __len__(self):
+        return len(self.snapshot.student_ids)
+
+    @property
+    def num_students(self):
+        return len(self.snapshot.identities)
+
+    def subset(self, student_ids, snapshot=None):
+        """Exact-search matcher over only the given students' gallery rows"""
+        snapshot = snapshot or self.snapshot
+        wanted = set(student_ids)
+        rows = [i for i, student_id in enumerate(snapshot.student_ids) if student_id in wanted]
+        return GalleryMatcher(snapshot.matrix[rows], [snapshot.student_ids[i] for i in rows])
+
+    def distances(self, face_encodings):
+        """Euclidean distances between every face and every gallery entry
+
+        Returns:
+            np.ndarray: float32 array of shape (num_faces, gallery_size)
+        """
+        return self._distances(self.snapshot, face_encodings)
+
+    @staticmethod
+    def _distances(gallery, face_encodings):
+        queries = as_encoding_matrix(face_encodings)
+        if len(gallery.matrix) == 0 or len(queries) == 0:
+            return np.empty((len(queries), len(gallery.matrix)), dtype=np.float32)
+
+        sq_dist = _squared_distances(queries, gallery.matrix, gallery.sq_norms)
+        return np.sqrt(sq_dist, out=sq_dist)
+
+    def _identity_distances(self, gallery, face_encodings):
+        """(num_faces, num_students) distance to each student's closest sample"""
+        distances = self._distances(gallery, face_encodings)
+        if not gallery.multi_sample:
+            return distances
+        closest = np.full((len(gallery.identities), distances.shape[0]), np.inf, dtype=np.float32)
+        np.minimum.at(closest, gallery.row_identity, distances.T)
+        return np.ascontiguousarray(closest.T)
+
+    def _representative_top_k(self, gallery, queries, k, exact):
+        """Closest k students by representative, through the index when allowed"""
+        if gallery.index_lists is not None and not exact:
+            return self.index.search(queries, k=k, lists=gallery.index_lists)
+        distances = np.sqrt(_squared_distances(queries, gallery.reps, gallery.rep_sq_norms))
+        return self._top_k(distances, k)
+
+    @staticmethod
+    def _rerank(gallery, queries, shortlist, k):
+        """Re-score shortlisted students by their closest individual sample"""
+        top, top_distances = [], []
+        for query, identities in zip(queries, shortlist):
+            identities = identities[identities >= 0]
+            if len(identities) == 0:
+                top.append(identities)
+                top_distances.append(np.empty(0, dtype=np.float32))
+                continue
+            groups = [gallery.identity_rows[i] for i in identities]
+            rows = np.concatenate(groups)
+            sq_dist = gallery.sq_norms[rows] - 2.0 * (gallery.matrix[rows] @ query) + float(query @ query)
+            # Rows are grouped per student, so one reduceat gives each student's closest sample
+            starts = np.cumsum([0] + [len(group) for group in groups[:-1]])
+            closest = np.sqrt(np.maximum(np.minimum.reduceat(sq_dist, starts), 0.0))
+            order = np.argsort(closest, kind='stable')[:k]
+            top.append(identities[order])
+            top_distances.append(closest[order])
+        return top, top_distances
+
+    def candidate_distances(self, face_encodings, candidates):
+        """Distance from each face to a few given students only (their closest sample)
+
+        Re-checks a shortlist kept across frames without scanning the gallery.
+        Students that are no longer in the gallery are left out.
+
+        Args:
+            candidates: one list of student IDs per face
+
+        Returns:
+            list: one {student_id: distance} dict per face
+        """
+        gallery = self.snapshot
+        queries = as_encoding_matrix(face_encodings)
+        results = []
+        for query, student_ids in zip(queries, candidates):
+            identities = np.array(
+                [gallery.identity_position[s] for s in student_ids if s in gallery.identity_position], dtype=np.int64
+            )
+            if len(identities) == 0:
+                results.append({})
+                continue
+            if gallery.multi_sample:
+                top, top_distances = self._rerank(gallery, query[None, :], [identities], len(identities))
+                identities, closest = top[0], top_distances[0]
+            else:
+                sq_dist = gallery.sq_norms[identities] - 2.0 * (gallery.matrix[identities] @ query) \
+                    + float(query @ query)
+                closest = np.sqrt(np.maximum(sq_dist, 0.0))
+            results.append({gallery.identities[i]: float(d) for i, d in zip(identities, closest)})
+        return results
+
+    def _exact_top_k(self, gallery, face_encodings, k):
+        return self._top_k(self._identity_distances(gallery, face_encodings), k)
+
+    @staticmethod
+    def _top_k(distances, k):
+        num_faces, gallery_size = distances.shape
+        k = min(k, gallery_size)
+        if k < gallery_size:
+            top = np.argpartition(distances, k - 1, axis=1)[:, :k]
+        else:
+            top = np.tile(np.arange(gallery_size), (num_faces, 1))
+        top_distances = np.take_along_axis(distances, top, axis=1)
+        order = np.argsort(top_distances, axis=1)
+        return np.take_along_axis(top, order, axis=1), np.take_along_axis(top_distances, order, axis=1)
+
+    def match(self, face_encodings, k=1, exact=False):
+        """Top-k students for every face, closest first
+
+        Uses the attached approximate index when it is active unless exact=True.
+        With several samples per student, students are shortlisted by their
+        representative and re-ranked by their closest sample; exact=True scores
+        every sample instead.
+
+        Returns:
+            list: one list per face of dicts with index (of the student in
+            identities), student_id, distance and confidence
+        """
+        gallery = self.snapshot
+        queries = as_encoding_matrix(face_encodings)
+        if len(gallery.matrix) == 0:
+            return [[] for _ in range(len(queries))]
+        if len(queries) == 0:
+            return []
+
+        k = max(1, int(k))
+        if gallery.multi_sample and not exact:
+            shortlist, _ = self._representative_top_k(gallery, queries, max(k * RERANK_FACTOR, RERANK_MIN), exact)
+            top, top_distances = self._rerank(gallery, queries, shortlist, k)
+        elif gallery.multi_sample:
+            top, top_distances = self._exact_top_k(gallery, queries, k)
+        else:
+            top, top_distances = self._representative_top_k(gallery, queries, k, exact)
+
+        results = []
+        for face_top, face_distances in zip(top, top_distances):
+            face_confidences = distance_to_confidence(face_distances)
+            results.append([
+                {
+                    'index': int(index),
+                    'student_id': gallery.identities[index],
+                    'distance': float(distance),
+                    'confidence': float(confidence)
+                }
+                for index, distance, confidence in zip(face_top, face_distances, face_confidences)
+            ])
+        return results
+
+    def best_matches(self, face_encodings, tolerance=DEFAULT_TOLERANCE, k=1, exact=False):
+        """Best candidate per face within tolerance, or None if nothing is close enough
+
+        The returned candidate carries the remaining top-k list under 'candidates'.
+        """
+        best = []
+        for candidates in self.match(face_encodings, k=k, exact=exact):
+            if candidates and candidates[0]['distance'] < tolerance:
+                best_match = dict(candidates[0])
+                best_match['candidates'] = candidates
+                best.append(best_match)
+            else:
+                best.append(None)
+        return best
+
+    def find_duplicate(self, face_encoding, tolerance=DEFAULT_TOLERANCE, exclude=None):
+        """Student ID of the closest enrolled face within tolerance, or None
+
+        Always exact: a missed duplicate is worse than a slower enrollment.
+        exclude skips one student, e.g. when adding another sample for them.
+        """
+        for candidate in self.match([face_encoding], k=2, exact=True)[0]:
+            if candidate['student_id'] == exclude:
+                continue
+            if candidate['distance'] <= tolerance:
+                return candidate['student_id']
+            break
+        return None
+
+
+class CourseGalleries:
+    """Cached per-course views of a GalleryMatcher
+
+    Rosters are registered per course_id (or passed inline per request) and the
+    matching sub-gallery is built once, then reused until the main gallery changes.
+    """
+
+    def __init__(self, matcher, max_views=64):
+        self.matcher = matcher
+        self.max_views = max_views
+        self.rosters = {}
+        self._views = OrderedDict()
+        self._lock = threading.Lock()
+
+    def set_roster(self, course_id, student_ids):
+        with self._lock:
+            self.rosters[str(course_id)] = [str(student_id) for student_id in student_ids]
+
+    def get_roster(self, course_id):
+        return self.rosters.get(str(course_id))
+
+    def remove_roster(self, course_id):
+        with self._lock:
+            return self.rosters.pop(str(course_id), None) is not None
+
+    def view(self, course_id=None, student_ids=None):
+        """Matcher scoped to a course roster or an explicit list of student IDs
+
+        Returns None when course_id has no registered roster and no IDs were given.
+        """
+        if student_ids is None:
+            if course_id is None:
+                return self.matcher
+            student_ids = self.get_roster(course_id)
+            if student_ids is None:
+                return None
+
+        key = (str(course_id) if course_id is not None else None, frozenset(str(s) for s in student_ids))
+        with self._lock:
+            snapshot = self.matcher.snapshot
+            cached = self._views.get(key)
+            if cached is not None and cached[0] == snapshot.version:
+                self._views.move_to_end(key)
+                return cached[1]
+
+            view = self.matcher.subset(key[1], snapshot)
+            self._views[key] = (snapshot.version, view)
+            self._views.move_to_end(key)
+            while len(self._views) > self.max_views:
+                self._views.popitem(last=False)
+            return view
@@ -0,0 +1,204 @@
+"""
+In-process metrics with Prometheus text exposition.
+
+Counters, gauges and histograms are plain Python objects guarded by a lock,
+registered on a module-level REGISTRY and rendered by render() for the
+/metrics route. Gauges can also be backed by a callback that is evaluated at
+scrape time (gallery size, cache counters, live stream stats), so nothing is
+recomputed on the request path.
+
+Stage timings collected with face_pipeline.StageTimer ({'decode_ms': ...})
+are folded into the cv_stage_seconds histogram with observe_timings().
+
+Logging goes through the standard logging module; CV_LOG_LEVEL (default
+INFO) is applied by configure_logging(). Per-face and per-request detail is
+logged at DEBUG so it costs nothing when disabled.
+"""
+import logging
+import os
+import threading
+
+LOG_LEVEL = os.environ.get('CV_LOG_LEVEL', 'INFO').upper()
+LOG_FORMAT = '%(asctime)s %(levelname)s %(name)s: %(message)s'
+
+# Seconds; covers a sub-millisecond match up to a multi-second HOG pass on a large photo
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (0, 1, 2, 4, 8, 16, 32, 64)
+
+
+def configure_logging(level=LOG_LEVEL):
+    logging.basicConfig(level=getattr(logging, level, logging.INFO), format=LOG_FORMAT)
+
+
+def _format_labels(names, values, extra=None):
+    pairs = list(zip(names, values)) + (list(extra.items()) if extra else [])
+    if not pairs:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if set(labels) != set(self.labels):
+            raise ValueError(f'{self.name} expects labels {self.labels}, got {tuple(labels)}')
+        return tuple(str(labels[name]) for name in self.labels)
+
+    def _samples(self):
+        with self._lock:
+            return [(self.name, key, None, value) for key, value in self._values.items()]
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.kind}']
+        for name, key, extra, value in self._samples():
+            lines.append(f'{name}{_format_labels(self.labels, key, extra)} {_format_value(value)}')
+        return lines
+
+
+class Counter(_Metric):
+    """Monotonic count, optionally per label set"""
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    """Current value, either set explicitly or read from a callback at scrape time
+
+    A callback returns a number (no labels) or a {label_values_tuple: number} dict.
+    """
+    kind = 'gauge'
+
+    def __init__(self, name, help_text, labels=(), callback=None, kind=None):
+        super().__init__(name, help_text, labels)
+        self.callback = callback
+        if kind is not None:
+            # Callback-backed totals kept elsewhere (e.g. cache hits) are exposed as counters
+            self.kind = kind
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def _samples(self):
+        if self.callback is None:
+            return super()._samples()
+        try:
+            values = self.callback()
+        except Exception:
+            logging.getLogger(__name__).exception('Metric callback for %s failed', self.name)
+            return []
+        if not isinstance(values, dict):
+            values = {(): values}
+        return [
+            (self.name, tuple(str(v) for v in (key if isinstance(key, tuple) else (key,))), None, value)
+            for key, value in values.items() if value is not None
+        ]
+
+
+class Histogram(_Metric):
+    """Cumulative-bucket histogram, optionally per label set"""
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # [per-bucket counts..., +Inf count], sum
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            counts = state[0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            else:
+                counts[-1] += 1
+            state[1] += value
+
+    def _samples(self):
+        samples = []
+        with self._lock:
+            items = [(key, list(counts), total) for key, (counts, total) in self._values.items()]
+        for key, counts, total in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                samples.append((f'{self.name}_bucket', key, {'le': _format_value(float(bound))}, cumulative))
+            samples.append((f'{self.name}_sum', key, None, total))
+            samples.append((f'{self.name}_count', key, None, cumulative))
+        return samples
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric):
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                # Re-registration (e.g. a module imported twice) returns the first instance
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name, help_text, labels=()):
+        return self._register(Counter(name, help_text, labels))
+
+    def gauge(self, name, help_text, labels=(), callback=None, kind=None):
+        return self._register(Gauge(name, help_text, labels, callback, kind))
+
+    def histogram(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        return self._register(Histogram(name, help_text, labels, buckets))
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+STAGE_SECONDS = REGISTRY.histogram(
+    'cv_stage_seconds', 'Time spent per processing stage', ('endpoint', 'stage')
+)
+
+
+def observe_timings(endpoint, timings):
+    """Fold a StageTimer dict ({'detect_ms': 12.3, ...}) into cv_stage_seconds"""
+    for stage, milliseconds in timings.items():
+        if stage.endswith('_ms'):
+            STAGE_SECONDS.observe(milliseconds / 1000, endpoint=endpoint, stage=stage[:-3])
+
+
+def render():
+    return REGISTRY.render()
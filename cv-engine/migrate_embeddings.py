@@ -2,143 +2,246 @@
 """
 Migration script to re-enroll all students with the improved face recognition system.
 This script processes all student photos and generates new embeddings using face_recognition library.
+
+Runs are incremental: a manifest in the embedding store directory remembers
+each photo's mtime, size and SHA-256 together with its encoding, so only new
+or changed photos are encoded again (across a pool of worker processes).
+Duplicate faces are found with one vectorized pairwise-distance pass and the
+store is written once at the end. Use --full to re-encode everything.
 """
+import argparse
+import hashlib
+import json
+import multiprocessing
 import os
-import cv2
-import pickle
 import sys
-from server import get_face_encoding_proper, compare_faces_proper
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from embedding_store import open_store
+from encoding_cache import EncodingCache
+from face_pipeline import detect_and_encode_bytes, face_crop_jpeg, pipeline_signature
+from matcher import find_duplicate_pairs
+from metrics import configure_logging
+
+MANIFEST_NAME = 'migration.json'
+ENCODINGS_NAME = 'migration-encodings.npy'
+
+# Encoding cache of the current worker process
+_encoding_cache = None
+
+
+def encode_photo(image_path):
+    """Detect and encode one photo (runs in a worker process)
+
+    Returns:
+        dict: 'status' ('ok', 'no_face' or 'unreadable'), 'sha256', and for 'ok'
+        the first face's 'encoding', 'coordinates' and a 200x200 JPEG 'crop'
+    """
+    global _encoding_cache
+    if _encoding_cache is None:
+        _encoding_cache = EncodingCache()
+
+    with open(image_path, 'rb') as f:
+        data = f.read()
+    result = {'sha256': hashlib.sha256(data).hexdigest()}
+    try:
+        image_shape, faces, _ = _encoding_cache.get_or_compute(data, detect_and_encode_bytes)
+    except Exception as e:
+        result.update(status='unreadable', error=str(e))
+        return result
+    if not faces:
+        result['status'] = 'no_face'
+        return result
 
-def migrate_embeddings(photos_dir='../client/public/models'):
+    crop = face_crop_jpeg(data, faces[0]['coordinates'])
+    result.update(
+        status='ok',
+        image_shape=list(image_shape),
+        encoding=np.asarray(faces[0]['encoding'], dtype=np.float32),
+        coordinates=[int(v) for v in faces[0]['coordinates']],
+        crop=crop
+    )
+    return result
+
+
+def file_digest(path):
+    with open(path, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def load_manifest(store_path):
+    """Previous run's per-photo entries and encodings, or empty if unusable"""
+    manifest_path = os.path.join(store_path, MANIFEST_NAME)
+    encodings_path = os.path.join(store_path, ENCODINGS_NAME)
+    if not os.path.exists(manifest_path) or not os.path.exists(encodings_path):
+        return {}, None
+    with open(manifest_path, 'r') as f:
+        manifest = json.load(f)
+    if manifest.get('signature') != pipeline_signature():
+        print("ℹ️  Detection/encoding settings changed since the last run - re-encoding all photos")
+        return {}, None
+    return manifest.get('files', {}), np.load(encodings_path)
+
+
+def save_manifest(store_path, entries, encodings):
+    """Write manifest and encodings (the manifest last, so a crash leaves the previous pair usable)"""
+    encodings_path = os.path.join(store_path, ENCODINGS_NAME)
+    manifest_path = os.path.join(store_path, MANIFEST_NAME)
+    with open(f'{encodings_path}.tmp', 'wb') as f:
+        np.save(f, np.asarray(encodings, dtype=np.float32).reshape(-1, 128))
+    os.replace(f'{encodings_path}.tmp', encodings_path)
+    with open(f'{manifest_path}.tmp', 'w') as f:
+        json.dump({'signature': pipeline_signature(), 'files': entries}, f)
+    os.replace(f'{manifest_path}.tmp', manifest_path)
+
+
+def migrate_embeddings(photos_dir='../client/public/models', incremental=True, workers=None):
     """Re-enroll all students from their photos"""
-    
+
     print("=" * 70)
     print("Face Recognition Embeddings Migration")
     print("=" * 70)
-    
+
     if not os.path.exists(photos_dir):
         print(f"❌ Photos directory not found: {photos_dir}")
         print("   Please provide the correct path to student photos.")
         return False
-    
+
     # Get all image files
-    image_files = [f for f in os.listdir(photos_dir) 
-                   if f.endswith(('.jpg', '.jpeg', '.png'))]
-    
+    image_files = sorted(f for f in os.listdir(photos_dir)
+                         if f.endswith(('.jpg', '.jpeg', '.png')))
+
     if not image_files:
         print(f"⚠️  No student photos found in: {photos_dir}")
         print("   Students need to be enrolled first.")
         return True
-    
+
     print(f"\nFound {len(image_files)} student photos")
     print(f"Photos directory: {photos_dir}")
     print("-" * 70)
-    
-    new_embeddings = []
-    new_student_ids = []
+
+    store = open_store(legacy_pickle=None)
     processed_faces_dir = 'processed_faces'
     os.makedirs(processed_faces_dir, exist_ok=True)
-    
-    successful = 0
-    failed = 0
-    duplicates = 0
-    
-    for image_file in sorted(image_files):
-        # Extract student ID from filename (assumes format: studentid.jpg)
-        student_id = os.path.splitext(image_file)[0]
+
+    previous, previous_encodings = load_manifest(store.path) if incremental else ({}, None)
+
+    # Reuse results for photos whose mtime/size (or, failing that, content hash) is unchanged
+    entries = {}
+    encodings = {}
+    to_encode = []
+    for image_file in image_files:
         image_path = os.path.join(photos_dir, image_file)
-        
-        print(f"\n📸 Processing: {image_file} (Student ID: {student_id})")
-        
-        # Load image
-        img = cv2.imread(image_path)
-        if img is None:
-            print(f"   ❌ Could not load image")
-            failed += 1
-            continue
-        
-        print(f"   Image size: {img.shape}")
-        
-        # Get face encoding using improved method
-        result = get_face_encoding_proper(img)
-        if result is None:
-            print(f"   ❌ No face detected - skipping")
-            failed += 1
-            continue
-        
-        face_encoding, face_location = result
-        top, right, bottom, left = face_location
-        x, y, w, h = left, top, right - left, bottom - top
-        
-        print(f"   ✅ Face detected at location: ({x}, {y}, {w}, {h})")
-        print(f"   Encoding: 128 dimensions")
-        
-        # Check for duplicates
-        is_duplicate = False
-        for i, existing_encoding in enumerate(new_embeddings):
-            if compare_faces_proper(existing_encoding, face_encoding, tolerance=0.6):
-                print(f"   ⚠️  Face matches existing student: {new_student_ids[i]}")
-                is_duplicate = True
-                duplicates += 1
-                break
-        
-        if is_duplicate:
-            print(f"   ⚠️  Skipping duplicate face")
+        stat = os.stat(image_path)
+        old = previous.get(image_file)
+        unchanged = False
+        if old is not None and old['size'] == stat.st_size:
+            unchanged = old['mtime_ns'] == stat.st_mtime_ns or old['sha256'] == file_digest(image_path)
+        if unchanged:
+            entries[image_file] = dict(old, mtime_ns=stat.st_mtime_ns)
+            if old['status'] == 'ok':
+                encodings[image_file] = previous_encodings[old['row']]
+        else:
+            entries[image_file] = {'mtime_ns': stat.st_mtime_ns, 'size': stat.st_size}
+            to_encode.append(image_file)
+
+    print(f"♻️  Unchanged since last run: {len(image_files) - len(to_encode)}")
+    print(f"📸 To encode: {len(to_encode)}")
+
+    crops = {}
+    if to_encode:
+        workers = max(1, min(workers or os.cpu_count() or 1, len(to_encode)))
+        print(f"   Encoding on {workers} worker processes...")
+        context = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context) as executor:
+            paths = [os.path.join(photos_dir, image_file) for image_file in to_encode]
+            results = executor.map(encode_photo, paths, chunksize=max(1, len(paths) // (workers * 8)))
+            for image_file, result in zip(to_encode, results):
+                entry = entries[image_file]
+                entry['sha256'] = result['sha256']
+                entry['status'] = result['status']
+                if result['status'] == 'ok':
+                    encodings[image_file] = result['encoding']
+                    entry['coordinates'] = result['coordinates']
+                    crops[image_file] = result['crop']
+                    x, y, w, h = result['coordinates']
+                    print(f"   ✅ {image_file}: face at ({x}, {y}, {w}, {h})")
+                elif result['status'] == 'no_face':
+                    print(f"   ❌ {image_file}: no face detected - skipping")
+                else:
+                    print(f"   ❌ {image_file}: could not load image ({result.get('error')})")
+
+    # Encoded photos in filename order; a face matching an earlier kept face is a duplicate
+    encoded_files = [f for f in image_files if f in encodings]
+    partners = {}
+    for i, j in find_duplicate_pairs([encodings[f] for f in encoded_files], tolerance=0.6):
+        partners.setdefault(i, []).append(j)
+
+    kept = []
+    kept_rows = set()
+    duplicates = 0
+    for i, image_file in enumerate(encoded_files):
+        originals = sorted(j for j in partners.get(i, []) if j in kept_rows)
+        if originals:
+            original_id = os.path.splitext(encoded_files[originals[0]])[0]
+            print(f"   ⚠️  {image_file}: face matches existing student {original_id} - skipping duplicate")
+            duplicates += 1
             continue
-        
-        # Add to new embeddings
-        new_embeddings.append(face_encoding)
-        new_student_ids.append(student_id)
-        
-        # Save processed face image
-        face_img = img[y:y+h, x:x+w]
-        face_img_resized = cv2.resize(face_img, (200, 200))
-        face_path = os.path.join(processed_faces_dir, f'{student_id}.jpg')
-        cv2.imwrite(face_path, face_img_resized)
-        
-        print(f"   ✅ Enrolled successfully")
-        successful += 1
-    
+        kept_rows.add(i)
+        kept.append(image_file)
+
+    # Save processed face images of newly encoded students
+    for image_file in kept:
+        if image_file in crops:
+            student_id = os.path.splitext(image_file)[0]
+            with open(os.path.join(processed_faces_dir, f'{student_id}.jpg'), 'wb') as f:
+                f.write(crops[image_file])
+
+    failed = sum(1 for entry in entries.values() if entry['status'] != 'ok')
+
     print("\n" + "=" * 70)
     print("Migration Results")
     print("=" * 70)
-    print(f"✅ Successfully enrolled: {successful}")
+    print(f"✅ Successfully enrolled: {len(kept)}")
     print(f"❌ Failed: {failed}")
     print(f"⚠️  Duplicates detected: {duplicates}")
-    print(f"📊 Total unique students: {len(new_embeddings)}")
+    print(f"♻️  Re-used from last run: {len(image_files) - len(to_encode)}, newly encoded: {len(to_encode)}")
+    print(f"📊 Total unique students: {len(kept)}")
     print("=" * 70)
-    
-    if new_embeddings:
-        # Save new embeddings
-        data = {
-            'encodings': new_embeddings,
-            'student_ids': new_student_ids
-        }
-        
-        embeddings_file = 'student_embeddings.pkl'
-        with open(embeddings_file, 'wb') as f:
-            pickle.dump(data, f)
-        
-        print(f"\n✅ New embeddings saved to: {embeddings_file}")
+
+    # Remember every photo (including failures) so unchanged ones are skipped next time
+    for row, image_file in enumerate(encoded_files):
+        entries[image_file]['row'] = row
+    save_manifest(store.path, entries, [encodings[f] for f in encoded_files])
+
+    if kept:
+        # Save new embeddings (single atomic rewrite of the store)
+        store.rewrite([os.path.splitext(f)[0] for f in kept], [encodings[f] for f in kept])
+
+        print(f"\n✅ New embeddings saved to: {store.path}/")
         print(f"✅ Processed faces saved to: {processed_faces_dir}/")
         print("\n🎉 Migration completed successfully!")
         print("\nNext steps:")
-        print("  1. Start the server: python server.py")
+        print("  1. Start the server: python run.py")
         print("  2. Test face recognition with the /verify endpoint")
         print("  3. Students can now be recognized in live attendance")
     else:
         print("\n⚠️  No students enrolled. Please add student photos first.")
-    
+
     return True
 
 def main():
-    # Check for custom photos directory
-    photos_dir = '../client/public/models'
-    if len(sys.argv) > 1:
-        photos_dir = sys.argv[1]
-    
+    parser = argparse.ArgumentParser(description='Re-enroll all students from their photos')
+    parser.add_argument('photos_dir', nargs='?', default='../client/public/models',
+                        help='Directory of <student_id>.jpg photos')
+    parser.add_argument('--full', action='store_true', help='Re-encode every photo, ignoring the last run')
+    parser.add_argument('--workers', type=int, default=None, help='Encoding processes (default: CPU count)')
+    args = parser.parse_args()
+
     try:
-        success = migrate_embeddings(photos_dir)
+        success = migrate_embeddings(args.photos_dir, incremental=not args.full, workers=args.workers)
         if not success:
             sys.exit(1)
     except Exception as e:
@@ -148,5 +251,5 @@ def main():
         sys.exit(1)
 
 if __name__ == '__main__':
+    configure_logging()
     main()
-
@@ -0,0 +1,40 @@
+"""
+Entry point for running the CV engine.
+
+    python run.py              Flask development server on port 5001
+    python run.py --asgi       the ASGI app (asgi.py) under uvicorn
+
+Detection pool workers (CV_DETECTION_WORKERS) are spawned processes, and a
+spawned process re-runs the main script before it runs anything else.
+server.py builds the embedding store, the gallery and the Flask app when it
+is imported, so it must not be the main script: every worker would boot a
+second engine. This module imports the engine only under its __main__ guard,
+so workers import nothing but face_pipeline. `python server.py` and
+`python asgi.py` hand over to this script.
+"""
+import argparse
+
+HOST = '0.0.0.0'
+PORT = 5001
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run the CV engine')
+    parser.add_argument('--asgi', action='store_true', help='Serve asgi:app with uvicorn instead of Flask')
+    parser.add_argument('--host', default=HOST)
+    parser.add_argument('--port', type=int, default=PORT)
+    args = parser.parse_args()
+
+    if args.asgi:
+        import uvicorn
+        # asgi's lifespan starts the warmup
+        uvicorn.run('asgi:app', host=args.host, port=args.port)
+        return
+
+    import server
+    server.start_warmup()
+    server.app.run(host=args.host, port=args.port)
+
+
+if __name__ == '__main__':
+    main()
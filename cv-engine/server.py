@@ -1,62 +1,190 @@
-from flask import Flask, request, jsonify, Response, send_file
 import os
+import sys
+
+if __name__ == '__main__':
+    # Serve through run.py: detection pool workers re-run the main script, and importing
+    # this module builds the whole engine (store, gallery, Flask app) in every one of them
+    os.execv(sys.executable, [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'run.py')])
+
+from flask import Flask, request, jsonify, Response, send_file, g
 import cv2
-import numpy as np
-from PIL import Image
+from PIL import UnidentifiedImageError
 import io
-import pickle
+import json
+import logging
+import threading
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
 from flask_cors import CORS
-import face_recognition
+from matcher import GalleryMatcher, CourseGalleries, find_duplicate_pairs
+from ann_index import IVFIndex
+from embedding_store import open_store
+from encoding_cache import EncodingCache
+from face_pipeline import (
+    detect_faces_rgb, batch_face_encodings, build_faces, decode_image, decode_scale, detect_and_encode_bytes,
+    face_crop_jpeg, face_encodings as encode_faces, locate_faces, location_to_coordinates,
+    StageTimer, warmup
+)
+from detection_pool import DetectionPool
+from detectors import DETECTOR
+from camera_broker import SourceRegistry
+from metrics import COUNT_BUCKETS, CONTENT_TYPE, REGISTRY, configure_logging, observe_timings, render as render_metrics
+
+configure_logging()
+logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
 CORS(app, resources={
     r"/*": {
         "origins": "*",
-        "methods": ["GET", "POST", "OPTIONS"],
+        "methods": ["GET", "POST", "DELETE", "OPTIONS"],
         "allow_headers": ["Content-Type", "Authorization"]
     }
 })
 
 # Configure storage
 UPLOAD_FOLDER = 'uploads'
-EMBEDDINGS_FILE = 'student_embeddings.pkl'
+EMBEDDINGS_DIR = 'student_embeddings'
+LEGACY_EMBEDDINGS_FILE = 'student_embeddings.pkl'
 PROCESSED_FACES = 'processed_faces'
+# Gallery search mode: 'exact' (brute force) or 'ivf' (approximate, for large galleries)
+MATCHER_INDEX = os.environ.get('CV_MATCHER_INDEX', 'exact')
+IVF_NPROBE = int(os.environ.get('CV_IVF_NPROBE', 8))
+# Threads used by /verify-batch to decode and detect uploaded images in parallel
+VERIFY_BATCH_WORKERS = int(os.environ.get('CV_VERIFY_BATCH_WORKERS', os.cpu_count() or 4))
+# Threads used by /enroll-bulk (each hands its photo to the detection pool when enabled)
+BULK_ENROLL_WORKERS = int(os.environ.get('CV_BULK_ENROLL_WORKERS', os.cpu_count() or 4))
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+# Encodings kept per student; enrolling again adds a sample (oldest dropped beyond this)
+MAX_SAMPLES_PER_STUDENT = int(os.environ.get('CV_MAX_SAMPLES_PER_STUDENT', 5))
+# Worker processes for detection/encoding (0 = run in the request thread)
+DETECTION_WORKERS = int(os.environ.get('CV_DETECTION_WORKERS', 0))
+# Load the models and run a dummy inference at startup instead of in the first request
+WARMUP = os.environ.get('CV_WARMUP', 'true').lower() == 'true'
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 os.makedirs(PROCESSED_FACES, exist_ok=True)
 
-def load_student_data():
-    if os.path.exists(EMBEDDINGS_FILE):
-        with open(EMBEDDINGS_FILE, 'rb') as f:
-            return pickle.load(f)
-    return {
-        'encodings': [],
-        'student_ids': []
-    }
+# Load student data (imports the legacy pickle on first start)
+embedding_store = open_store(EMBEDDINGS_DIR, legacy_pickle=LEGACY_EMBEDDINGS_FILE)
+gallery_matcher = GalleryMatcher(
+    *embedding_store.snapshot(),
+    index=IVFIndex(nprobe=IVF_NPROBE) if MATCHER_INDEX == 'ivf' else None,
+    # k-means runs off the import path; exact search is used until it is done
+    background_training=True
+)
+
+# Per-course sub-galleries, rebuilt lazily after gallery changes
+course_galleries = CourseGalleries(gallery_matcher)
+
+# Held from reading the store until the matcher is updated, so concurrent refreshes publish in order
+gallery_refresh_lock = threading.Lock()
+
+def refresh_gallery():
+    """Rebuild the matcher's float32 gallery matrix after the store changes"""
+    with gallery_refresh_lock:
+        gallery_matcher.set_gallery(*embedding_store.snapshot())
+
+detection_pool = None
+
+def get_detection_pool():
+    """Detection worker pool, created on first use when CV_DETECTION_WORKERS > 0"""
+    global detection_pool
+    if detection_pool is None and DETECTION_WORKERS > 0:
+        detection_pool = DetectionPool(DETECTION_WORKERS)
+    return detection_pool
+
+def start_warmup():
+    """Warm the models up in the background (requests arriving meanwhile wait for the load)"""
+    if get_detection_pool() is not None:
+        detection_pool.start()
+    if WARMUP:
+        threading.Thread(
+            target=lambda: logger.info("Models warmed up in %.0f ms", warmup()), name='warmup', daemon=True
+        ).start()
+
+# Detection + encoding results keyed by image content, so re-sent photos skip HOG and the encoder
+encoding_cache = EncodingCache()
+
+REQUESTS = REGISTRY.counter('cv_requests_total', 'HTTP requests by endpoint and status', ('endpoint', 'method', 'status'))
+REQUEST_SECONDS = REGISTRY.histogram('cv_request_seconds', 'HTTP request latency (until the response is returned)', ('endpoint',))
+FACES_PER_IMAGE = REGISTRY.histogram('cv_faces_per_image', 'Faces detected per processed image', ('endpoint',), buckets=COUNT_BUCKETS)
+RECOGNITIONS = REGISTRY.counter('cv_recognitions_total', 'Detected faces by match outcome', ('endpoint', 'outcome'))
+REGISTRY.gauge('cv_gallery_encodings', 'Encodings in the gallery', callback=lambda: len(gallery_matcher))
+REGISTRY.gauge('cv_gallery_students', 'Distinct students in the gallery', callback=lambda: gallery_matcher.num_students)
+REGISTRY.gauge('cv_encoding_cache_entries', 'Images in the encoding cache', callback=lambda: len(encoding_cache))
+REGISTRY.gauge('cv_encoding_cache_hits_total', 'Encoding cache hits', callback=lambda: encoding_cache.hits, kind='counter')
+REGISTRY.gauge('cv_encoding_cache_misses_total', 'Encoding cache misses', callback=lambda: encoding_cache.misses, kind='counter')
+REGISTRY.gauge('cv_encoding_cache_evictions_total', 'Encoding cache evictions', callback=lambda: encoding_cache.evictions, kind='counter')
+
+def record_faces(endpoint, faces, matches=None, min_confidence=0.5):
+    """Count detected faces and, when matched, how many were recognized"""
+    FACES_PER_IMAGE.observe(len(faces), endpoint=endpoint)
+    for match in matches or ():
+        recognized = match is not None and match['confidence'] >= min_confidence
+        RECOGNITIONS.inc(endpoint=endpoint, outcome='recognized' if recognized else 'unknown')
 
-def save_student_data(data):
-    with open(EMBEDDINGS_FILE, 'wb') as f:
-        pickle.dump(data, f)
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
 
-# Load student data
-student_data = load_student_data()
+@app.after_request
+def record_request(response):
+    endpoint = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+    REQUESTS.inc(endpoint=endpoint, method=request.method, status=response.status_code)
+    if 'request_start' in g:
+        REQUEST_SECONDS.observe(time.perf_counter() - g.request_start, endpoint=endpoint)
+    return response
 
-def get_face_encoding_proper(image):
+def detect_upload(image_bytes):
+    """Faces in an uploaded image, from the encoding cache or on the worker pool when enabled
+
+    Returns:
+        tuple: (image_shape, faces, timings) with faces as [{'encoding', 'coordinates'}]
+    """
+    pool = get_detection_pool()
+    compute = pool.detect if pool is not None else detect_and_encode_bytes
+    return encoding_cache.get_or_compute(image_bytes, compute)
+
+def parse_student_ids(value):
+    """Parse a roster given as a JSON list or a comma-separated string"""
+    if value is None or value == '':
+        return None
+    if isinstance(value, list):
+        return [str(v) for v in value]
+    value = value.strip()
+    if value.startswith('['):
+        return [str(v) for v in json.loads(value)]
+    return [v.strip() for v in value.split(',') if v.strip()]
+
+def resolve_matcher(params):
+    """Pick the gallery to match against from course_id / student_ids request params
+
+    Returns:
+        tuple: (matcher, error_message) - matcher is None when the course has no roster
+    """
+    course_id = params.get('course_id') or None
+    student_ids = parse_student_ids(params.get('student_ids'))
+    matcher = course_galleries.view(course_id, student_ids)
+    if matcher is None:
+        return None, f'No roster registered for course {course_id}. Send student_ids or POST /course-roster first.'
+    return matcher, None
+
+def get_face_encoding_proper(rgb_image, timings=None):
     """Get face encoding using face_recognition library - much more accurate"""
-    # Convert BGR to RGB (OpenCV uses BGR, face_recognition uses RGB)
-    rgb_image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-    
-    # Find face locations
-    face_locations = face_recognition.face_locations(rgb_image, model='hog')
+    # Find face locations (detected on a downscaled copy, mapped back to full resolution)
+    face_locations = locate_faces(rgb_image, timings=timings)
     
     if len(face_locations) == 0:
-        print(f"No faces detected in image of size: {image.shape}")
+        logger.debug("No faces detected in image of size: %s", rgb_image.shape)
         return None
     
-    print(f"Detected {len(face_locations)} faces")
+    logger.debug("Detected %d faces", len(face_locations))
     
-    # Get face encodings
-    face_encodings = face_recognition.face_encodings(rgb_image, face_locations)
+    # Get face encodings from the full-resolution image
+    with StageTimer(timings, 'encode_ms'):
+        face_encodings = encode_faces(rgb_image, face_locations)
     
     if len(face_encodings) == 0:
         return None
@@ -64,90 +192,64 @@ def get_face_encoding_proper(image):
     # Return the first face (or you could return the largest)
     return face_encodings[0], face_locations[0]
 
-def get_all_face_encodings_proper(image):
-    """Get encodings for all faces using face_recognition library"""
-    # Convert BGR to RGB
-    rgb_image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-    
-    # Find face locations
-    face_locations = face_recognition.face_locations(rgb_image, model='hog')
+def get_all_face_encodings_proper(rgb_image, image_shape=None, timings=None):
+    """Get encodings for all faces using face_recognition library
+
+    Coordinates are (x, y, w, h) in the original image (image_shape, when
+    rgb_image was draft-decoded at a reduced size).
+    """
+    # Find face locations (detected on a downscaled copy, mapped back to full resolution)
+    face_locations = locate_faces(rgb_image, timings=timings)
     
     if len(face_locations) == 0:
-        print(f"No faces detected in image of size: {image.shape}")
+        logger.debug("No faces detected in image of size: %s", rgb_image.shape)
         return []
     
-    print(f"Detected {len(face_locations)} faces")
-    
-    # Get face encodings
-    face_encodings = face_recognition.face_encodings(rgb_image, face_locations)
+    logger.debug("Detected %d faces", len(face_locations))
     
-    result = []
-    for encoding, location in zip(face_encodings, face_locations):
-        # face_recognition returns (top, right, bottom, left)
-        top, right, bottom, left = location
-        # Convert to (x, y, w, h) format for consistency
-        x, y, w, h = left, top, right - left, bottom - top
-        
-        result.append({
-            'encoding': encoding,
-            'coordinates': (x, y, w, h)
-        })
+    # Get face encodings from the full-resolution image
+    with StageTimer(timings, 'encode_ms'):
+        face_encodings = encode_faces(rgb_image, face_locations)
     
-    return result
+    return build_faces(face_encodings, face_locations, rgb_image, image_shape or rgb_image.shape)
 
-def compare_faces_proper(known_encoding, face_encoding, tolerance=0.6):
-    """Compare faces using face_recognition library
-    
-    Args:
-        known_encoding: Known face encoding (128-dim array)
-        face_encoding: Face encoding to compare (128-dim array)
-        tolerance: Distance threshold (default 0.6, lower = stricter)
-    
-    Returns:
-        bool: True if faces match
-    """
-    # Calculate face distance
-    distance = face_recognition.face_distance([known_encoding], face_encoding)[0]
-    print(f"Face distance: {distance:.4f}, tolerance: {tolerance}")
-    
-    return distance <= tolerance
-
-def get_face_confidence_proper(known_encoding, face_encoding):
-    """Calculate confidence score (0-1) based on face distance"""
-    # Calculate face distance
-    distance = face_recognition.face_distance([known_encoding], face_encoding)[0]
-    
-    # Convert distance to confidence
-    # Distance typically ranges from 0 (identical) to 1+ (very different)
-    # Good match: < 0.6
-    # Borderline: 0.6-0.8
-    # No match: > 0.8
-    
-    if distance > 1.0:
-        return 0.0
-    elif distance < 0.4:
-        return 1.0
-    else:
-        # Linear mapping: 0.4 distance = 1.0 confidence, 1.0 distance = 0.0 confidence
-        confidence = 1.0 - ((distance - 0.4) / 0.6)
-        return max(0.0, min(1.0, confidence))
-
-# Initialize systems
-from werkzeug.utils import secure_filename
+def build_recognition(match, coordinates, top_k=1):
+    """Response entry for one matched face"""
+    recognition = {
+        'student_id': match['student_id'],
+        'confidence': match['confidence'],
+        'distance': match['distance'],
+        'face_coordinates': {
+            'x': int(coordinates[0]),
+            'y': int(coordinates[1]),
+            'w': int(coordinates[2]),
+            'h': int(coordinates[3])
+        }
+    }
+    if top_k > 1:
+        recognition['candidates'] = [
+            {
+                'student_id': c['student_id'],
+                'distance': c['distance'],
+                'confidence': c['confidence']
+            }
+            for c in match['candidates']
+        ]
+    return recognition
 
 @app.route('/health', methods=['GET'])
 def health_check():
     try:
-        # Try to open the camera
-        cap = cv2.VideoCapture(0)
-        camera_available = cap.isOpened()
-        if camera_available:
-            cap.release()
-            
+        # Cached by the broker: health probes must not fight live viewers for the device
+        broker = live_sources.get()
+        camera = broker.camera_status() if broker is not None else {'available': False, 'checked_seconds_ago': None}
+        
         return jsonify({
             'status': 'healthy',
-            'camera_available': camera_available,
-            'opencv_version': cv2.__version__
+            'camera_available': camera['available'],
+            'camera_checked_seconds_ago': camera['checked_seconds_ago'],
+            'opencv_version': cv2.__version__,
+            'detector': DETECTOR
         })
     except Exception as e:
         return jsonify({
@@ -167,6 +269,8 @@ def enroll_student():
     photo = request.files['photo']
     student_id = request.form.get('student_id')
     force_enroll = request.form.get('force_enroll', 'false').lower() == 'true'
+    # replace=true discards the student's previous samples instead of adding to them
+    replace = request.form.get('replace', 'false').lower() == 'true'
     
     if not student_id:
         return jsonify({
@@ -181,162 +285,198 @@ def enroll_student():
         }), 400
     
     try:
-        # Save uploaded file temporarily
-        filename = secure_filename(f"{student_id}_{photo.filename}")
-        photo_path = os.path.join(UPLOAD_FOLDER, filename)
-        photo.save(photo_path)
-        
-        # Read image and detect face
-        img = cv2.imread(photo_path)
-        if img is None:
-            os.remove(photo_path)
+        # Decode, detect and encode in memory, reusing the cached result when this exact photo was seen before
+        image_bytes = photo.read()
+        try:
+            _, faces, timings = detect_upload(image_bytes)
+        except (UnidentifiedImageError, OSError):
             return jsonify({
                 'success': False,
                 'message': 'Could not read uploaded image'
             }), 400
-        
-        # Get face encoding using improved face_recognition library
-        result = get_face_encoding_proper(img)
-        if result is None:
-            os.remove(photo_path)
+        record_faces('/enroll', faces)
+        if not faces:
+            observe_timings('/enroll', timings)
             return jsonify({
                 'success': False,
                 'message': 'No face detected in photo'
             }), 400
         
-        face_encoding, face_location = result
-        # face_recognition returns (top, right, bottom, left)
-        top, right, bottom, left = face_location
-        x, y, w, h = left, top, right - left, bottom - top
+        face_encoding = faces[0]['encoding']
         
-        # Check for duplicate faces
-        duplicate_found = False
-        duplicate_student_id = None
-        for i, encoding in enumerate(student_data['encodings']):
-            if compare_faces_proper(encoding, face_encoding, tolerance=0.6):
-                duplicate_found = True
-                duplicate_student_id = student_data["student_ids"][i]
-                break
-        
-        if duplicate_found and not force_enroll:
+        # Check for duplicate faces (the student's own samples are expected to match)
+        with StageTimer(timings, 'match_ms'):
+            duplicate_student_id = gallery_matcher.find_duplicate(face_encoding, tolerance=0.6, exclude=student_id)
+        
+        if duplicate_student_id is not None and not force_enroll:
             # Still save the processed face image for debugging
-            face_img = img[y:y+h, x:x+w]
-            face_img_resized = cv2.resize(face_img, (200, 200))
-            face_path = os.path.join(PROCESSED_FACES, f'{student_id}_duplicate.jpg')
-            cv2.imwrite(face_path, face_img_resized)
+            with StageTimer(timings, 'jpeg_encode_ms'):
+                save_processed_face(f'{student_id}_duplicate', image_bytes, faces[0]['coordinates'])
+            observe_timings('/enroll', timings)
             
-            os.remove(photo_path)
             return jsonify({
                 'success': False,
                 'message': f'Face similar to student ID: {duplicate_student_id}. Use force_enroll=true to override this check.'
             }), 400
         
-        # Check if student ID already exists and remove old entry
-        if student_id in student_data['student_ids']:
-            # Remove existing entry for this student ID
-            old_index = student_data['student_ids'].index(student_id)
-            student_data['encodings'].pop(old_index)
-            student_data['student_ids'].pop(old_index)
-            print(f"Removed existing enrollment for student {student_id}")
-        
-        # Save face encoding and student ID
-        student_data['encodings'].append(face_encoding)
-        student_data['student_ids'].append(student_id)
-        save_student_data(student_data)
+        # Save face encoding as another sample of this student, or as their only one
+        with StageTimer(timings, 'persist_ms'):
+            if replace:
+                if student_id in embedding_store:
+                    logger.info("Replacing existing enrollment for student %s", student_id)
+                embedding_store.replace(student_id, face_encoding)
+            else:
+                embedding_store.add_sample(student_id, face_encoding, MAX_SAMPLES_PER_STUDENT)
+        with StageTimer(timings, 'gallery_refresh_ms'):
+            refresh_gallery()
         
         # Save processed face image (resize to standard size for consistency)
-        face_img = img[y:y+h, x:x+w]
-        face_img_resized = cv2.resize(face_img, (200, 200))  # Standard size
-        face_path = os.path.join(PROCESSED_FACES, f'{student_id}.jpg')
-        cv2.imwrite(face_path, face_img_resized)
+        with StageTimer(timings, 'jpeg_encode_ms'):
+            face_path = save_processed_face(student_id, image_bytes, faces[0]['coordinates'])
+        observe_timings('/enroll', timings)
         
-        print(f"Processed face saved to: {face_path}")
-        
-        # Clean up uploaded file
-        os.remove(photo_path)
+        logger.debug("Processed face saved to: %s", face_path)
         
         return jsonify({
             'success': True,
-            'message': 'Face enrolled successfully'
+            'message': 'Face enrolled successfully',
+            'samples': len(embedding_store.encodings_for(student_id))
         })
             
     except Exception as e:
-        # Clean up on error
-        if os.path.exists(photo_path):
-            os.remove(photo_path)
         return jsonify({
             'success': False,
             'message': f'Server error: {str(e)}'
         }), 500
 
+# Named live sources (cameras, RTSP streams, video files), each with one shared
+# capture + recognition pipeline fanned out to every viewer
+live_sources = SourceRegistry(course_galleries)
+live_sources.load()
+
+def live_stream_stat(read):
+    """Scrape-time callback reading one value from every live stream's stats"""
+    return lambda: {(stream['name'],): read(stream) for stream in live_sources.stats()['streams']}
+
+for _name, _help, _read in (
+    ('cv_live_capture_fps', 'Frames captured per second', lambda s: s.get('capture_fps')),
+    ('cv_live_inference_fps', 'Frames recognized per second', lambda s: s.get('inference_fps')),
+    ('cv_live_stream_fps', 'Frames streamed to viewers per second', lambda s: s.get('stream_fps')),
+    ('cv_live_subscribers', 'Viewers per live source', lambda s: s.get('subscribers')),
+):
+    REGISTRY.gauge(_name, _help, ('source',), callback=live_stream_stat(_read))
+REGISTRY.gauge('cv_live_dropped_frames_total', 'Frames dropped by the inference and encode queues', ('source', 'queue'),
+               kind='counter', callback=lambda: {
+                   (stream['name'], queue): count
+                   for stream in live_sources.stats()['streams'] for queue, count in stream.get('dropped', {}).items()
+               })
+
 @app.route('/api/attendance/live')
-def video_feed():
+@app.route('/api/attendance/live/<source_name>')
+def video_feed(source_name=None):
+    broker = live_sources.get(source_name)
+    if broker is None:
+        return jsonify({
+            'success': False,
+            'message': f'Unknown live source: {source_name}'
+        }), 404
+    # Optional ?course_id=...&student_ids=... restricts matching to one course roster
+    # (otherwise the source's own course binding applies)
+    matcher, error = resolve_matcher(request.args)
+    if matcher is None:
+        return jsonify({
+            'success': False,
+            'message': error
+        }), 404
+    course_id = request.args.get('course_id') or None
+    student_ids = parse_student_ids(request.args.get('student_ids'))
+    
     def generate_frames():
-        print("Attempting to open camera...")
-        camera = cv2.VideoCapture(0)
-        if not camera.isOpened():
-            print("Failed to open camera!")
+        subscription = broker.subscribe(course_id, student_ids)
+        if subscription is None:
+            logger.error("Failed to open camera %s!", broker.name)
             return b''
         
-        print("Camera opened successfully!")
-        while True:
-            success, frame = camera.read()
-            if not success:
-                print("Failed to read frame from camera")
-                break
-            
-            # Use the improved face detection for live video
-            face_encodings = get_all_face_encodings_proper(frame)
-            
-            # Process each detected face
-            for face_data in face_encodings:
-                face_encoding = face_data['encoding']
-                coordinates = face_data['coordinates']
-                x, y, w, h = coordinates
-                
-                # Find the best match with confidence scoring
-                best_match = None
-                best_confidence = 0.0
-                best_distance = float('inf')
-                
-                for i, encoding in enumerate(student_data['encodings']):
-                    distance = face_recognition.face_distance([encoding], face_encoding)[0]
-                    confidence = get_face_confidence_proper(encoding, face_encoding)
-                    
-                    # Find the match with the smallest distance (best match)
-                    if distance < best_distance and distance < 0.6:  # Proper threshold
-                        best_distance = distance
-                        best_confidence = confidence
-                        best_match = {
-                            'student_id': student_data['student_ids'][i],
-                            'confidence': confidence
-                        }
-                
-                # Only show recognition if confidence is high enough (50% threshold)
-                if best_match and best_confidence >= 0.5:
-                    # Draw green rectangle and student ID
-                    cv2.rectangle(frame, (x, y), (x+w, y+h), (0, 255, 0), 2)
-                    label = f"{best_match['student_id']} ({best_confidence:.2f})"
-                    cv2.putText(frame, label, (x, y-10), cv2.FONT_HERSHEY_SIMPLEX, 
-                              0.7, (0, 255, 0), 2)
-                else:
-                    # Draw red rectangle for unrecognized faces
-                    cv2.rectangle(frame, (x, y), (x+w, y+h), (0, 0, 255), 2)
-            
-            # Convert frame to JPEG
-            ret, buffer = cv2.imencode('.jpg', frame)
-            frame_bytes = buffer.tobytes()
-            
-            yield (b'--frame\r\n'
-                   b'Content-Type: image/jpeg\r\n\r\n' + frame_bytes + b'\r\n')
-        
-        # Make sure to release the camera
-        camera.release()
-        print("Camera released")
+        try:
+            for frame_bytes in subscription.frames():
+                yield (b'--frame\r\n'
+                       b'Content-Type: image/jpeg\r\n\r\n' + frame_bytes + b'\r\n')
+        finally:
+            # Also when the client disconnects; the broker releases the camera once nobody watches
+            broker.unsubscribe(subscription)
     
     return Response(generate_frames(),
                    mimetype='multipart/x-mixed-replace; boundary=frame')
 
+@app.route('/api/attendance/live/stats', methods=['GET'])
+def live_stats():
+    """Per-source FPS, inference lag, queue drops and latency, plus scheduler shares"""
+    return jsonify({
+        'success': True,
+        **live_sources.stats()
+    })
+
+@app.route('/live-sources', methods=['GET', 'POST'])
+def manage_live_sources():
+    """List live sources or register one (camera index, RTSP URL or video file path)"""
+    if request.method == 'GET':
+        return jsonify({
+            'success': True,
+            'sources': [
+                {
+                    'name': broker.name,
+                    'source': str(broker.source),
+                    'course_id': broker.course_id,
+                    'weight': broker.weight,
+                    'viewers': broker.subscriber_count
+                }
+                for broker in live_sources.brokers()
+            ]
+        })
+    
+    try:
+        data = request.get_json()
+        name = data.get('name')
+        source = data.get('source')
+        if not name or source is None or source == '':
+            return jsonify({
+                'success': False,
+                'message': 'Both name and source are required'
+            }), 400
+        
+        try:
+            live_sources.add(
+                name, source, course_id=data.get('course_id'),
+                weight=data.get('weight', 1.0), loop=data.get('loop', False)
+            )
+        except ValueError as e:
+            return jsonify({
+                'success': False,
+                'message': str(e)
+            }), 409
+        
+        logger.info("Registered live source %s: %s", name, source)
+        return jsonify({
+            'success': True,
+            'message': f'Live source {name} registered',
+            'name': name
+        })
+        
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'message': f'Server error: {str(e)}'
+        }), 500
+
+@app.route('/live-sources/<name>', methods=['DELETE'])
+def delete_live_source(name):
+    """Stop and remove a live source"""
+    removed = live_sources.remove(name)
+    return jsonify({
+        'success': removed,
+        'message': f'Live source {name} removed' if removed else f'Unknown live source: {name}'
+    }), 200 if removed else 404
+
 @app.route('/enroll-from-camera', methods=['POST'])
 def enroll_from_camera():
     """Enroll a student from the current camera frame"""
@@ -362,16 +502,24 @@ def enroll_from_camera():
         }), 400
     
     try:
-        # Read image file
-        img = Image.open(photo.stream)
-        img_array = np.array(img)
-        img_cv = cv2.cvtColor(img_array, cv2.COLOR_RGB2BGR)
+        # Decode the upload stream straight to RGB
+        timings = {}
+        try:
+            with StageTimer(timings, 'decode_ms'):
+                rgb_image, image_shape = decode_image(photo.stream)
+        except (UnidentifiedImageError, OSError):
+            return jsonify({
+                'success': False,
+                'message': 'Could not read uploaded image'
+            }), 400
         
-        print(f"Enrolling student {student_id} from camera frame of size: {img_cv.shape}")
+        logger.debug("Enrolling student %s from camera frame of size: %s", student_id, image_shape)
         
         # Get all face encodings using improved face_recognition library
-        face_encodings = get_all_face_encodings_proper(img_cv)
+        face_encodings = get_all_face_encodings_proper(rgb_image, image_shape, timings)
+        record_faces('/enroll-from-camera', face_encodings)
         if not face_encodings:
+            observe_timings('/enroll-from-camera', timings)
             return jsonify({
                 'success': False,
                 'message': 'No faces detected in camera frame'
@@ -382,22 +530,26 @@ def enroll_from_camera():
         face_encoding = largest_face['encoding']
         coordinates = largest_face['coordinates']
         
-        print(f"Using largest face at coordinates {coordinates} for enrollment")
+        logger.debug("Using largest face at coordinates %s for enrollment", coordinates)
         
         # Check for duplicate faces
-        for i, encoding in enumerate(student_data['encodings']):
-            if compare_faces_proper(encoding, face_encoding, tolerance=0.6):
-                return jsonify({
-                    'success': False,
-                    'message': f'Face already registered with student ID: {student_data["student_ids"][i]}'
-                }), 400
+        with StageTimer(timings, 'match_ms'):
+            duplicate_student_id = gallery_matcher.find_duplicate(face_encoding, tolerance=0.6, exclude=student_id)
+        if duplicate_student_id is not None:
+            observe_timings('/enroll-from-camera', timings)
+            return jsonify({
+                'success': False,
+                'message': f'Face already registered with student ID: {duplicate_student_id}'
+            }), 400
         
-        # Save face encoding and student ID
-        student_data['encodings'].append(face_encoding)
-        student_data['student_ids'].append(student_id)
-        save_student_data(student_data)
+        # Save face encoding as another sample of this student
+        with StageTimer(timings, 'persist_ms'):
+            embedding_store.add_sample(student_id, face_encoding, MAX_SAMPLES_PER_STUDENT)
+        with StageTimer(timings, 'gallery_refresh_ms'):
+            refresh_gallery()
+        observe_timings('/enroll-from-camera', timings)
         
-        print(f"Successfully enrolled student {student_id}")
+        logger.info("Enrolled student %s from camera frame", student_id)
         
         return jsonify({
             'success': True,
@@ -417,6 +569,164 @@ def enroll_from_camera():
             'message': f'Server error: {str(e)}'
         }), 500
 
+def collect_bulk_photos(files):
+    """(student_id, image_bytes) pairs from 'photos' uploads and zip 'archive' uploads
+
+    The student ID is the file name without extension, e.g. 2021CS001.jpg.
+    """
+    photos = []
+    for photo in files.getlist('photos'):
+        if photo.filename and photo.filename.lower().endswith(IMAGE_EXTENSIONS):
+            photos.append((os.path.splitext(os.path.basename(photo.filename))[0], photo.read()))
+    for archive in files.getlist('archive'):
+        with zipfile.ZipFile(archive.stream) as zf:
+            for info in zf.infolist():
+                name = info.filename
+                if info.is_dir() or '__MACOSX' in name or not name.lower().endswith(IMAGE_EXTENSIONS):
+                    continue
+                photos.append((os.path.splitext(os.path.basename(name))[0], zf.read(info)))
+    return photos
+
+def save_processed_face(name, image_bytes, coordinates):
+    """Save the 200x200 face crop kept for debugging enrollments; returns its path"""
+    face_path = os.path.join(PROCESSED_FACES, f'{name}.jpg')
+    with open(face_path, 'wb') as f:
+        f.write(face_crop_jpeg(image_bytes, coordinates))
+    return face_path
+
+@app.route('/enroll-bulk', methods=['POST'])
+def enroll_bulk():
+    """Enroll many students from <student_id>.jpg photos (multipart 'photos' or a zip 'archive')
+
+    Photos are encoded in parallel, duplicates are checked in one batched pass
+    (against the gallery and within the upload) and all new encodings are
+    committed to the store at once. Like /enroll, each photo is added as
+    another sample of its student unless replace=true. Progress streams back
+    as NDJSON, or as server-sent events with format=sse.
+    """
+    force_enroll = request.form.get('force_enroll', 'false').lower() == 'true'
+    replace = request.form.get('replace', 'false').lower() == 'true'
+    use_sse = request.args.get('format', request.form.get('format', 'ndjson')) == 'sse'
+    
+    try:
+        photos = collect_bulk_photos(request.files)
+    except zipfile.BadZipFile:
+        return jsonify({
+            'success': False,
+            'message': 'Archive is not a valid zip file'
+        }), 400
+    
+    if not photos:
+        return jsonify({
+            'success': False,
+            'message': 'No photos provided (send photos[] or a zip archive of <student_id>.jpg files)'
+        }), 400
+    
+    def event(name, **data):
+        data = {'event': name, **data}
+        if use_sse:
+            return f"event: {name}\ndata: {json.dumps(data)}\n\n"
+        return json.dumps(data) + '\n'
+    
+    def generate():
+        start = time.perf_counter()
+        total = len(photos)
+        yield event('start', total=total)
+        
+        # Encode every photo in parallel; a repeated student ID keeps its first photo
+        seen_ids = set()
+        jobs = []
+        failed = 0
+        for index, (student_id, data) in enumerate(photos):
+            if student_id in seen_ids:
+                failed += 1
+                yield event('photo', index=index, student_id=student_id, status='error',
+                            message='Student ID appears more than once in this upload')
+                continue
+            seen_ids.add(student_id)
+            jobs.append(index)
+        
+        encoded = {}
+        done = failed
+        with ThreadPoolExecutor(max_workers=max(1, min(BULK_ENROLL_WORKERS, len(jobs)))) as executor:
+            futures = {executor.submit(detect_upload, photos[index][1]): index for index in jobs}
+            for future in as_completed(futures):
+                index = futures[future]
+                student_id = photos[index][0]
+                done += 1
+                try:
+                    _, faces, timings = future.result()
+                except Exception as e:
+                    failed += 1
+                    yield event('photo', index=index, student_id=student_id, status='error',
+                                message=f'Could not read image: {e}', done=done, total=total)
+                    continue
+                observe_timings('/enroll-bulk', timings)
+                record_faces('/enroll-bulk', faces)
+                if not faces:
+                    failed += 1
+                    yield event('photo', index=index, student_id=student_id, status='no_face',
+                                done=done, total=total)
+                    continue
+                encoded[index] = faces[0]
+                yield event('photo', index=index, student_id=student_id, status='encoded',
+                            done=done, total=total)
+        
+        # One batched duplicate check: against the enrolled gallery, then within the upload
+        order = sorted(encoded)
+        encodings = [encoded[index]['encoding'] for index in order]
+        duplicate_of = {}
+        batch_timings = {}
+        if order and not force_enroll:
+            # A match with the student's own previous enrollment is not a conflict
+            with StageTimer(batch_timings, 'match_ms'):
+                gallery_candidates = gallery_matcher.match(encodings, k=2, exact=True)
+            for index, candidates in zip(order, gallery_candidates):
+                for candidate in candidates:
+                    if candidate['distance'] <= 0.6 and candidate['student_id'] != photos[index][0]:
+                        duplicate_of[index] = candidate['student_id']
+                        break
+            for i, j in sorted(find_duplicate_pairs(encodings, tolerance=0.6)):
+                if order[i] not in duplicate_of and order[j] not in duplicate_of:
+                    duplicate_of[order[i]] = photos[order[j]][0]
+        for index, other_id in sorted(duplicate_of.items()):
+            yield event('photo', index=index, student_id=photos[index][0], status='duplicate',
+                        duplicate_of=other_id)
+        
+        # One store commit for every accepted photo
+        accepted = [index for index in order if index not in duplicate_of]
+        if accepted:
+            accepted_ids = [photos[index][0] for index in accepted]
+            accepted_encodings = [encoded[index]['encoding'] for index in accepted]
+            with StageTimer(batch_timings, 'persist_ms'):
+                if replace:
+                    embedding_store.replace_many(accepted_ids, accepted_encodings)
+                else:
+                    embedding_store.add_samples(accepted_ids, accepted_encodings, MAX_SAMPLES_PER_STUDENT)
+            with StageTimer(batch_timings, 'gallery_refresh_ms'):
+                refresh_gallery()
+            with StageTimer(batch_timings, 'jpeg_encode_ms'), \
+                    ThreadPoolExecutor(max_workers=max(1, min(BULK_ENROLL_WORKERS, len(accepted)))) as executor:
+                list(executor.map(
+                    lambda index: save_processed_face(photos[index][0], photos[index][1], encoded[index]['coordinates']),
+                    accepted
+                ))
+        observe_timings('/enroll-bulk', batch_timings)
+        
+        logger.info("Bulk enrollment: %d enrolled, %d duplicates, %d failed", len(accepted), len(duplicate_of), failed)
+        yield event(
+            'done',
+            success=True,
+            total=total,
+            enrolled=len(accepted),
+            duplicates=len(duplicate_of),
+            failed=failed,
+            enrolled_ids=[photos[index][0] for index in accepted],
+            elapsed_ms=round((time.perf_counter() - start) * 1000, 2)
+        )
+    
+    return Response(generate(), mimetype='text/event-stream' if use_sse else 'application/x-ndjson')
+
 @app.route('/test-face-detection', methods=['POST'])
 def test_face_detection():
     """Test endpoint to check if faces can be detected in an image"""
@@ -435,33 +745,41 @@ def test_face_detection():
         }), 400
     
     try:
-        # Read image file
-        img = Image.open(photo.stream)
-        img_array = np.array(img)
-        img_cv = cv2.cvtColor(img_array, cv2.COLOR_RGB2BGR)
+        # Decode the upload stream straight to RGB
+        timings = {}
+        try:
+            with StageTimer(timings, 'decode_ms'):
+                rgb_image, image_shape = decode_image(photo.stream)
+        except (UnidentifiedImageError, OSError):
+            return jsonify({
+                'success': False,
+                'message': 'Could not read uploaded image'
+            }), 400
         
-        print(f"Testing face detection on image of size: {img_cv.shape}")
+        logger.debug("Testing face detection on image of size: %s", image_shape)
         
         # Get face encoding using improved face_recognition library
-        result = get_face_encoding_proper(img_cv)
+        result = get_face_encoding_proper(rgb_image, timings)
+        observe_timings('/test-face-detection', timings)
         if result is None:
             return jsonify({
                 'success': False,
                 'message': 'No face detected in photo',
-                'image_size': img_cv.shape
+                'image_size': image_shape,
+                'timings': timings
             }), 400
         
         face_encoding, face_location = result
-        # face_recognition returns (top, right, bottom, left)
-        top, right, bottom, left = face_location
-        x, y, w, h = left, top, right - left, bottom - top
+        # face_recognition returns (top, right, bottom, left) in decoded pixels
+        x, y, w, h = location_to_coordinates(face_location, decode_scale(rgb_image, image_shape))
         
         return jsonify({
             'success': True,
             'message': 'Face detected successfully',
-            'image_size': img_cv.shape,
+            'image_size': image_shape,
             'face_coordinates': {'x': int(x), 'y': int(y), 'w': int(w), 'h': int(h)},
-            'face_encoding_size': len(face_encoding)
+            'face_encoding_size': len(face_encoding),
+            'timings': timings
         })
         
     except Exception as e:
@@ -487,65 +805,64 @@ def verify_face():
         }), 400
     
     try:
-        # Read image file
-        img = Image.open(photo.stream)
-        img_array = np.array(img)
-        img_cv = cv2.cvtColor(img_array, cv2.COLOR_RGB2BGR)
+        # Number of candidates to report per face (1 = best match only)
+        top_k = max(1, int(request.form.get('top_k', 1)))
+        # Force brute-force search even when the approximate index is enabled
+        exact = request.form.get('exact', 'false').lower() == 'true'
         
-        print(f"Processing image of size: {img_cv.shape}")
-        print(f"Number of enrolled students: {len(student_data['encodings'])}")
+        # Restrict matching to a course roster when course_id/student_ids are given
+        matcher, error = resolve_matcher(request.form)
+        if matcher is None:
+            return jsonify({
+                'success': False,
+                'message': error
+            }), 404
+        
+        # Decode, detect and encode (on a worker process when the pool is enabled)
+        try:
+            image_shape, face_encodings, timings = detect_upload(photo.read())
+        except (UnidentifiedImageError, OSError):
+            return jsonify({
+                'success': False,
+                'message': 'Could not read uploaded image'
+            }), 400
+        
+        logger.debug("Processing image of size %s against %d students", image_shape, matcher.num_students)
         
-        # Get all face encodings using improved face_recognition library
-        face_encodings = get_all_face_encodings_proper(img_cv)
         if not face_encodings:
+            observe_timings('/verify', timings)
+            record_faces('/verify', face_encodings)
             return jsonify({
                 'success': False,
                 'message': 'No faces detected in photo'
             }), 400
         
-        print(f"Processing {len(face_encodings)} faces for recognition")
-        
         # Process ALL faces, not just the largest one
         all_recognized = []
         
-        for face_idx, face_data in enumerate(face_encodings):
-            face_encoding = face_data['encoding']
+        # Score every face against every enrolled student in one batched call
+        with StageTimer(timings, 'match_ms'):
+            best_matches = matcher.best_matches(
+                [f['encoding'] for f in face_encodings], tolerance=0.6, k=top_k, exact=exact
+            )
+        
+        observe_timings('/verify', timings)
+        record_faces('/verify', face_encodings, best_matches)
+        
+        debug = logger.isEnabledFor(logging.DEBUG)
+        for face_idx, (face_data, match) in enumerate(zip(face_encodings, best_matches)):
             coordinates = face_data['coordinates']
-            
-            print(f"\nProcessing face {face_idx + 1} at coordinates {coordinates}")
-            
-            # Find the best match for this face
-            best_match = None
-            best_distance = float('inf')
-            
-            for i, encoding in enumerate(student_data['encodings']):
-                distance = face_recognition.face_distance([encoding], face_encoding)[0]
-                confidence = get_face_confidence_proper(encoding, face_encoding)
-                
-                print(f"  Student {student_data['student_ids'][i]}: distance={distance:.4f}, confidence={confidence:.3f}")
-                
-                # Find the match with the smallest distance (best match)
-                if distance < best_distance and distance < 0.6:  # Proper threshold
-                    best_distance = distance
-                    best_match = {
-                        'student_id': student_data['student_ids'][i],
-                        'confidence': confidence,
-                        'distance': distance,
-                        'face_coordinates': {
-                            'x': int(coordinates[0]),
-                            'y': int(coordinates[1]),
-                            'w': int(coordinates[2]),
-                            'h': int(coordinates[3])
-                        }
-                    }
-                    print(f"    → New best match: {student_data['student_ids'][i]} (distance: {distance:.4f})")
+            best_match = build_recognition(match, coordinates, top_k) if match else None
             
             # Add this face's best match if it's good enough (50% confidence threshold)
             if best_match and best_match['confidence'] >= 0.5:
                 all_recognized.append(best_match)
-                print(f"✅ Face {face_idx + 1} recognized as: {best_match['student_id']} with confidence {best_match['confidence']:.3f}")
-            else:
-                print(f"❌ Face {face_idx + 1}: No good match found (best distance: {best_distance:.4f})")
+                if debug:
+                    logger.debug("Face %d at %s recognized as %s with confidence %.3f (distance: %.4f)",
+                                 face_idx + 1, coordinates, best_match['student_id'],
+                                 best_match['confidence'], best_match['distance'])
+            elif debug:
+                logger.debug("Face %d at %s: no good match found", face_idx + 1, coordinates)
         
         # Remove duplicates (same student recognized multiple times)
         unique_recognized = []
@@ -560,15 +877,17 @@ def verify_face():
                 'success': True,
                 'recognized': unique_recognized,
                 'total_faces_detected': len(face_encodings),
-                'total_students_recognized': len(unique_recognized)
+                'total_students_recognized': len(unique_recognized),
+                'timings': timings
             }
         else:
             result = {
                 'success': False,
-                'message': f'No faces recognized in photo (detected {len(face_encodings)} faces)'
+                'message': f'No faces recognized in photo (detected {len(face_encodings)} faces)',
+                'timings': timings
             }
         
-        print(f"Verification result: {result}")
+        logger.debug("Verification result: %s", result)
         return jsonify(result)
         
     except Exception as e:
@@ -577,6 +896,165 @@ def verify_face():
             'message': f'Server error: {str(e)}'
         }), 500
 
+@app.route('/verify-batch', methods=['POST'])
+def verify_batch():
+    """Verify several photos in one request and merge the recognized students"""
+    photos = [p for p in request.files.getlist('photos') + request.files.getlist('photo') if p.filename != '']
+    if not photos:
+        return jsonify({
+            'success': False,
+            'message': 'No photo files provided'
+        }), 400
+    
+    try:
+        top_k = max(1, int(request.form.get('top_k', 1)))
+        exact = request.form.get('exact', 'false').lower() == 'true'
+        
+        matcher, error = resolve_matcher(request.form)
+        if matcher is None:
+            return jsonify({
+                'success': False,
+                'message': error
+            }), 404
+        
+        # Read request streams on this thread, then decode and detect in parallel
+        uploads = [(photo.filename, photo.read()) for photo in photos]
+        logger.debug("Batch verification of %d images against %d students", len(uploads), matcher.num_students)
+        
+        image_timings = [{} for _ in uploads]
+        
+        def decode_and_detect(i):
+            try:
+                return detect_faces_rgb(uploads[i][1], image_timings[i])
+            except Exception as e:
+                logger.warning("Could not process %s: %s", uploads[i][0], e)
+                return None
+        
+        faces = []
+        batch_timings = {}
+        detections = [None] * len(uploads)
+        
+        # Photos seen before come straight from the encoding cache
+        with StageTimer(batch_timings, 'cache_ms'):
+            cached = [encoding_cache.get(data) for _, data in uploads]
+        for i, hit in enumerate(cached):
+            if hit is not None:
+                image_shape, image_faces = hit
+                detections[i] = (image_shape, [face['coordinates'] for face in image_faces])
+                faces.extend((i, face['encoding'], face['coordinates']) for face in image_faces)
+        pending = [i for i, hit in enumerate(cached) if hit is None]
+        
+        pool = get_detection_pool()
+        if pool is not None:
+            # Each image is decoded, detected and encoded on its own worker process
+            futures = [(i, pool.submit(uploads[i][1])) for i in pending]
+            for i, future in futures:
+                try:
+                    image_shape, image_faces, timings = future.result()
+                except Exception as e:
+                    logger.warning("Could not process %s: %s", uploads[i][0], e)
+                    continue
+                image_timings[i] = timings
+                detections[i] = (image_shape, [face['coordinates'] for face in image_faces])
+                faces.extend((i, face['encoding'], face['coordinates']) for face in image_faces)
+                encoding_cache.put(uploads[i][1], image_shape, image_faces)
+        elif pending:
+            with ThreadPoolExecutor(max_workers=max(1, min(VERIFY_BATCH_WORKERS, len(pending)))) as executor:
+                decoded_images = dict(zip(pending, executor.map(decode_and_detect, pending)))
+            
+            # One encoder call covers the whole batch, so its time is reported once
+            decoded = [i for i in pending if decoded_images[i] is not None]
+            with StageTimer(batch_timings, 'encode_ms'):
+                encodings = batch_face_encodings(
+                    [decoded_images[i][0] for i in decoded],
+                    [decoded_images[i][1] for i in decoded]
+                )
+            
+            # Flatten every face of every image into one batched gallery match
+            for i, image_encodings in zip(decoded, encodings):
+                rgb_image, face_locations, image_shape = decoded_images[i]
+                image_faces = build_faces(image_encodings, face_locations, rgb_image, image_shape)
+                detections[i] = (image_shape, [face['coordinates'] for face in image_faces])
+                faces.extend((i, face['encoding'], face['coordinates']) for face in image_faces)
+                encoding_cache.put(uploads[i][1], image_shape, image_faces)
+        
+        with StageTimer(batch_timings, 'match_ms'):
+            best_matches = matcher.best_matches([f[1] for f in faces], tolerance=0.6, k=top_k, exact=exact)
+        for i, detection in enumerate(detections):
+            observe_timings('/verify-batch', image_timings[i])
+            if detection is not None:
+                FACES_PER_IMAGE.observe(len(detection[1]), endpoint='/verify-batch')
+        observe_timings('/verify-batch', batch_timings)
+        record_faces('/verify-batch', (), best_matches)
+        
+        results = [
+            {
+                'filename': filename,
+                'success': False,
+                'total_faces_detected': 0,
+                'recognized': [],
+                'timings': timings
+            }
+            for (filename, _), timings in zip(uploads, image_timings)
+        ]
+        for i, result in enumerate(results):
+            if detections[i] is None:
+                result['message'] = 'Could not read uploaded image'
+            else:
+                result['total_faces_detected'] = len(detections[i][1])
+        
+        students = {}
+        for (image_index, _, coordinates), match in zip(faces, best_matches):
+            if not match or match['confidence'] < 0.5:
+                continue
+            recognition = build_recognition(match, coordinates, top_k)
+            image_result = results[image_index]
+            # Same student twice in one photo: keep the closer face
+            existing = next((r for r in image_result['recognized'] if r['student_id'] == recognition['student_id']), None)
+            if existing is None:
+                image_result['recognized'].append(recognition)
+            elif recognition['distance'] < existing['distance']:
+                image_result['recognized'][image_result['recognized'].index(existing)] = recognition
+            
+            merged = students.get(recognition['student_id'])
+            if merged is None:
+                students[recognition['student_id']] = merged = {
+                    'student_id': recognition['student_id'],
+                    'confidence': recognition['confidence'],
+                    'distance': recognition['distance'],
+                    'best_image': image_index,
+                    'images': []
+                }
+            elif recognition['distance'] < merged['distance']:
+                merged.update(confidence=recognition['confidence'], distance=recognition['distance'], best_image=image_index)
+            if image_index not in merged['images']:
+                merged['images'].append(image_index)
+        
+        for result in results:
+            result['success'] = bool(result['recognized'])
+            result['total_students_recognized'] = len(result['recognized'])
+            if not result['success'] and 'message' not in result:
+                result['message'] = f"No faces recognized in photo (detected {result['total_faces_detected']} faces)"
+        
+        recognized = sorted(students.values(), key=lambda s: s['distance'])
+        logger.debug("Batch verification recognized %d students across %d images", len(recognized), len(uploads))
+        
+        return jsonify({
+            'success': bool(recognized),
+            'recognized': recognized,
+            'results': results,
+            'total_images': len(uploads),
+            'total_faces_detected': len(faces),
+            'total_students_recognized': len(recognized),
+            'timings': batch_timings
+        })
+        
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'message': f'Server error: {str(e)}'
+        }), 500
+
 @app.route('/delete-student', methods=['POST'])
 def delete_student():
     """Delete a student's face data and associated files"""
@@ -590,23 +1068,18 @@ def delete_student():
                 'message': 'Student ID is required'
             }), 400
         
-        print(f"Deleting student {student_id} from face recognition system...")
-        
         # Find and remove student from embeddings
         student_found = False
-        if student_id in student_data['student_ids']:
-            # Get the index of the student
-            student_index = student_data['student_ids'].index(student_id)
-            
-            # Remove from both lists
-            student_data['encodings'].pop(student_index)
-            student_data['student_ids'].pop(student_index)
-            
-            # Save updated data
-            save_student_data(student_data)
+        timings = {}
+        with StageTimer(timings, 'persist_ms'):
+            removed = embedding_store.remove(student_id)
+        if removed:
+            with StageTimer(timings, 'gallery_refresh_ms'):
+                refresh_gallery()
             student_found = True
             
-            print(f"Removed student {student_id} from embeddings")
+            logger.info("Removed student %s from embeddings", student_id)
+        observe_timings('/delete-student', timings)
         
         # Delete associated image files
         files_deleted = []
@@ -616,14 +1089,14 @@ def delete_student():
         if os.path.exists(upload_path):
             os.remove(upload_path)
             files_deleted.append(upload_path)
-            print(f"Deleted upload file: {upload_path}")
+            logger.debug("Deleted upload file: %s", upload_path)
         
         # Delete from processed_faces directory
         processed_path = os.path.join(PROCESSED_FACES, f'{student_id}.jpg')
         if os.path.exists(processed_path):
             os.remove(processed_path)
             files_deleted.append(processed_path)
-            print(f"Deleted processed file: {processed_path}")
+            logger.debug("Deleted processed file: %s", processed_path)
         
         # Also check for any files with the student ID in the name (in case of different extensions)
         for directory in [UPLOAD_FOLDER, PROCESSED_FACES]:
@@ -633,7 +1106,7 @@ def delete_student():
                     if os.path.exists(file_path):
                         os.remove(file_path)
                         files_deleted.append(file_path)
-                        print(f"Deleted additional file: {file_path}")
+                        logger.debug("Deleted additional file: %s", file_path)
         
         return jsonify({
             'success': True,
@@ -655,9 +1128,11 @@ def debug_embeddings():
     try:
         return jsonify({
             'success': True,
-            'student_ids': student_data['student_ids'],
-            'encodings_count': len(student_data['encodings']),
-            'message': f'Found {len(student_data["student_ids"])} students in face recognition system'
+            'student_ids': gallery_matcher.identities,
+            'encodings_count': len(embedding_store),
+            'students_count': gallery_matcher.num_students,
+            'tombstones': embedding_store.tombstones,
+            'message': f'Found {gallery_matcher.num_students} students in face recognition system'
         })
     except Exception as e:
         return jsonify({
@@ -665,6 +1140,22 @@ def debug_embeddings():
             'message': f'Server error: {str(e)}'
         }), 500
 
+@app.route('/encoding-cache', methods=['GET', 'DELETE'])
+def encoding_cache_stats():
+    """Hit/miss counters of the encoding cache, or clear it with DELETE"""
+    if request.method == 'DELETE':
+        encoding_cache.clear()
+        return jsonify({
+            'success': True,
+            'message': 'Encoding cache cleared'
+        })
+
+    return jsonify({
+        'success': True,
+        'signature': encoding_cache.signature,
+        **encoding_cache.stats()
+    })
+
 @app.route('/update-student-id', methods=['POST'])
 def update_student_id():
     """Update a student ID in the face recognition system"""
@@ -679,20 +1170,17 @@ def update_student_id():
                 'message': 'Both old_id and new_id are required'
             }), 400
         
-        if old_id not in student_data['student_ids']:
+        if old_id not in embedding_store:
             return jsonify({
                 'success': False,
                 'message': f'Student {old_id} not found in face recognition system'
             }), 404
         
-        # Update the student ID
-        index = student_data['student_ids'].index(old_id)
-        student_data['student_ids'][index] = new_id
-        
-        # Save updated data
-        save_student_data(student_data)
+        # Update the student ID (journaled, vectors are untouched)
+        embedding_store.rename(old_id, new_id)
+        refresh_gallery()
         
-        print(f"Updated student ID from {old_id} to {new_id}")
+        logger.info("Updated student ID from %s to %s", old_id, new_id)
         
         return jsonify({
             'success': True,
@@ -707,5 +1195,65 @@ def update_student_id():
             'message': f'Server error: {str(e)}'
         }), 500
 
-if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=5001)
\ No newline at end of file
+@app.route('/course-roster', methods=['POST'])
+def set_course_roster():
+    """Register the student IDs enrolled in a course for scoped recognition"""
+    try:
+        data = request.get_json()
+        course_id = data.get('course_id')
+        student_ids = parse_student_ids(data.get('student_ids'))
+        
+        if not course_id or student_ids is None:
+            return jsonify({
+                'success': False,
+                'message': 'Both course_id and student_ids are required'
+            }), 400
+        
+        course_galleries.set_roster(course_id, student_ids)
+        enrolled = course_galleries.view(course_id)
+        
+        logger.info("Registered roster for course %s: %d students, %d with enrolled faces",
+                    course_id, len(student_ids), enrolled.num_students)
+        
+        return jsonify({
+            'success': True,
+            'message': f'Roster registered for course {course_id}',
+            'course_id': course_id,
+            'roster_size': len(student_ids),
+            'enrolled_faces': enrolled.num_students
+        })
+        
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'message': f'Server error: {str(e)}'
+        }), 500
+
+@app.route('/course-roster/<course_id>', methods=['GET', 'DELETE'])
+def course_roster(course_id):
+    """Inspect or remove a registered course roster"""
+    if request.method == 'DELETE':
+        removed = course_galleries.remove_roster(course_id)
+        return jsonify({
+            'success': removed,
+            'message': f'Roster for course {course_id} removed' if removed else f'No roster registered for course {course_id}'
+        }), 200 if removed else 404
+    
+    roster = course_galleries.get_roster(course_id)
+    if roster is None:
+        return jsonify({
+            'success': False,
+            'message': f'No roster registered for course {course_id}'
+        }), 404
+    
+    return jsonify({
+        'success': True,
+        'course_id': course_id,
+        'student_ids': roster,
+        'enrolled_faces': course_galleries.view(course_id).num_students
+    })
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Prometheus text exposition of request, stage, gallery, cache and live stream metrics"""
+    return Response(render_metrics(), content_type=CONTENT_TYPE)
@@ -0,0 +1,477 @@
+"""
+Staged live-video pipeline: capture -> inference -> JPEG encode.
+
+Each stage runs on its own thread and hands frames on through bounded
+drop-oldest queues, so a slow stage never backs frames up behind it:
+
+    capture    reads the source as fast as it delivers (video files are paced
+               to their native FPS) and keeps only the newest frame for
+               inference and for the encoder
+    inference  runs the face tracker on the newest frame and publishes the
+               latest annotations (boxes + identities)
+    encoder    draws the latest annotations on every captured frame and
+               JPEG-encodes it once, then fans it out to every subscriber
+
+Inference is served by an InferenceScheduler, whose worker threads can be
+shared by many pipelines (one per camera/room) so the total recognition
+load stays within a fixed CPU budget. A pipeline without a scheduler gets a
+private single-worker one.
+
+Subscribers read with frames() (a blocking generator, for WSGI) or
+aframes() (an async generator woken by the queue, for asyncio servers, so
+an idle viewer holds no thread).
+
+Stream FPS is therefore bounded by the camera and the encoder, not by
+recognition speed. stats() exports per-stage FPS, queue drops, inference
+lag and capture-to-yield latency percentiles.
+"""
+import asyncio
+import collections
+import logging
+import os
+import threading
+import time
+
+import cv2
+import numpy as np
+
+from metrics import STAGE_SECONDS
+from tracking import FaceTracker
+
+logger = logging.getLogger(__name__)
+
+JPEG_QUALITY = 80
+# Inference threads shared by every live source, and an optional cap on their combined rate
+INFERENCE_WORKERS = int(os.environ.get('CV_INFERENCE_WORKERS', max(1, (os.cpu_count() or 2) // 2)))
+INFERENCE_MAX_FPS = float(os.environ.get('CV_INFERENCE_MAX_FPS', 0))
+
+
+class DropOldestQueue:
+    """Bounded queue whose put() discards the oldest item instead of blocking"""
+
+    def __init__(self, maxsize=1):
+        self._items = collections.deque(maxlen=maxsize)
+        self._cond = threading.Condition()
+        self.dropped = 0
+        # Called after every put (used to wake an asyncio reader)
+        self.listener = None
+
+    def put(self, item):
+        with self._cond:
+            if len(self._items) == self._items.maxlen:
+                self.dropped += 1
+            self._items.append(item)
+            self._cond.notify()
+        listener = self.listener
+        if listener is not None:
+            listener()
+
+    def get(self, timeout=None):
+        """Oldest queued item, or None if nothing arrived within timeout"""
+        with self._cond:
+            if not self._items:
+                self._cond.wait(timeout)
+            return self._items.popleft() if self._items else None
+
+    def __len__(self):
+        with self._cond:
+            return len(self._items)
+
+
+class RateMeter:
+    """Events per second over a sliding window"""
+
+    def __init__(self, window=2.0):
+        self.window = window
+        self._events = collections.deque()
+        self._lock = threading.Lock()
+
+    def tick(self, now=None):
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            self._events.append(now)
+            while self._events and now - self._events[0] > self.window:
+                self._events.popleft()
+
+    def rate(self):
+        now = time.monotonic()
+        with self._lock:
+            while self._events and now - self._events[0] > self.window:
+                self._events.popleft()
+            return round(len(self._events) / self.window, 2)
+
+
+def draw_annotations(frame, annotations):
+    """Draw (box, student_id, confidence) annotations in place"""
+    for (x, y, w, h), student_id, confidence in annotations:
+        # Only show recognition if confidence is high enough (50% threshold)
+        if student_id and confidence >= 0.5:
+            cv2.rectangle(frame, (x, y), (x + w, y + h), (0, 255, 0), 2)
+            cv2.putText(frame, f"{student_id} ({confidence:.2f})", (x, y - 10),
+                        cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 255, 0), 2)
+        else:
+            cv2.rectangle(frame, (x, y), (x + w, y + h), (0, 0, 255), 2)
+    return frame
+
+
+class InferenceScheduler:
+    """Worker threads running inference for any number of live pipelines
+
+    Every pipeline keeps only its newest frame waiting. Idle workers pick the
+    next pipeline by smooth weighted round-robin among those that have a frame
+    waiting and are not already being processed (trackers are not thread
+    safe), so a source with weight 2 gets twice the inference slots of a
+    source with weight 1 when the workers are saturated. max_fps caps the
+    combined inference rate across all sources (0 = unlimited).
+    """
+
+    def __init__(self, workers=INFERENCE_WORKERS, max_fps=INFERENCE_MAX_FPS):
+        self.workers = max(1, workers)
+        self.max_fps = max_fps
+        self._entries = {}
+        self._cond = threading.Condition()
+        self._threads = []
+        self._stop = threading.Event()
+        self._next_slot = 0.0
+
+    def register(self, pipeline, weight=1.0):
+        with self._cond:
+            self._entries[pipeline] = {'weight': max(float(weight), 0.01), 'current': 0.0, 'busy': False, 'runs': 0}
+            if not self._threads:
+                self._start()
+
+    def unregister(self, pipeline):
+        with self._cond:
+            self._entries.pop(pipeline, None)
+
+    def notify(self):
+        """Wake a worker: a pipeline has a new frame waiting"""
+        with self._cond:
+            self._cond.notify()
+
+    def _start(self):
+        self._stop.clear()
+        self._threads = [
+            threading.Thread(target=self._worker, name=f'live-inference-{i}', daemon=True)
+            for i in range(self.workers)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def _pick(self):
+        """Smooth weighted round-robin over pipelines with a frame waiting"""
+        ready = [(p, e) for p, e in self._entries.items() if not e['busy'] and p.has_frame()]
+        if not ready:
+            return None
+        total = sum(e['weight'] for _, e in ready)
+        for _, entry in ready:
+            entry['current'] += entry['weight']
+        pipeline, entry = max(ready, key=lambda item: item[1]['current'])
+        entry['current'] -= total
+        return pipeline
+
+    def _wait_for_slot(self):
+        if not self.max_fps:
+            return
+        with self._cond:
+            now = time.monotonic()
+            slot = max(now, self._next_slot)
+            self._next_slot = slot + 1.0 / self.max_fps
+        if slot > now:
+            time.sleep(slot - now)
+
+    def _worker(self):
+        while not self._stop.is_set():
+            self._wait_for_slot()
+            with self._cond:
+                pipeline = self._pick()
+                while pipeline is None and not self._stop.is_set():
+                    self._cond.wait(0.5)
+                    pipeline = self._pick()
+                if pipeline is None:
+                    break
+                entry = self._entries[pipeline]
+                entry['busy'] = True
+            try:
+                pipeline.run_inference()
+            except Exception as e:
+                logger.exception("Inference failed for source %s: %s", pipeline.name, e)
+            finally:
+                with self._cond:
+                    entry['busy'] = False
+                    entry['runs'] += 1
+                    self._cond.notify()
+
+    def stop(self):
+        self._stop.set()
+        with self._cond:
+            self._cond.notify_all()
+        for thread in self._threads:
+            thread.join(timeout=2.0)
+        self._threads = []
+
+    def stats(self):
+        with self._cond:
+            runs = {p.name: e['runs'] for p, e in self._entries.items()}
+            weights = {p.name: e['weight'] for p, e in self._entries.items()}
+        total = sum(runs.values()) or 1
+        return {
+            'workers': self.workers,
+            'max_fps': self.max_fps,
+            'sources': {
+                name: {'weight': weights[name], 'runs': count, 'share': round(count / total, 3)}
+                for name, count in runs.items()
+            }
+        }
+
+
+def is_file_source(source):
+    return isinstance(source, str) and os.path.isfile(source)
+
+
+def parse_source(value):
+    """Camera indices may be given as strings ("0"); everything else is a path or URL"""
+    if isinstance(value, str) and value.strip().isdigit():
+        return int(value)
+    return value
+
+
+class LivePipeline:
+    """Capture, inference and encoder threads for one video source
+
+    Args:
+        source: cv2.VideoCapture argument (camera index, file path or URL)
+        get_matcher: callable returning the GalleryMatcher to use, called on
+            every inference so gallery changes are picked up
+        tracker: FaceTracker instance (a new one by default)
+        scheduler: shared InferenceScheduler (a private one by default)
+        weight: this source's share of the scheduler's inference slots
+        loop: restart video files from the beginning when they end
+        realtime: pace reads to the source FPS (default: only for video files)
+        name: label for stats and logs (defaults to the source)
+    """
+
+    def __init__(self, source, get_matcher, tracker=None, jpeg_quality=JPEG_QUALITY,
+                 scheduler=None, weight=1.0, loop=False, realtime=None, name=None):
+        self.source = source
+        self.name = name or str(source)
+        self.get_matcher = get_matcher
+        self.tracker = tracker or FaceTracker()
+        self.jpeg_quality = jpeg_quality
+        self.weight = weight
+        self.loop = loop
+        self.realtime = is_file_source(source) if realtime is None else realtime
+        self._owns_scheduler = scheduler is None
+        self.scheduler = scheduler or InferenceScheduler(workers=1, max_fps=0)
+
+        self._capture = None
+        self._rewound = False
+        self._stop = threading.Event()
+        self._threads = []
+        self._inference_queue = DropOldestQueue(1)
+        self._encode_queue = DropOldestQueue(2)
+        self._subscribers = set()
+        self._subscribers_lock = threading.Lock()
+        self._annotations = []
+        self._annotations_lock = threading.Lock()
+
+        self.capture_rate = RateMeter()
+        self.inference_rate = RateMeter()
+        self.stream_rate = RateMeter()
+        self._latencies_ms = collections.deque(maxlen=300)
+        self._inference_ms = collections.deque(maxlen=100)
+        self._inference_lag_ms = collections.deque(maxlen=100)
+
+    @property
+    def running(self):
+        return bool(self._threads) and not self._stop.is_set()
+
+    def open(self):
+        """Open the source; returns False if it cannot be opened"""
+        self._capture = cv2.VideoCapture(self.source)
+        return self._capture.isOpened()
+
+    def start(self):
+        if self._capture is None and not self.open():
+            return False
+        self._stop.clear()
+        self._threads = [
+            threading.Thread(target=self._capture_loop, name='live-capture', daemon=True),
+            threading.Thread(target=self._encode_loop, name='live-encode', daemon=True)
+        ]
+        for thread in self._threads:
+            thread.start()
+        self.scheduler.register(self, self.weight)
+        return True
+
+    def stop(self):
+        self._stop.set()
+        self.scheduler.unregister(self)
+        if self._owns_scheduler:
+            self.scheduler.stop()
+        for thread in self._threads:
+            thread.join(timeout=2.0)
+        self._threads = []
+        if self._capture is not None:
+            self._capture.release()
+            self._capture = None
+
+    def _capture_loop(self):
+        fps = self._capture.get(cv2.CAP_PROP_FPS) if self.realtime else 0
+        frame_interval = 1.0 / fps if fps and fps > 0 else 0.0
+        next_frame = time.monotonic()
+        while not self._stop.is_set():
+            success, frame = self._capture.read()
+            if not success and self.loop and is_file_source(self.source):
+                self._capture.set(cv2.CAP_PROP_POS_FRAMES, 0)
+                # Tracks do not survive the jump back; reset on the inference side
+                self._rewound = True
+                success, frame = self._capture.read()
+            if not success:
+                logger.warning("Failed to read frame from source %s", self.name)
+                self._stop.set()
+                break
+            if frame_interval:
+                # Replay files at their own frame rate, like a camera would deliver them
+                next_frame += frame_interval
+                delay = next_frame - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+                else:
+                    next_frame = time.monotonic()
+            captured_at = time.monotonic()
+            self.capture_rate.tick(captured_at)
+            self._inference_queue.put((captured_at, frame))
+            self.scheduler.notify()
+            self._encode_queue.put((captured_at, frame))
+
+    def has_frame(self):
+        return not self._stop.is_set() and len(self._inference_queue) > 0
+
+    def run_inference(self):
+        """Run the tracker on the newest waiting frame (called by the scheduler)"""
+        item = self._inference_queue.get(timeout=0)
+        if item is None:
+            return
+        captured_at, frame = item
+        if self._rewound:
+            self._rewound = False
+            self.tracker.reset()
+        start = time.perf_counter()
+        tracks = self.tracker.process(frame, self.get_matcher())
+        annotations = [(track.box, track.student_id, track.confidence) for track in tracks]
+        with self._annotations_lock:
+            self._annotations = annotations
+        elapsed = time.perf_counter() - start
+        self._inference_ms.append(elapsed * 1000)
+        STAGE_SECONDS.observe(elapsed, endpoint='live', stage='inference')
+        # Lag: how old the frame was when its annotations became visible
+        self._inference_lag_ms.append((time.monotonic() - captured_at) * 1000)
+        self.inference_rate.tick()
+
+    def _encode_loop(self):
+        params = [int(cv2.IMWRITE_JPEG_QUALITY), self.jpeg_quality]
+        while not self._stop.is_set():
+            item = self._encode_queue.get(timeout=0.5)
+            if item is None:
+                continue
+            captured_at, frame = item
+            with self._annotations_lock:
+                annotations = self._annotations
+            # Draw on a copy: the inference thread may still be reading this frame
+            start = time.perf_counter()
+            annotated = draw_annotations(frame.copy(), annotations)
+            ok, buffer = cv2.imencode('.jpg', annotated, params)
+            STAGE_SECONDS.observe(time.perf_counter() - start, endpoint='live', stage='jpeg_encode')
+            if ok:
+                jpeg = buffer.tobytes()
+                with self._subscribers_lock:
+                    subscribers = list(self._subscribers)
+                for queue in subscribers:
+                    queue.put((captured_at, jpeg))
+
+    def subscribe(self):
+        """Output queue receiving every encoded frame (slow readers drop the oldest)"""
+        queue = DropOldestQueue(2)
+        with self._subscribers_lock:
+            self._subscribers.add(queue)
+        return queue
+
+    def unsubscribe(self, queue):
+        with self._subscribers_lock:
+            self._subscribers.discard(queue)
+
+    @property
+    def subscriber_count(self):
+        with self._subscribers_lock:
+            return len(self._subscribers)
+
+    def frames(self, queue=None):
+        """Yield JPEG bytes from a subscription until the pipeline stops or unsubscribes"""
+        queue = queue or self.subscribe()
+        while not self._stop.is_set():
+            with self._subscribers_lock:
+                if queue not in self._subscribers:
+                    break
+            item = queue.get(timeout=0.5)
+            if item is None:
+                continue
+            captured_at, jpeg = item
+            self._latencies_ms.append((time.monotonic() - captured_at) * 1000)
+            self.stream_rate.tick()
+            yield jpeg
+
+    async def aframes(self, queue):
+        """Async frames(): waits on the event loop instead of a thread"""
+        loop = asyncio.get_running_loop()
+        ready = asyncio.Event()
+
+        def wake():
+            try:
+                loop.call_soon_threadsafe(ready.set)
+            except RuntimeError:
+                # Event loop already closed
+                pass
+
+        queue.listener = wake
+        try:
+            while not self._stop.is_set():
+                with self._subscribers_lock:
+                    if queue not in self._subscribers:
+                        break
+                # Clear before polling so a put in between still wakes the wait below
+                ready.clear()
+                item = queue.get(timeout=0)
+                if item is None:
+                    try:
+                        await asyncio.wait_for(ready.wait(), 0.5)
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+                captured_at, jpeg = item
+                self._latencies_ms.append((time.monotonic() - captured_at) * 1000)
+                self.stream_rate.tick()
+                yield jpeg
+        finally:
+            queue.listener = None
+
+    def stats(self):
+        latencies = np.asarray(self._latencies_ms) if self._latencies_ms else None
+        return {
+            'source': str(self.source),
+            'name': self.name,
+            'running': self.running,
+            'capture_fps': self.capture_rate.rate(),
+            'inference_fps': self.inference_rate.rate(),
+            'stream_fps': self.stream_rate.rate(),
+            'inference_ms_avg': round(float(np.mean(self._inference_ms)), 2) if self._inference_ms else None,
+            'inference_lag_ms_avg': round(float(np.mean(self._inference_lag_ms)), 2) if self._inference_lag_ms else None,
+            'latency_ms_p50': round(float(np.percentile(latencies, 50)), 2) if latencies is not None else None,
+            'latency_ms_p95': round(float(np.percentile(latencies, 95)), 2) if latencies is not None else None,
+            'subscribers': self.subscriber_count,
+            'dropped': {
+                'inference': self._inference_queue.dropped,
+                'encode': self._encode_queue.dropped
+            },
+            'tracker': dict(self.tracker.stats)
+        }
@@ -0,0 +1,27 @@
+import os
+import sys
+
+import pytest
+
+ENGINE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ENGINE_DIR)
+
+
+@pytest.fixture(scope='session')
+def engine_dir(tmp_path_factory):
+    """Empty working directory for importing server.py (fresh store, no live sources file)"""
+    workdir = tmp_path_factory.mktemp('engine')
+    os.environ['CV_ENCODING_CACHE_SIZE'] = '0'
+    os.environ['CV_LIVE_SOURCES'] = str(workdir / 'live_sources.json')
+    os.environ.setdefault('CV_LOG_LEVEL', 'WARNING')
+    return workdir
+
+
+@pytest.fixture(scope='session')
+def server(engine_dir):
+    # The store and upload folders are relative paths, so stay in the directory while tests run
+    cwd = os.getcwd()
+    os.chdir(engine_dir)
+    import server
+    yield server
+    os.chdir(cwd)
@@ -0,0 +1,68 @@
+import numpy as np
+
+from ann_index import IVFIndex
+from matcher import GalleryMatcher
+
+
+def gallery(seed, size):
+    rng = np.random.default_rng(seed)
+    encodings = rng.normal(size=(size, 128)).astype(np.float32)
+    encodings /= np.linalg.norm(encodings, axis=1, keepdims=True)
+    return encodings, [f's{seed}-{i}' for i in range(size)]
+
+
+def bucket_of(lists):
+    buckets = np.empty(len(lists.rows), dtype=np.int64)
+    for i in range(len(lists.offsets) - 1):
+        buckets[lists.rows[lists.offsets[i]:lists.offsets[i + 1]]] = i
+    return buckets
+
+
+def test_update_assigns_only_changed_rows(monkeypatch):
+    encodings, keys = gallery(0, 2000)
+    index = IVFIndex(min_index_size=0)
+    index.update(encodings, keys=keys)
+    centroids = index.centroids
+
+    assigned = []
+    original = IVFIndex.assign
+    monkeypatch.setattr(IVFIndex, 'assign', staticmethod(lambda m, c: assigned.append(len(m)) or original(m, c)))
+
+    added, added_keys = gallery(1, 5)
+    # Drop ten rows, add five, keep the rest in a different order
+    matrix = np.concatenate([added, encodings[10:][::-1]])
+    row_keys = added_keys + keys[10:][::-1]
+    lists = index.update(matrix, keys=row_keys)
+
+    assert assigned == [5]
+    assert index.centroids is centroids
+    expected = IVFIndex.assign(matrix, centroids)
+    assert np.array_equal(bucket_of(lists), expected)
+
+
+def test_needs_training_when_a_list_outgrows_its_trained_size():
+    encodings, keys = gallery(2, 2000)
+    index = IVFIndex(min_index_size=0)
+    index.update(encodings, keys=keys)
+    assert not index.needs_training(len(encodings))
+
+    # Pile new rows next to one centroid; the gallery size stays within RETRAIN_FACTOR
+    rng = np.random.default_rng(3)
+    crowd = index.centroids[0] + 0.01 * rng.normal(size=(3 * index.trained_max_list, 128)).astype(np.float32)
+    index.update(np.concatenate([encodings, crowd]), keys=keys + [f'c{i}' for i in range(len(crowd))], train=False)
+    assert index.needs_training(len(encodings) + len(crowd))
+
+
+def test_background_training_serves_exact_search_until_ready():
+    encodings, student_ids = gallery(4, 3000)
+    matcher = GalleryMatcher(encodings, student_ids, index=IVFIndex(min_index_size=0), background_training=True)
+    assert matcher.snapshot.index_lists is None
+    assert matcher.match(encodings[:1])[0][0]['student_id'] == student_ids[0]
+
+    matcher._training.join()
+    added, added_ids = gallery(5, 3)
+    matcher.set_gallery(np.concatenate([encodings, added]), student_ids + added_ids)
+
+    assert matcher.snapshot.index_lists is not None
+    assert matcher._training is None
+    assert matcher.match(added[:1])[0][0]['student_id'] == added_ids[0]
@@ -0,0 +1,85 @@
+import asyncio
+
+import pytest
+
+
+class FakeSubscription:
+    def __init__(self, log):
+        self.log = log
+
+    async def aframes(self):
+        self.log.append('started')
+        # A camera that has not produced its first frame yet
+        await asyncio.Event().wait()
+        yield b'frame'
+
+
+class FakeBroker:
+    name = 'fake'
+
+    def __init__(self):
+        self.generator_log = []
+        self.subscribed = []
+        self.unsubscribed = []
+
+    def subscribe(self, course_id=None, student_ids=None):
+        subscription = FakeSubscription(self.generator_log)
+        self.subscribed.append(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        self.unsubscribed.append(subscription)
+
+
+@pytest.fixture
+def asgi(server, monkeypatch):
+    import asgi
+    broker = FakeBroker()
+    monkeypatch.setattr(server.live_sources, 'get', lambda name=None: broker)
+    monkeypatch.setattr(server, 'resolve_matcher', lambda params: (object(), None))
+    asgi.broker = broker
+    return asgi
+
+
+def live_scope(spec_version):
+    return {
+        'type': 'http', 'asgi': {'version': '3.0', 'spec_version': spec_version},
+        'http_version': '1.1', 'method': 'GET', 'scheme': 'http', 'path': '/api/attendance/live',
+        'raw_path': b'/api/attendance/live', 'query_string': b'', 'root_path': '',
+        'headers': [], 'client': ('127.0.0.1', 1234), 'server': ('127.0.0.1', 5001),
+    }
+
+
+def call(app, scope, send):
+    async def receive():
+        return {'type': 'http.disconnect'}
+
+    async def run():
+        await asyncio.wait_for(app(scope, receive, send), 5)
+
+    asyncio.run(run())
+
+
+def test_live_feed_unsubscribes_when_client_disconnects_before_first_frame(asgi):
+    async def send(message):
+        # Still sending the headers when the disconnect arrives
+        await asyncio.Event().wait()
+
+    call(asgi.app, live_scope('2.3'), send)
+
+    broker = asgi.broker
+    assert broker.generator_log == []
+    assert len(broker.subscribed) == 1
+    assert broker.unsubscribed == broker.subscribed
+
+
+def test_live_feed_unsubscribes_when_send_fails(asgi):
+    async def send(message):
+        # ASGI 2.4 servers report a gone client by raising from send()
+        raise OSError('client disconnected')
+
+    with pytest.raises(Exception):
+        call(asgi.app, live_scope('2.4'), send)
+
+    broker = asgi.broker
+    assert broker.unsubscribed == broker.subscribed
@@ -0,0 +1,81 @@
+import json
+
+import requests
+
+from attendance_dispatcher import AttendanceDispatcher
+
+
+class FakeSession:
+    """Answers posts from a switchable backend and records what was sent"""
+
+    def __init__(self, dispatcher=None):
+        self.up = False
+        self.posted = []
+        self.lock_held = []
+        self.on_post = None
+        self.dispatcher = dispatcher
+
+    def post(self, url, json=None, timeout=None):
+        self.posted.append(json)
+        self.lock_held.append(self.dispatcher._lock.locked())
+        if self.on_post:
+            self.on_post(json)
+        if not self.up:
+            raise requests.ConnectionError('backend down')
+        response = requests.Response()
+        response.status_code = 200
+        return response
+
+
+def make_dispatcher(tmp_path):
+    session = FakeSession()
+    dispatcher = AttendanceDispatcher('http://backend', spool_path=str(tmp_path / 'spool.jsonl'),
+                                      max_retries=0, session=session)
+    session.dispatcher = dispatcher
+    return dispatcher, session
+
+
+def spooled(dispatcher):
+    with open(dispatcher.spool_path) as f:
+        return [json.loads(line)['studentIds'] for line in f]
+
+
+def test_spool_is_not_replayed_while_the_backend_is_down(tmp_path):
+    dispatcher, session = make_dispatcher(tmp_path)
+
+    assert not dispatcher.send(['s1'], 'c1')
+    assert not dispatcher.send(['s2'], 'c1')
+
+    # One attempt per batch, no replay of the spooled one in between
+    assert [p['studentIds'] for p in session.posted] == [['s1'], ['s2']]
+    assert spooled(dispatcher) == [['s1'], ['s2']]
+
+
+def test_spool_is_replayed_once_after_a_delivery_without_holding_the_lock(tmp_path):
+    dispatcher, session = make_dispatcher(tmp_path)
+    dispatcher.send(['s1'], 'c1')
+    dispatcher.send(['s2'], 'c1')
+    session.posted.clear()
+    session.lock_held.clear()
+
+    session.up = True
+    assert dispatcher.send(['s3'], 'c1')
+
+    assert [p['studentIds'] for p in session.posted] == [['s3'], ['s1'], ['s2']]
+    assert not any(session.lock_held)
+    assert not (tmp_path / 'spool.jsonl').exists()
+
+
+def test_batches_spooled_during_a_replay_are_kept(tmp_path):
+    dispatcher, session = make_dispatcher(tmp_path)
+    dispatcher.send(['s1'], 'c1')
+    session.up = True
+
+    def spool_once(payload):
+        if payload['studentIds'] == ['s1']:
+            session.on_post = None
+            dispatcher._spool({'studentIds': ['late'], 'courseId': 'c1', 'confidence': 0.9})
+
+    session.on_post = spool_once
+    assert dispatcher.replay_spool() == 1
+    assert spooled(dispatcher) == [['late']]
@@ -0,0 +1,93 @@
+import multiprocessing
+import threading
+
+import numpy as np
+
+from embedding_store import EmbeddingStore
+
+
+def test_snapshot_stays_aligned_during_writes(tmp_path):
+    store = EmbeddingStore(str(tmp_path / 'store'))
+    rng = np.random.default_rng(0)
+    store.add_many([f's{i}' for i in range(20)], rng.normal(size=(20, 128)))
+    errors = []
+    stop = threading.Event()
+
+    def read():
+        while not stop.is_set():
+            matrix, student_ids = store.snapshot()
+            if len(matrix) != len(student_ids):
+                errors.append((len(matrix), len(student_ids)))
+                stop.set()
+
+    reader = threading.Thread(target=read)
+    reader.start()
+    for i in range(300):
+        if stop.is_set():
+            break
+        store.add_sample(f's{i % 7}', rng.normal(size=128), max_samples=3)
+        if i % 5 == 0:
+            store.remove(f's{i % 20}')
+    stop.set()
+    reader.join()
+
+    assert errors == []
+    matrix, student_ids = store.snapshot()
+    assert len(matrix) == len(student_ids) == len(store)
+
+
+def test_enrollments_after_a_torn_journal_line_survive_a_restart(tmp_path):
+    path = str(tmp_path / 'store')
+    store = EmbeddingStore(path)
+    store.add_many(['a', 'b'], np.eye(2, 128))
+    # A crash in the middle of writing the next journal entry
+    with open(store._journal_path(), 'a') as f:
+        f.write('{"op": "add", "row": 2, "i')
+
+    store = EmbeddingStore(path)
+    assert store.student_ids == ['a', 'b']
+    store.add('c', np.ones(128))
+    store.add('d', np.ones(128))
+
+    store = EmbeddingStore(path)
+    assert store.student_ids == ['a', 'b', 'c', 'd']
+    assert np.array_equal(store.encodings_for('c'), np.ones((1, 128), dtype=np.float32))
+
+
+def test_two_store_handles_append_after_each_other(tmp_path):
+    path = str(tmp_path / 'store')
+    first, second = EmbeddingStore(path), EmbeddingStore(path)
+
+    first.add('a', np.full(128, 1.0))
+    second.add('b', np.full(128, 2.0))
+    first.add('c', np.full(128, 3.0))
+
+    store = EmbeddingStore(path)
+    assert store.student_ids == ['a', 'b', 'c']
+    assert [float(v[0]) for v in store.matrix()] == [1.0, 2.0, 3.0]
+
+
+def _add_rows(path, prefix, count):
+    store = EmbeddingStore(path)
+    for i in range(count):
+        store.add_sample(f'{prefix}{i % 5}', np.full(128, float(i)), max_samples=3)
+
+
+def test_concurrent_writer_processes_keep_the_store_consistent(tmp_path):
+    path = str(tmp_path / 'store')
+    EmbeddingStore(path).add('seed', np.zeros(128))
+    context = multiprocessing.get_context('spawn')
+    writers = [context.Process(target=_add_rows, args=(path, prefix, 40)) for prefix in ('p', 'q')]
+    for writer in writers:
+        writer.start()
+    for writer in writers:
+        writer.join()
+        assert writer.exitcode == 0
+
+    store = EmbeddingStore(path)
+    matrix, student_ids = store.snapshot()
+    assert sorted(set(student_ids)) == ['p0', 'p1', 'p2', 'p3', 'p4', 'q0', 'q1', 'q2', 'q3', 'q4', 'seed']
+    for prefix in ('p', 'q'):
+        for k in range(5):
+            # Each student keeps its three newest samples, whichever process wrote them
+            assert [float(v[0]) for v in store.encodings_for(f'{prefix}{k}')] == [25.0 + k, 30.0 + k, 35.0 + k]
@@ -0,0 +1,62 @@
+import threading
+
+import numpy as np
+import pytest
+
+from matcher import CourseGalleries, GalleryMatcher
+
+
+def gallery(seed, size, prefix, samples=1):
+    rng = np.random.default_rng(seed)
+    encodings = rng.normal(size=(size * samples, 128)).astype(np.float32)
+    encodings /= np.linalg.norm(encodings, axis=1, keepdims=True)
+    return encodings, [f'{prefix}{i % size}' for i in range(size * samples)]
+
+
+def test_failed_update_keeps_the_published_gallery():
+    encodings, student_ids = gallery(0, 10, 'a')
+    matcher = GalleryMatcher(encodings, student_ids)
+    snapshot = matcher.snapshot
+
+    with pytest.raises(ValueError):
+        matcher.set_gallery(encodings, student_ids[:-1])
+
+    assert matcher.snapshot is snapshot
+    assert matcher.match(encodings[:1])[0][0]['student_id'] == 'a0'
+
+
+def test_queries_never_mix_old_and_new_gallery():
+    # Different sizes and sample counts, so mixing derived arrays would fail or misattribute
+    small = gallery(1, 50, 'a')
+    large = gallery(2, 400, 'b', samples=3)
+    queries = np.concatenate([small[0][:4], large[0][:4]])
+    matcher = GalleryMatcher(*small)
+    course_galleries = CourseGalleries(matcher)
+    errors = []
+    stop = threading.Event()
+
+    def read():
+        try:
+            while not stop.is_set():
+                for face in matcher.match(queries, k=2):
+                    assert len({candidate['student_id'][0] for candidate in face}) == 1
+                for face in matcher.candidate_distances(queries[:1], [['a0', 'b0']]):
+                    assert len(face) == 1
+                view = course_galleries.view(student_ids=['a1', 'b1'])
+                assert len(view) in (1, 3)
+        except Exception as e:
+            errors.append(e)
+            stop.set()
+
+    readers = [threading.Thread(target=read) for _ in range(4)]
+    for reader in readers:
+        reader.start()
+    for i in range(200):
+        if stop.is_set():
+            break
+        matcher.set_gallery(*(large if i % 2 == 0 else small))
+    stop.set()
+    for reader in readers:
+        reader.join()
+
+    assert errors == []
@@ -0,0 +1,61 @@
+import io
+import json
+
+import numpy as np
+import pytest
+
+rng = np.random.default_rng(0)
+
+
+@pytest.fixture
+def client(server, monkeypatch):
+    def fake_detect(image_bytes):
+        # Random unit vectors are ~1.4 apart, so no upload looks like a duplicate
+        encoding = rng.normal(size=128)
+        faces = [{'encoding': encoding / np.linalg.norm(encoding), 'coordinates': (0, 10, 10, 0)}]
+        return (10, 10, 3), faces, {}
+
+    monkeypatch.setattr(server, 'detect_upload', fake_detect)
+    monkeypatch.setattr(server, 'save_processed_face', lambda name, image_bytes, coordinates: None)
+    return server.app.test_client()
+
+
+def enroll_bulk(client, student_ids, **form):
+    data = {'photos': [(io.BytesIO(b'photo'), f'{student_id}.jpg') for student_id in student_ids], **form}
+    response = client.post('/enroll-bulk', data=data, content_type='multipart/form-data')
+    return [json.loads(line) for line in response.get_data(as_text=True).splitlines()][-1]
+
+
+def test_enroll_bulk_adds_samples_by_default(server, client):
+    server.embedding_store.add_many(['BULK1', 'BULK1'], np.eye(2, 128))
+
+    summary = enroll_bulk(client, ['BULK1', 'BULK2'])
+
+    assert summary['enrolled_ids'] == ['BULK1', 'BULK2']
+    assert len(server.embedding_store.encodings_for('BULK1')) == 3
+    assert len(server.embedding_store.encodings_for('BULK2')) == 1
+    assert server.gallery_matcher.student_ids.count('BULK1') == 3
+
+
+def test_enroll_bulk_keeps_at_most_max_samples(server, client):
+    for _ in range(server.MAX_SAMPLES_PER_STUDENT + 2):
+        enroll_bulk(client, ['BULK3'])
+
+    assert len(server.embedding_store.encodings_for('BULK3')) == server.MAX_SAMPLES_PER_STUDENT
+
+
+def test_enroll_bulk_replace_drops_previous_samples(server, client):
+    server.embedding_store.add_many(['BULK4', 'BULK4'], np.eye(2, 128))
+
+    enroll_bulk(client, ['BULK4'], replace='true')
+
+    assert len(server.embedding_store.encodings_for('BULK4')) == 1
+
+
+@pytest.mark.parametrize('endpoint', ['/verify', '/enroll', '/enroll-from-camera', '/test-face-detection'])
+def test_undecodable_upload_is_a_bad_request(server, endpoint):
+    data = {'photo': (io.BytesIO(b'not an image'), 'photo.jpg'), 'student_id': 'BAD1'}
+    response = server.app.test_client().post(endpoint, data=data, content_type='multipart/form-data')
+
+    assert response.status_code == 400
+    assert response.get_json() == {'success': False, 'message': 'Could not read uploaded image'}
@@ -0,0 +1,48 @@
+import numpy as np
+
+import tracking
+from tracking import FaceTracker
+
+BOX = (40, 30, 80, 80)
+
+
+class FakeMatcher:
+    def match(self, encodings, k=1):
+        return [[{'student_id': 'S1', 'distance': 0.3}, {'student_id': 'S2', 'distance': 0.55}] for _ in encodings]
+
+    def candidate_distances(self, encodings, candidates):
+        return [{'S1': 0.3, 'S2': 0.55} for _ in encodings]
+
+
+def run(monkeypatch, frames, **kwargs):
+    """Frame indices at which the single face in view was encoded, and the frame it was confirmed"""
+    encoded = []
+    monkeypatch.setattr(tracking, 'locate_faces', lambda rgb: [(BOX[1], BOX[0] + BOX[2], BOX[1] + BOX[3], BOX[0])])
+
+    def fake_encodings(rgb, locations):
+        encoded.extend([tracker.frame_index] * len(locations))
+        return [np.zeros(128, dtype=np.float32) for _ in locations]
+
+    monkeypatch.setattr(tracking, 'face_encodings', fake_encodings)
+    tracker = FaceTracker(**kwargs)
+    frame = np.zeros((160, 160, 3), dtype=np.uint8)
+    confirmed_at = None
+    for _ in range(frames):
+        track, = tracker.process(frame, FakeMatcher())
+        if confirmed_at is None and track.student_id == 'S1':
+            confirmed_at = tracker.frame_index
+    return encoded, confirmed_at
+
+
+def test_voting_tracks_are_observed_every_vote_every_frames_between_detections(monkeypatch):
+    encoded, confirmed_at = run(monkeypatch, 12, detect_every=5, tracker='iou', min_votes=3, vote_every=2)
+
+    assert encoded[:3] == [0, 2, 4]
+    assert confirmed_at == 4
+
+
+def test_confirmed_tracks_are_not_re_encoded_from_stale_boxes(monkeypatch):
+    encoded, _ = run(monkeypatch, 30, detect_every=5, tracker='iou', min_votes=3, vote_every=2)
+
+    # Voting ends at frame 4; the confident identity then decays slowly and is reused
+    assert encoded == [0, 2, 4]
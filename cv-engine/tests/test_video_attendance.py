@@ -0,0 +1,36 @@
+import pickle
+
+import cv2
+import numpy as np
+
+import video_attendance
+from embedding_store import EmbeddingStore
+
+
+def write_legacy_pickle(path):
+    with open(path, 'wb') as f:
+        pickle.dump({'encodings': [np.full(128, 0.05)], 'student_ids': ['legacy1']}, f)
+
+
+def test_worker_does_not_import_the_legacy_pickle_or_build_a_dispatcher(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    write_legacy_pickle('student_embeddings.pkl')
+
+    video_attendance._init_worker(str(tmp_path / 'store'))
+
+    assert video_attendance._system.store.student_ids == []
+    assert video_attendance._system._dispatcher is None
+
+
+def test_process_video_imports_the_legacy_pickle_in_the_parent(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    write_legacy_pickle('student_embeddings.pkl')
+    writer = cv2.VideoWriter('lecture.avi', cv2.VideoWriter_fourcc(*'MJPG'), 5, (64, 48))
+    for _ in range(10):
+        writer.write(np.zeros((48, 64, 3), dtype=np.uint8))
+    writer.release()
+
+    report = video_attendance.process_video('lecture.avi', embeddings_dir='store', workers=2)
+
+    assert report['students'] == []
+    assert EmbeddingStore('store').student_ids == ['legacy1']
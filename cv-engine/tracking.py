@@ -0,0 +1,299 @@
+"""
+Track-then-recognize pipeline for live video.
+
+Faces are detected every `detect_every` frames. Detections are associated
+with existing tracks by IoU, and between detections each track is carried
+forward either as-is ('iou' mode, zero cost) or by an OpenCV single-object
+tracker ('kcf', 'csrt', 'mil' when the build provides it).
+
+Identity is decided per track from several frames rather than one. Each
+observation of a track's face is folded into IdentityEvidence, an
+exponential moving average of the distance to each of a few candidate
+students; the track takes an identity only once it has `min_votes`
+observations, the best average is within tolerance and it leads the runner-up
+by `vote_margin`. Only a track's first observation (or one whose candidates
+all fell out of tolerance) scans the whole gallery; later ones re-score just
+the candidates (GalleryMatcher.candidate_distances).
+
+A face is encoded while its track is still voting (every `vote_every`
+frames; in 'iou' mode from the box of the last detection), when a confirmed
+identity's confidence has decayed below `reidentify_below`, or (for unknown
+faces) every `retry_unknown_every` frames. Per-frame cost therefore depends
+on how many faces change rather than on how many are in view.
+"""
+import itertools
+import os
+
+import cv2
+
+from face_pipeline import face_encodings, locate_faces
+from matcher import distance_to_confidence
+
+LIVE_DETECT_EVERY = int(os.environ.get('CV_LIVE_DETECT_EVERY', 5))
+LIVE_TRACKER = os.environ.get('CV_LIVE_TRACKER', 'iou')
+LIVE_MIN_VOTES = int(os.environ.get('CV_LIVE_MIN_VOTES', 3))
+LIVE_VOTE_EVERY = int(os.environ.get('CV_LIVE_VOTE_EVERY', 2))
+LIVE_VOTE_ALPHA = float(os.environ.get('CV_LIVE_VOTE_ALPHA', 0.5))
+LIVE_VOTE_MARGIN = float(os.environ.get('CV_LIVE_VOTE_MARGIN', 0.05))
+# Candidate students kept per track
+VOTE_CANDIDATES = 3
+
+
+def iou(box_a, box_b):
+    """Intersection over union of two (x, y, w, h) boxes"""
+    ax, ay, aw, ah = box_a
+    bx, by, bw, bh = box_b
+    inter_w = min(ax + aw, bx + bw) - max(ax, bx)
+    inter_h = min(ay + ah, by + bh) - max(ay, by)
+    if inter_w <= 0 or inter_h <= 0:
+        return 0.0
+    inter = inter_w * inter_h
+    return inter / float(aw * ah + bw * bh - inter)
+
+
+def create_cv_tracker(kind):
+    """OpenCV single-object tracker by name, or None if this build lacks it"""
+    factory_names = {
+        'kcf': 'TrackerKCF_create',
+        'csrt': 'TrackerCSRT_create',
+        'mil': 'TrackerMIL_create'
+    }
+    name = factory_names.get(kind)
+    if name is None:
+        return None
+    for module in (cv2, getattr(cv2, 'legacy', None)):
+        factory = getattr(module, name, None) if module is not None else None
+        if factory is not None:
+            return factory()
+    return None
+
+
+class IdentityEvidence:
+    """Moving average of one face's distance to each of its candidate students"""
+
+    def __init__(self, tolerance, alpha=LIVE_VOTE_ALPHA, max_candidates=VOTE_CANDIDATES):
+        self.tolerance = tolerance
+        self.alpha = alpha
+        self.max_candidates = max_candidates
+        self.averages = {}
+        self.observations = 0
+
+    @property
+    def candidates(self):
+        """Candidate student IDs, most likely first"""
+        return sorted(self.averages, key=self.averages.get)
+
+    @property
+    def has_shortlist(self):
+        """Whether some candidate is still within tolerance (so a full scan can be skipped)"""
+        return any(average < self.tolerance for average in self.averages.values())
+
+    def update(self, distances):
+        """Fold in one observation ({student_id: distance})
+
+        Candidates missing from the observation count as at least `tolerance`
+        away, and so does the history of a candidate seen for the first time.
+        """
+        self.observations += 1
+        far = max([self.tolerance] + list(distances.values()))
+        for student_id in set(self.averages) | set(distances):
+            distance = distances.get(student_id, far)
+            if self.observations == 1:
+                self.averages[student_id] = distance
+            else:
+                previous = self.averages.get(student_id, self.tolerance)
+                self.averages[student_id] = previous + self.alpha * (distance - previous)
+        for student_id in self.candidates[self.max_candidates:]:
+            del self.averages[student_id]
+
+    def ranking(self):
+        """(best student ID, its average, runner-up's average) or (None, None, None)"""
+        candidates = self.candidates
+        if not candidates:
+            return None, None, None
+        runner_up = self.averages[candidates[1]] if len(candidates) > 1 else float('inf')
+        return candidates[0], self.averages[candidates[0]], runner_up
+
+
+class Track:
+    """One face followed across frames with its accumulated identity evidence"""
+
+    def __init__(self, track_id, box, frame_index, tolerance=0.6):
+        self.track_id = track_id
+        self.box = box
+        self.evidence = IdentityEvidence(tolerance)
+        # Confirmed identity only; stays None while the track is still voting
+        self.student_id = None
+        self.distance = None
+        self.confidence = 0.0
+        self.last_identified = None
+        self.last_seen = frame_index
+        self.misses = 0
+        self.cv_tracker = None
+
+    @property
+    def location(self):
+        """Box as (top, right, bottom, left) for face_recognition"""
+        x, y, w, h = self.box
+        return (y, x + w, y + h, x)
+
+    def observe(self, distances, frame_index, min_votes=LIVE_MIN_VOTES, margin=LIVE_VOTE_MARGIN):
+        """Add one frame's distances and confirm, keep or drop the identity"""
+        self.last_identified = frame_index
+        self.evidence.update(distances)
+        best, average, runner_up = self.evidence.ranking()
+
+        if best is None or average >= self.evidence.tolerance:
+            self.student_id = None
+        elif self.evidence.observations >= min_votes and runner_up - average >= margin:
+            self.student_id = best
+        elif best != self.student_id:
+            # Another student is catching up: withhold the identity until the evidence is clear again
+            self.student_id = None
+
+        if self.student_id is None:
+            self.distance = None
+            self.confidence = 0.0
+        else:
+            self.distance = average
+            self.confidence = float(distance_to_confidence(average))
+
+
+class FaceTracker:
+    """Detect periodically, track in between, and re-encode only when needed"""
+
+    def __init__(self, detect_every=LIVE_DETECT_EVERY, tracker=LIVE_TRACKER, iou_threshold=0.3,
+                 max_misses=2, confidence_decay=0.01, reidentify_below=0.5, retry_unknown_every=15,
+                 tolerance=0.6, min_votes=LIVE_MIN_VOTES, vote_every=LIVE_VOTE_EVERY, vote_margin=LIVE_VOTE_MARGIN):
+        self.detect_every = max(1, detect_every)
+        self.tracker_kind = tracker
+        self.iou_threshold = iou_threshold
+        self.max_misses = max_misses
+        self.confidence_decay = confidence_decay
+        self.reidentify_below = reidentify_below
+        self.retry_unknown_every = retry_unknown_every
+        self.tolerance = tolerance
+        self.min_votes = max(1, min_votes)
+        self.vote_every = max(1, vote_every)
+        self.vote_margin = vote_margin
+        self.tracks = []
+        self.frame_index = -1
+        self._ids = itertools.count(1)
+        # Counters for tuning: how often we detected/encoded/scanned versus reused cached identities
+        self.stats = {'frames': 0, 'detections': 0, 'encodings': 0, 'gallery_scans': 0, 'shortlist_scans': 0}
+
+    def _associate(self, boxes):
+        """Greedy IoU matching of detected boxes to tracks; returns unmatched boxes"""
+        pairs = sorted(
+            ((iou(track.box, box), t, b) for t, track in enumerate(self.tracks) for b, box in enumerate(boxes)),
+            reverse=True
+        )
+        used_tracks, used_boxes = set(), set()
+        for overlap, t, b in pairs:
+            if overlap < self.iou_threshold:
+                break
+            if t in used_tracks or b in used_boxes:
+                continue
+            used_tracks.add(t)
+            used_boxes.add(b)
+            self.tracks[t].box = boxes[b]
+            self.tracks[t].last_seen = self.frame_index
+            self.tracks[t].misses = 0
+
+        for t, track in enumerate(self.tracks):
+            if t not in used_tracks:
+                track.misses += 1
+        self.tracks = [track for track in self.tracks if track.misses <= self.max_misses]
+        return [box for b, box in enumerate(boxes) if b not in used_boxes]
+
+    def _start_cv_tracker(self, track, frame):
+        track.cv_tracker = create_cv_tracker(self.tracker_kind)
+        if track.cv_tracker is not None:
+            track.cv_tracker.init(frame, tuple(int(v) for v in track.box))
+
+    def _is_voting(self, track):
+        """Still gathering evidence for a likely identity (observed every vote_every frames)"""
+        return (track.student_id is None and track.evidence.has_shortlist
+                and track.evidence.observations < self.retry_unknown_every)
+
+    def _is_visible(self, track):
+        """Whether the track's box is current enough to encode the face in it this frame
+
+        A box is current on the frame it was detected or tracked. Without an
+        OpenCV tracker ('iou' mode) boxes only move on detection frames, so a
+        voting track also reuses the box of the last detection while it still
+        matched, otherwise vote_every could never be shorter than detect_every.
+        """
+        if track.last_seen == self.frame_index:
+            return True
+        return track.cv_tracker is None and track.misses == 0 and self._is_voting(track)
+
+    def _needs_identity(self, track):
+        if track.last_identified is None:
+            return True
+        age = self.frame_index - track.last_identified
+        if track.student_id is None:
+            return age >= (self.vote_every if self._is_voting(track) else self.retry_unknown_every)
+        return track.confidence - age * self.confidence_decay < self.reidentify_below
+
+    def process(self, frame, matcher):
+        """Update tracks for one BGR frame and return the live tracks"""
+        self.frame_index += 1
+        self.stats['frames'] += 1
+        rgb_frame = None
+
+        if self.frame_index % self.detect_every == 0:
+            rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+            boxes = [
+                (left, top, right - left, bottom - top)
+                for top, right, bottom, left in locate_faces(rgb_frame)
+            ]
+            self.stats['detections'] += 1
+            for box in self._associate(boxes):
+                self.tracks.append(Track(next(self._ids), box, self.frame_index, self.tolerance))
+            for track in self.tracks:
+                self._start_cv_tracker(track, frame)
+        else:
+            for track in self.tracks:
+                if track.cv_tracker is not None:
+                    ok, box = track.cv_tracker.update(frame)
+                    if ok:
+                        track.box = tuple(int(v) for v in box)
+                        track.last_seen = self.frame_index
+
+        pending = [track for track in self.tracks if self._is_visible(track) and self._needs_identity(track)]
+        if pending:
+            if rgb_frame is None:
+                rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+            # One encoder call for every face that needs it
+            encodings = face_encodings(rgb_frame, [track.location for track in pending])
+            self.stats['encodings'] += len(encodings)
+            observations = self._score(pending, encodings, matcher)
+            for track, distances in zip(pending, observations):
+                track.observe(distances, self.frame_index, self.min_votes, self.vote_margin)
+
+        return self.tracks
+
+    def _score(self, tracks, encodings, matcher):
+        """{student_id: distance} per face: a gallery scan for new evidence, else the track's candidates"""
+        observations = [None] * len(tracks)
+        scan = [i for i, track in enumerate(tracks) if not track.evidence.has_shortlist]
+        if scan:
+            results = matcher.match([encodings[i] for i in scan], k=VOTE_CANDIDATES)
+            for i, candidates in zip(scan, results):
+                observations[i] = {c['student_id']: c['distance'] for c in candidates}
+            self.stats['gallery_scans'] += len(scan)
+
+        shortlisted = [i for i, distances in enumerate(observations) if distances is None]
+        if shortlisted:
+            results = matcher.candidate_distances(
+                [encodings[i] for i in shortlisted], [tracks[i].evidence.candidates for i in shortlisted]
+            )
+            for i, distances in zip(shortlisted, results):
+                observations[i] = distances
+            self.stats['shortlist_scans'] += len(shortlisted)
+        return observations
+
+    def reset(self):
+        self.tracks = []
+        self.frame_index = -1
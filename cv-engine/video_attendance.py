@@ -0,0 +1,253 @@
+"""
+Offline attendance from a recorded lecture video.
+
+The video is split into segments that are decoded and recognized in
+parallel worker processes, each running AttendanceSystem.recognize_faces on
+the frames it samples. Sampling is adaptive: after every sample the worker
+compares a small grayscale thumbnail with the last recognized frame.
+
+    - nearly identical picture  -> reuse the last result, double the interval
+    - picture changed           -> run recognition
+    - recognized students changed -> drop back to the minimum interval
+
+so static stretches (slides, an empty room) are crossed in a few large
+steps while changes are sampled densely. Samples are merged into one
+presence record per student (first seen, last seen, total seconds visible),
+and with --mark the students present for at least --min-seconds are sent to
+the backend in a single attendance call from the parent process.
+
+The embedding store is opened (and the legacy pickle imported) once in the
+parent before the workers start; workers only open it for reading.
+
+Usage:
+    python video_attendance.py lecture.mp4 --course-id CS101 --mark
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import cv2
+import numpy as np
+
+from attendance_dispatcher import AttendanceDispatcher
+from embedding_store import open_store
+from metrics import configure_logging
+
+MIN_INTERVAL = 0.5
+MAX_INTERVAL = 8.0
+# Mean absolute thumbnail difference (0-1) below which a frame counts as unchanged
+CHANGE_THRESHOLD = 0.02
+THUMBNAIL_SIZE = (64, 36)
+
+# AttendanceSystem of the current worker process
+_system = None
+
+
+def _init_worker(embeddings_dir):
+    global _system
+    from main import AttendanceSystem
+    # The parent already imported the legacy pickle
+    _system = AttendanceSystem(embeddings_dir=embeddings_dir, store=open_store(embeddings_dir, legacy_pickle=None))
+
+
+def _thumbnail(frame):
+    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+    return cv2.resize(gray, THUMBNAIL_SIZE, interpolation=cv2.INTER_AREA).astype(np.float32) / 255.0
+
+
+def video_info(video_path):
+    """(fps, frame_count) of a video file"""
+    capture = cv2.VideoCapture(video_path)
+    if not capture.isOpened():
+        raise ValueError(f'Cannot open video: {video_path}')
+    fps = capture.get(cv2.CAP_PROP_FPS) or 25.0
+    frame_count = int(capture.get(cv2.CAP_PROP_FRAME_COUNT))
+    capture.release()
+    return fps, frame_count
+
+
+def sample_segment(video_path, start_frame, end_frame, scale=0.5, min_interval=MIN_INTERVAL,
+                   max_interval=MAX_INTERVAL, change_threshold=CHANGE_THRESHOLD):
+    """Adaptively sample frames [start_frame, end_frame) and recognize faces
+
+    Returns:
+        dict: 'samples' as (seconds, {student_id: confidence}) pairs, plus
+        decode/recognition counters
+    """
+    capture = cv2.VideoCapture(video_path)
+    fps = capture.get(cv2.CAP_PROP_FPS) or 25.0
+    if start_frame:
+        capture.set(cv2.CAP_PROP_POS_FRAMES, start_frame)
+
+    samples = []
+    stats = {'decoded': 0, 'skipped': 0, 'recognized': 0}
+    frame_index = start_frame
+    interval = min_interval
+    last_thumbnail = None
+    last_students = None
+
+    while frame_index < end_frame:
+        ok, frame = capture.read()
+        if not ok:
+            break
+        stats['decoded'] += 1
+        thumbnail = _thumbnail(frame)
+
+        if last_thumbnail is not None and float(np.mean(np.abs(thumbnail - last_thumbnail))) < change_threshold:
+            students = last_students
+            interval = min(interval * 2, max_interval)
+        else:
+            recognized = _system.recognize_faces(frame, scale=scale)
+            stats['recognized'] += 1
+            students = {}
+            for student in recognized:
+                confidence = float(student['confidence'])
+                students[student['student_id']] = max(confidence, students.get(student['student_id'], 0.0))
+            if last_students is not None and set(students) != set(last_students):
+                interval = min_interval
+            last_thumbnail = thumbnail
+        last_students = students
+        samples.append((frame_index / fps, students))
+
+        # grab() advances without converting the skipped frames
+        step = max(1, int(round(interval * fps)))
+        skip = min(step - 1, end_frame - frame_index - 1)
+        for _ in range(max(0, skip)):
+            if not capture.grab():
+                break
+            stats['skipped'] += 1
+        frame_index += step
+
+    capture.release()
+    stats['samples'] = samples
+    return stats
+
+
+def aggregate_presence(samples, duration, max_gap=MAX_INTERVAL):
+    """Merge time-ordered samples into one presence record per student
+
+    Each sample stands for the time until the next one (capped at max_gap).
+    """
+    samples = sorted(samples, key=lambda sample: sample[0])
+    presence = {}
+    for i, (seconds, students) in enumerate(samples):
+        next_seconds = samples[i + 1][0] if i + 1 < len(samples) else duration
+        span = max(0.0, min(next_seconds - seconds, max_gap))
+        for student_id, confidence in students.items():
+            record = presence.setdefault(student_id, {
+                'student_id': student_id,
+                'first_seen': seconds,
+                'last_seen': seconds,
+                'total_seconds': 0.0,
+                'samples': 0,
+                'best_confidence': 0.0
+            })
+            record['last_seen'] = seconds
+            record['total_seconds'] += span
+            record['samples'] += 1
+            record['best_confidence'] = max(record['best_confidence'], confidence)
+
+    for record in presence.values():
+        for key in ('first_seen', 'last_seen', 'total_seconds', 'best_confidence'):
+            record[key] = round(record[key], 2)
+    return sorted(presence.values(), key=lambda record: record['first_seen'])
+
+
+def process_video(video_path, embeddings_dir='student_embeddings', workers=None, scale=0.5,
+                  min_interval=MIN_INTERVAL, max_interval=MAX_INTERVAL, change_threshold=CHANGE_THRESHOLD):
+    """Recognize a whole video in parallel and return the per-student presence report"""
+    start = time.perf_counter()
+    fps, frame_count = video_info(video_path)
+    duration = frame_count / fps
+    workers = workers or os.cpu_count() or 1
+    # A few more segments than workers so an early-finishing worker picks up another
+    segment_count = max(1, min(workers * 2, frame_count // max(1, int(fps * max_interval))))
+    bounds = np.linspace(0, frame_count, segment_count + 1).astype(int)
+    # Create or migrate the store here, not in every worker at once
+    open_store(embeddings_dir)
+
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context,
+                             initializer=_init_worker, initargs=(embeddings_dir,)) as executor:
+        futures = [
+            executor.submit(sample_segment, video_path, int(bounds[i]), int(bounds[i + 1]), scale,
+                            min_interval, max_interval, change_threshold)
+            for i in range(segment_count)
+        ]
+        results = [future.result() for future in futures]
+
+    samples = [sample for result in results for sample in result['samples']]
+    elapsed = time.perf_counter() - start
+    return {
+        'video': video_path,
+        'duration_seconds': round(duration, 2),
+        'processing_seconds': round(elapsed, 2),
+        'speedup': round(duration / elapsed, 2) if elapsed else None,
+        'segments': segment_count,
+        'workers': workers,
+        'frames': {
+            'total': frame_count,
+            'decoded': sum(result['decoded'] for result in results),
+            'skipped': sum(result['skipped'] for result in results),
+            'recognized': sum(result['recognized'] for result in results)
+        },
+        'students': aggregate_presence(samples, duration, max_interval)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Take attendance from a recorded lecture video')
+    parser.add_argument('video', help='Path to the lecture recording')
+    parser.add_argument('--course-id', help='Course to mark attendance for (required with --mark)')
+    parser.add_argument('--mark', action='store_true', help='Send present students to the backend')
+    parser.add_argument('--min-seconds', type=float, default=60.0,
+                        help='Minimum visible time to count a student as present (default: 60)')
+    parser.add_argument('--workers', type=int, default=None, help='Decode/recognition processes (default: CPU count)')
+    parser.add_argument('--scale', type=float, default=0.5, help='Resize factor before detection (default: 0.5)')
+    parser.add_argument('--min-interval', type=float, default=MIN_INTERVAL, help='Densest sampling interval in seconds')
+    parser.add_argument('--max-interval', type=float, default=MAX_INTERVAL, help='Sparsest sampling interval in seconds')
+    parser.add_argument('--embeddings-dir', default='student_embeddings')
+    parser.add_argument('--backend-url', default='http://localhost:5000')
+    parser.add_argument('--output', help='Write the JSON report to this file')
+    args = parser.parse_args()
+
+    if args.mark and not args.course_id:
+        parser.error('--mark requires --course-id')
+
+    report = process_video(
+        args.video, embeddings_dir=args.embeddings_dir, workers=args.workers, scale=args.scale,
+        min_interval=args.min_interval, max_interval=args.max_interval
+    )
+    present = [record['student_id'] for record in report['students'] if record['total_seconds'] >= args.min_seconds]
+    report['course_id'] = args.course_id
+    report['min_seconds'] = args.min_seconds
+    report['present'] = present
+
+    print(f"Processed {report['duration_seconds']}s of video in {report['processing_seconds']}s "
+          f"({report['speedup']}x real time)")
+    for record in report['students']:
+        marker = '*' if record['student_id'] in present else ' '
+        print(f" {marker} {record['student_id']}: first {record['first_seen']}s, last {record['last_seen']}s, "
+              f"visible {record['total_seconds']}s")
+    print(f"{len(present)} students present for at least {args.min_seconds}s")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"Report written to {args.output}")
+
+    if args.mark and present:
+        # One attendance call for the whole lecture
+        dispatcher = AttendanceDispatcher(args.backend_url)
+        if dispatcher.send(present, args.course_id):
+            print(f"Attendance marked for {len(present)} students")
+        else:
+            print(f"Backend unreachable, attendance for {len(present)} students saved to {dispatcher.spool_path}")
+
+
+if __name__ == '__main__':
+    configure_logging()
+    main()
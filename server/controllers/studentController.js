@@ -1,4 +1,5 @@
 const Student = require('../models/Student');
+const Course = require('../models/Course');
 const cvEngineService = require('../services/cvEngineService');
 
 // Get all students
@@ -157,6 +158,36 @@ exports.enrollStudent = async (req, res) => {
   }
 };
 
+// Enroll many students at once (photos named <studentId>.jpg), relaying CV engine progress as NDJSON
+exports.enrollBulk = async (req, res) => {
+  if (!req.files || req.files.length === 0) {
+    return res.status(400).json({
+      success: false,
+      message: 'No photos uploaded'
+    });
+  }
+
+  res.setHeader('Content-Type', 'application/x-ndjson');
+
+  try {
+    const summary = await cvEngineService.enrollStudentsBulk(req.files, {
+      forceEnroll: req.body.forceEnroll === 'true',
+      onProgress: (event) => res.write(JSON.stringify(event) + '\n')
+    });
+
+    if (summary.enrolled_ids && summary.enrolled_ids.length) {
+      await Student.updateMany(
+        { studentId: { $in: summary.enrolled_ids } },
+        { hasEnrolledFace: true }
+      );
+    }
+    res.end();
+
+  } catch (error) {
+    res.end(JSON.stringify({ event: 'error', success: false, message: error.message }) + '\n');
+  }
+};
+
 // Update student's face photo
 exports.updateStudentPhoto = async (req, res) => {
   try {
@@ -206,6 +237,25 @@ exports.updateStudentPhoto = async (req, res) => {
   }
 };
 
+// Roster for CV engine matching: explicit studentIds win, otherwise the active students of the course's
+// department, year and section. Returns null when the course does not exist.
+const resolveRoster = async ({ courseId, studentIds }) => {
+  if (!courseId || (studentIds && studentIds.length)) {
+    return { courseId, studentIds };
+  }
+  const course = await Course.findById(courseId);
+  if (!course) {
+    return null;
+  }
+  const students = await Student.find({
+    department: course.department,
+    year: course.year,
+    section: course.section,
+    isActive: true
+  }).select('studentId');
+  return { courseId, studentIds: students.map((student) => student.studentId) };
+};
+
 // Verify a face against enrolled students
 exports.verifyFace = async (req, res) => {
   try {
@@ -216,7 +266,45 @@ exports.verifyFace = async (req, res) => {
       });
     }
 
-    const verificationResult = await cvEngineService.verifyFace(req.file);
+    // Optional course scope: roster as an array, JSON string or comma-separated IDs
+    const roster = await resolveRoster(req.body);
+    if (!roster) {
+      return res.status(404).json({
+        success: false,
+        message: 'Course not found'
+      });
+    }
+
+    const verificationResult = await cvEngineService.verifyFace(req.file, roster);
+    res.json(verificationResult);
+
+  } catch (error) {
+    res.status(500).json({ 
+      success: false, 
+      message: error.message 
+    });
+  }
+};
+
+// Verify several photos (e.g. one class session) in a single CV engine call
+exports.verifyFaces = async (req, res) => {
+  try {
+    if (!req.files || req.files.length === 0) {
+      return res.status(400).json({
+        success: false,
+        message: 'No photos uploaded'
+      });
+    }
+
+    const roster = await resolveRoster(req.body);
+    if (!roster) {
+      return res.status(404).json({
+        success: false,
+        message: 'Course not found'
+      });
+    }
+
+    const verificationResult = await cvEngineService.verifyFaces(req.files, roster);
     res.json(verificationResult);
 
   } catch (error) {
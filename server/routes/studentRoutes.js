@@ -11,7 +11,9 @@ router.delete('/:id', studentController.deleteStudent);
 
 // Face recognition endpoints
 router.post('/enroll', upload.single('photo'), studentController.enrollStudent);
+router.post('/enroll-bulk', upload.array('photos', 5000), studentController.enrollBulk);
 router.put('/:id/photo', upload.single('photo'), studentController.updateStudentPhoto);
 router.post('/verify', upload.single('photo'), studentController.verifyFace);
+router.post('/verify-batch', upload.array('photos', 20), studentController.verifyFaces);
 
 module.exports = router;
\ No newline at end of file
@@ -37,7 +37,7 @@ const cvEngineService = {
     }
   },
 
-  async verifyFace(photo) {
+  async verifyFace(photo, { courseId, studentIds } = {}) {
     try {
       const formData = new FormData();
       
@@ -48,6 +48,17 @@ const cvEngineService = {
         contentType: photo.mimetype
       });
 
+      // Restrict matching to the course roster when known
+      if (courseId) {
+        formData.append('course_id', courseId);
+      }
+      // An empty array is sent too: a course without students matches nobody
+      if (Array.isArray(studentIds)) {
+        formData.append('student_ids', JSON.stringify(studentIds));
+      } else if (studentIds) {
+        formData.append('student_ids', studentIds);
+      }
+
       const response = await axios.post(`${CV_ENGINE_URL}/verify`, formData, {
         headers: {
           ...formData.getHeaders()
@@ -60,6 +71,123 @@ const cvEngineService = {
     }
   },
 
+  async verifyFaces(photos, { courseId, studentIds } = {}) {
+    try {
+      const formData = new FormData();
+
+      // All photos go to the CV engine in a single multipart request
+      photos.forEach((photo) => {
+        formData.append('photos', bufferToStream(photo.buffer), {
+          filename: photo.originalname,
+          contentType: photo.mimetype
+        });
+      });
+
+      if (courseId) {
+        formData.append('course_id', courseId);
+      }
+      // An empty array is sent too: a course without students matches nobody
+      if (Array.isArray(studentIds)) {
+        formData.append('student_ids', JSON.stringify(studentIds));
+      } else if (studentIds) {
+        formData.append('student_ids', studentIds);
+      }
+
+      const response = await axios.post(`${CV_ENGINE_URL}/verify-batch`, formData, {
+        headers: {
+          ...formData.getHeaders()
+        },
+        maxBodyLength: Infinity
+      });
+
+      return response.data;
+    } catch (error) {
+      throw new Error(`CV Engine Error: ${error.response?.data?.message || error.message}`);
+    }
+  },
+
+  // Photos must be named <studentId>.<ext>; onProgress receives each NDJSON progress event
+  async enrollStudentsBulk(photos, { forceEnroll = false, onProgress } = {}) {
+    try {
+      const formData = new FormData();
+
+      photos.forEach((photo) => {
+        formData.append('photos', bufferToStream(photo.buffer), {
+          filename: photo.originalname,
+          contentType: photo.mimetype
+        });
+      });
+      formData.append('force_enroll', forceEnroll ? 'true' : 'false');
+
+      const response = await axios.post(`${CV_ENGINE_URL}/enroll-bulk`, formData, {
+        headers: {
+          ...formData.getHeaders()
+        },
+        maxBodyLength: Infinity,
+        responseType: 'stream'
+      });
+
+      return await new Promise((resolve, reject) => {
+        let buffered = '';
+        let summary = null;
+        let failed = false;
+
+        const handleLines = (lines) => {
+          lines.filter((line) => line.trim()).forEach((line) => {
+            let event;
+            try {
+              event = JSON.parse(line);
+            } catch (error) {
+              throw new Error(`Invalid progress event from /enroll-bulk: ${line.slice(0, 200)}`);
+            }
+            if (event.event === 'done') {
+              summary = event;
+            }
+            if (onProgress) {
+              onProgress(event);
+            }
+          });
+        };
+        const fail = (error) => {
+          if (!failed) {
+            failed = true;
+            response.data.destroy();
+            reject(error);
+          }
+        };
+
+        // Decode as UTF-8 across chunk boundaries (a chunk may end mid-character)
+        response.data.setEncoding('utf8');
+        response.data.on('data', (chunk) => {
+          if (failed) {
+            return;
+          }
+          buffered += chunk;
+          const lines = buffered.split('\n');
+          buffered = lines.pop();
+          try {
+            handleLines(lines);
+          } catch (error) {
+            fail(error);
+          }
+        });
+        response.data.on('end', () => {
+          try {
+            handleLines([buffered]);
+          } catch (error) {
+            fail(error);
+          }
+          if (!failed) {
+            resolve(summary || { success: false, message: 'Bulk enrollment ended without a summary' });
+          }
+        });
+        response.data.on('error', fail);
+      });
+    } catch (error) {
+      throw new Error(`CV Engine Error: ${error.response?.data?.message || error.message}`);
+    }
+  },
+
   async deleteStudent(studentId) {
     try {
       const response = await axios.post(`${CV_ENGINE_URL}/delete-student`, {